@@ -0,0 +1,303 @@
+# Import all the necessary packages
+import sys
+import time
+import argparse
+import threading
+from datetime import datetime
+from collections import OrderedDict
+import psycopg2
+from sql_queries import load_epoch_select, plays_per_period_select, top_songs_period_select, top_artists_period_select
+from sql_queries import top_users_period_select, plays_by_hour_of_day_select, user_activity_select
+
+
+DSN = "host=127.0.0.1 dbname=sparkifydb user=student password=student"
+
+PERIODS = ('hour', 'day', 'week', 'month')
+
+
+def result_size(rows):
+    """
+    Returns the approximate memory footprint in bytes of a list of result rows.
+    """
+    return sys.getsizeof(rows) + sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows)
+
+
+class QueryCache:
+    """
+    LRU cache of query results, bounded both by number of entries and by (approximate) memory.
+
+    - The least recently used results are evicted first once `max_entries` or `max_bytes` is exceeded;
+    a result larger than `max_bytes` on its own is not cached.
+
+    - Every entry keeps the time its query took, so that the time saved by the hits can be reported.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of cached results.
+    max_bytes : int
+        Maximum total size of the cached results.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the `(rows, seconds)` cached for `key`, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            rows, seconds, size = entry
+            return rows, seconds
+
+    def put(self, key, rows, seconds):
+        """
+        Caches the result of a query that took `seconds`.
+        """
+        size = result_size(rows)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (rows, seconds, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self.bytes -= self._entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+class Analytics:
+    """
+    Common song play analytics as parameterized functions, with their results cached.
+
+    - Results are kept in a `QueryCache`, keyed by load epoch, query and parameters.
+
+    - The cache is tied to the load epoch (`load_epoch` sequence, bumped by `etl.py` after every commit of
+    loaded data): as soon as the epoch moved, every cached result is dropped, so a result is never older than
+    the last load. Reading the epoch is one cheap round trip per call, or at most one every `epoch_interval`
+    seconds if staleness for that long is acceptable.
+
+    - Counts hits, misses and invalidations, and the query time saved by the hits (see `stats`).
+
+    Parameters
+    ----------
+    conn :
+        Connection object to `sparkifydb` (preferably in autocommit mode, so every query sees the latest load).
+    max_entries : int
+        Maximum number of cached results.
+    max_bytes : int
+        Maximum total size of the cached results.
+    epoch_interval : float
+        Minimum number of seconds between two reads of the load epoch (default: every call).
+    """
+
+    def __init__(self, conn, max_entries=256, max_bytes=64 * 1024 * 1024, epoch_interval=0.0):
+        self.conn = conn
+        self.cache = QueryCache(max_entries, max_bytes)
+        self.epoch_interval = epoch_interval
+        self.epoch = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.query_seconds = 0.0
+        self.saved_seconds = 0.0
+        self._epoch_read = 0.0
+        self._lock = threading.Lock()
+
+    def current_epoch(self):
+        """
+        Reads the load epoch (at most every `epoch_interval` seconds) and drops the cache if it moved.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.epoch is not None and now - self._epoch_read < self.epoch_interval:
+                return self.epoch
+
+        with self.conn.cursor() as cur:
+            cur.execute(load_epoch_select)
+            epoch = cur.fetchone()[0]
+
+        with self._lock:
+            self._epoch_read = now
+            # the epoch only moves forward: a read that raced with a newer one is not applied
+            if self.epoch is None or epoch > self.epoch:
+                if self.epoch is not None:
+                    self.invalidations += 1
+                self.cache.clear()
+                self.epoch = epoch
+            return self.epoch
+
+    def query(self, query, params):
+        """
+        Runs `query` with `params`, or returns its cached result.
+
+        Returns
+        -------
+        list of tuple
+            Result rows.
+        """
+        # the epoch is part of the key: a result read before a load is never served after it,
+        # even if it is put in the cache once the cache was cleared
+        epoch = self.current_epoch()
+        key = (epoch, query, params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            rows, seconds = cached
+            with self._lock:
+                self.hits += 1
+                self.saved_seconds += seconds
+            return rows
+
+        start = time.perf_counter()
+        with self.conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        seconds = time.perf_counter() - start
+
+        with self._lock:
+            current = self.epoch == epoch
+        if current:
+            self.cache.put(key, rows, seconds)
+        with self._lock:
+            self.misses += 1
+            self.query_seconds += seconds
+        return rows
+
+    def plays_per_period(self, start, end, period='day'):
+        """
+        Plays per `period` ('hour', 'day', 'week' or 'month') and level between `start` (included) and `end` (excluded).
+
+        Returns
+        -------
+        list of tuple
+            `(period start, level, plays)`.
+        """
+        if period not in PERIODS:
+            raise ValueError('period must be one of {}'.format(', '.join(PERIODS)))
+        return self.query(plays_per_period_select, (period, start, end))
+
+    def top_songs(self, start, end, limit=10):
+        """
+        Most played songs between `start` and `end`, as `(song_id, title, artist name, plays)`.
+        """
+        return self.query(top_songs_period_select, (start, end, limit))
+
+    def top_artists(self, start, end, limit=10):
+        """
+        Most played artists between `start` and `end`, as `(artist_id, name, plays)`.
+        """
+        return self.query(top_artists_period_select, (start, end, limit))
+
+    def top_users(self, start, end, limit=10):
+        """
+        Most active users between `start` and `end`, as `(user_id, first_name, last_name, level, plays)`.
+        """
+        return self.query(top_users_period_select, (start, end, limit))
+
+    def plays_by_hour_of_day(self, start, end):
+        """
+        Plays per weekday and hour of the day between `start` and `end`, as `(weekday, hour, plays)`.
+        """
+        return self.query(plays_by_hour_of_day_select, (start, end))
+
+    def user_activity(self, user_id, start, end):
+        """
+        Plays and sessions per day of one user between `start` and `end`, as `(day, level, plays, sessions)`.
+        """
+        return self.query(user_activity_select, (user_id, start, end))
+
+    def stats(self):
+        """
+        Returns the cache statistics: hits, misses, hit rate, invalidations, evictions, cached entries and bytes,
+        time spent running queries and time saved by the hits (in seconds), and the current load epoch.
+        """
+        with self._lock:
+            calls = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / calls, 4) if calls else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.cache.evictions,
+                'entries': len(self.cache),
+                'bytes': self.cache.bytes,
+                'query_seconds': round(self.query_seconds, 6),
+                'saved_seconds': round(self.saved_seconds, 6),
+                'epoch': self.epoch,
+            }
+
+    def summary(self):
+        """
+        Returns a one-line report of `stats`.
+        """
+        stats = self.stats()
+        return ('{hits} hits / {misses} misses ({hit_rate:.1%}), {saved_seconds:.3f}s of queries saved '
+                '({query_seconds:.3f}s run), {invalidations} invalidations, {evictions} evictions, '
+                '{entries} results cached ({bytes} bytes), load epoch {epoch}').format(**stats)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the common song play analytics through the result cache.')
+    parser.add_argument('--start', default='2018-11-01', help='First day of the period (default: 2018-11-01).')
+    parser.add_argument('--end', default='2018-12-01', help='Day after the period (default: 2018-12-01).')
+    parser.add_argument('--top', type=int, default=5, metavar='N', help='Number of songs/artists/users (default: 5).')
+    parser.add_argument('--repeat', type=int, default=3, metavar='N',
+                        help='Run the queries N times, to show the cache at work (default: 3).')
+    parser.add_argument('--max-entries', type=int, default=256, help='Maximum number of cached results (default: 256).')
+    parser.add_argument('--max-mb', type=float, default=64, help='Maximum size of the cached results in MB (default: 64).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Runs the common queries over the period `--repeat` times (only the first run hits the database,
+    unless `etl.py` commits meanwhile).
+
+    - Prints the results and the cache statistics.
+    """
+    args = parse_args(argv)
+    start, end = datetime.strptime(args.start, '%Y-%m-%d'), datetime.strptime(args.end, '%Y-%m-%d')
+
+    conn = psycopg2.connect(DSN)
+    conn.set_session(readonly=True, autocommit=True)
+    analytics = Analytics(conn, max_entries=args.max_entries, max_bytes=int(args.max_mb * 1024 * 1024))
+
+    for _ in range(max(args.repeat, 1)):
+        results = {
+            'plays per day': analytics.plays_per_period(start, end, 'day'),
+            'top songs': analytics.top_songs(start, end, args.top),
+            'top artists': analytics.top_artists(start, end, args.top),
+            'top users': analytics.top_users(start, end, args.top),
+            'plays by weekday and hour': analytics.plays_by_hour_of_day(start, end),
+        }
+
+    for name, rows in results.items():
+        print('{} ({} rows):'.format(name, len(rows)))
+        for row in rows[:args.top]:
+            print('    ' + ', '.join(str(value) for value in row))
+    print(analytics.summary())
+
+    conn.close()
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# Import all the necessary packages
+import sys
+import time
+from etl import get_files, read_song_file, transform_song_file
+
+
+def time_reader(reader, all_files):
+    """
+    Reads every file with `reader` and returns the elapsed wall time in seconds.
+    """
+    start = time.perf_counter()
+    for datafile in all_files:
+        reader(datafile)
+
+    return time.perf_counter() - start
+
+
+def main(filepath='data/song_data', repeat=3):
+    """
+    - Compares the throughput of `transform_song_file` (one pandas DataFrame per file)
+    with `read_song_file` (plain JSON parsing into tuples) on the files of `filepath`.
+
+    - No database is needed: only the read/transform step is timed, best of `repeat` runs.
+    """
+    all_files = get_files(filepath)
+    print('{} files found in {}'.format(len(all_files), filepath))
+
+    results = {}
+    for name, reader in (('transform_song_file', transform_song_file), ('read_song_file', read_song_file)):
+        elapsed = min(time_reader(reader, all_files) for _ in range(repeat))
+        results[name] = elapsed
+        print('{:<20} {:8.3f} s  {:10.1f} files/s'.format(name, elapsed, len(all_files) / elapsed))
+
+    print('speed-up: {:.1f}x'.format(results['transform_song_file'] / results['read_song_file']))
+
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
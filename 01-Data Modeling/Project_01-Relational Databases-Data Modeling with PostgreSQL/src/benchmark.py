@@ -0,0 +1,151 @@
+# Import all the necessary packages
+import os
+import sys
+import json
+import time
+import shlex
+import argparse
+import platform
+import resource
+import subprocess
+from datetime import datetime
+import psycopg2
+import create_tables
+import etl
+
+
+BENCHMARK_TABLES = ['songplays', 'users', 'songs', 'artists', 'time']
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size (in MB) of this process and of its finished child processes
+    (e.g. the `--workers` of `etl.py`).
+    """
+    # `ru_maxrss` is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(max(own, children), 1)
+
+
+def count_rows():
+    """
+    Returns the number of rows of every table of the star schema.
+    """
+    conn = psycopg2.connect(etl.DSN)
+    cur = conn.cursor()
+    counts = {}
+    for table in BENCHMARK_TABLES:
+        cur.execute('SELECT COUNT(*) FROM {}'.format(table))
+        counts[table] = cur.fetchone()[0]
+    conn.close()
+
+    return counts
+
+
+def git_revision():
+    """
+    Returns the current git commit, so that results can be compared between versions.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(data_dir, etl_args, bulk_load=False):
+    """
+    - Recreates `sparkifydb` with `create_tables.py` (with `--bulk-load` if `bulk_load`).
+
+    - Runs `etl.py` on `data_dir` with the extra command line options `etl_args`.
+
+    - Measures the wall time of every stage, the resulting row counts, rows/sec and peak RSS.
+
+    NOTE: This drops and recreates `sparkifydb`, so only run it against a local benchmark database.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory containing `song_data` and `log_data` (e.g. generated by `generate_data.py`).
+    etl_args : list of str
+        Extra options passed to `etl.main`.
+    bulk_load : bool
+        Defers the secondary indexes until the data is loaded.
+
+    Returns
+    -------
+    dict
+        Benchmark result.
+    """
+    stages = {}
+
+    start = time.perf_counter()
+    create_tables.main(['--bulk-load'] if bulk_load else [])
+    stages['create_tables'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stages.update(etl.main(['--data-dir', data_dir] + etl_args))
+    etl_seconds = time.perf_counter() - start
+    stages['etl'] = etl_seconds
+
+    rows = count_rows()
+    total_rows = sum(rows.values())
+
+    manifest = {}
+    manifest_path = os.path.join(data_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf8') as f:
+            manifest = json.load(f)
+
+    result = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'data_dir': data_dir,
+        'dataset': manifest,
+        'etl_args': etl_args,
+        'bulk_load': bulk_load,
+        'stages_seconds': {stage: round(seconds, 3) for stage, seconds in stages.items()},
+        'rows': rows,
+        'rows_per_second': round(total_rows / etl_seconds, 1) if etl_seconds else None,
+        'songplays_per_second': round(rows['songplays'] / stages['log_data'], 1) if stages.get('log_data') else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark `create_tables.py` + `etl.py` against the local PostgreSQL.')
+    parser.add_argument('--data-dir', default='data',
+                        help='Directory containing `song_data` and `log_data` (default: data).')
+    parser.add_argument('--etl-args', default='',
+                        help='Extra options for `etl.py`, e.g. "--loader copy --song-index".')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='Run `create_tables.py --bulk-load`, so the indexes are built after the load.')
+    parser.add_argument('--label', default=None, help='Free-form label stored with the result.')
+    parser.add_argument('--output', default='benchmark_results.jsonl',
+                        help='JSON Lines file the result is appended to (default: benchmark_results.jsonl).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Runs one benchmark and appends its result as one JSON line to `--output`.
+
+    Run it once per configuration (a fresh process), so that the peak RSS is not inherited from a previous run.
+    """
+    args = parse_args(argv)
+
+    result = run_benchmark(args.data_dir, shlex.split(args.etl_args), args.bulk_load)
+    result['label'] = args.label
+
+    with open(args.output, 'a', encoding='utf8') as f:
+        f.write(json.dumps(result) + '\n')
+    print(json.dumps(result, indent=4))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 # Import all the necessary packages
+import argparse
 import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from sql_queries import create_table_queries, drop_table_queries, create_index_queries, deferred_index_queries
+from partitions import SongplayPartitions, month_range
 
 
 def create_database():
@@ -46,7 +48,38 @@ def create_tables(cur, conn):
         conn.commit()
 
 
-def main():
+def create_indexes(cur, conn, bulk_load=False):
+    """
+    Creates each index using the queries in `create_index_queries` list.
+
+    With `bulk_load`, the indexes are deferred instead (see `deferred_index_queries`):
+    `etl.py` builds them once the data is loaded, which is much cheaper than maintaining them on every insert.
+    """
+    for query in deferred_index_queries if bulk_load else create_index_queries:
+        cur.execute(query)
+        conn.commit()
+
+
+def create_partitions(cur, conn, first, last):
+    """
+    Creates the monthly partitions of `songplays` from `first` to `last` ('YYYY-MM', both included).
+    `etl.py` creates the partitions it is missing anyway, this is for loading into partitions created ahead of time.
+    """
+    partitions = SongplayPartitions("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    partitions.ensure(month_range(first, last))
+    partitions.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Recreate the sparkify database and its tables.')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='Create the tables without their secondary indexes, `etl.py` builds them after the load.')
+    parser.add_argument('--partitions', nargs=2, metavar=('FROM', 'TO'),
+                        help='Create the monthly partitions of `songplays` from FROM to TO (YYYY-MM, both included).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """
     - Drops (if exists) and Creates the sparkify database.
 
@@ -55,14 +88,20 @@ def main():
 
     - Drops all the tables.
 
-    - Creates all tables needed.
+    - Creates all tables needed, and their indexes unless `--bulk-load` is given.
+
+    - Creates the monthly partitions of `songplays` given by `--partitions`.
 
     - Finally, closes the connection.
     """
+    args = parse_args(argv)
     cur, conn = create_database()
 
     drop_tables(cur, conn)
     create_tables(cur, conn)
+    create_indexes(cur, conn, bulk_load=args.bulk_load)
+    if args.partitions:
+        create_partitions(cur, conn, *args.partitions)
 
     conn.close()
 
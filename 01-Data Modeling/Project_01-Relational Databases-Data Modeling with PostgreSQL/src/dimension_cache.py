@@ -0,0 +1,111 @@
+# Import all the necessary packages
+import threading
+from collections import OrderedDict
+
+
+class DimensionCache:
+    """
+    In-process deduplication layer for the `time` and `users` upserts, shared by all the log files of a run.
+
+    - Remembers the most recent `max_times` start times already sent (least recently seen are evicted first),
+    so a timestamp is only upserted once.
+
+    - Keeps the latest committed `(ts, level)` of every user, so a user is only upserted when first seen or when
+    their level actually changes. With one writer, the latest row by `ts` wins whatever the order the files
+    are processed in. With several writers, the cache does not see the files still in flight: the rows that reach
+    `users` are ordered by its `level_ts` guard, but a row skipped as unchanged does not move `level_ts` forward,
+    so an older row of a file written at the same time can still set the level back.
+
+    - Counts the redundant upserts that were avoided.
+
+    Usage: `filter_log_records` before writing the records of a file, `remember` once they were committed,
+    so that a file which is rolled back does not hide its rows from later files.
+
+    Parameters
+    ----------
+    max_times : int
+        Maximum number of start times kept in memory.
+    """
+
+    def __init__(self, max_times=1000000):
+        self.max_times = max_times
+        self.avoided_times = 0
+        self.avoided_users = 0
+        self._times = OrderedDict()
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def filter_log_records(self, time_df, user_df, ts):
+        """
+        Drops the time and user records that would not change the `time` and `users` tables.
+
+        Parameters
+        ----------
+        time_df, user_df : pandas.DataFrame
+            Records returned by `transform_log_file`.
+        ts : pandas.Series
+            Event timestamp of every user record (same index as `user_df`).
+
+        Returns
+        -------
+        tuple
+            `(time_df, user_df, pending)` where `pending` is to be passed to `remember` once the records are committed.
+        """
+        with self._lock:
+            start_times = time_df['start_time']
+            known_times = start_times.map(self._times.__contains__)
+            new_times = ~start_times.duplicated() & ~known_times
+            new_time_df = time_df[new_times]
+            # a hit makes the start time the most recently seen
+            for start_time in start_times[known_times]:
+                self._times.move_to_end(start_time)
+
+            # latest row of every user in this file
+            latest = user_df.assign(ts=ts).sort_values('ts', kind='stable').drop_duplicates('userId', keep='last')
+
+            keep, pending_users = [], {}
+            for user_id, level, user_ts in zip(latest['userId'], latest['level'], latest['ts']):
+                known = self._users.get(user_id)
+                newer = known is None or user_ts >= known[0]
+                if newer:
+                    pending_users[user_id] = (user_ts, level)
+                keep.append(newer and (known is None or level != known[1]))
+            new_user_df = latest[keep].drop(columns='ts')
+
+            self.avoided_times += len(time_df) - len(new_time_df)
+            self.avoided_users += len(user_df) - len(new_user_df)
+
+        return new_time_df, new_user_df, (list(new_time_df['start_time']), pending_users)
+
+    def remember(self, pending):
+        """
+        Records the time and user records returned by `filter_log_records` as committed.
+
+        Parameters
+        ----------
+        pending : tuple
+            Third element returned by `filter_log_records`.
+
+        Returns
+        -------
+        None
+        """
+        start_times, users = pending
+        with self._lock:
+            for start_time in start_times:
+                self._times[start_time] = None
+                self._times.move_to_end(start_time)
+            while len(self._times) > self.max_times:
+                self._times.popitem(last=False)
+
+            for user_id, (user_ts, level) in users.items():
+                known = self._users.get(user_id)
+                if known is None or user_ts >= known[0]:
+                    self._users[user_id] = (user_ts, level)
+
+    def summary(self):
+        """
+        Returns a one-line report of the upserts avoided so far.
+        """
+        return '{} redundant time upserts and {} redundant user upserts avoided ({} start times, {} users cached)'.format(
+            self.avoided_times, self.avoided_users, len(self._times), len(self._users))
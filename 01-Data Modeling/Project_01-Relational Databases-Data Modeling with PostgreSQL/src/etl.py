@@ -1,61 +1,260 @@
 # Import all the necessary packages
 import os
+import io
+import json
 import glob
+import hashlib
+import argparse
 import psycopg2
+import psycopg2.pool
+from psycopg2.errors import DeadlockDetected, SerializationFailure
+from psycopg2.extras import execute_values
 import pandas as pd
+from collections import deque
+from functools import partial
+from itertools import islice
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from sql_queries import *
+from song_index import SongIndex
+from dimension_cache import DimensionCache
+from partitions import SongplayPartitions, log_file_months
+from rollups import refresh_rollups
+from pipeline import Pipeline, Stage
+from metrics import Metrics, InstrumentedCursor, record, timed
 
 
-def process_song_file(cur, filepath):
+DSN = "host=127.0.0.1 dbname=sparkifydb user=student password=student"
+
+
+def read_json_file(filepath):
     """
-    - Utility function to process one JSON file from the `song_data` directory.
+    Reads the JSON records (one per line) of a `song_data` or `log_data` file into a DataFrame.
+    """
+    return pd.read_json(filepath, lines=True)
 
-    - Inserts a record into the `songs` and `artists` tables.
+
+def transform_song_file(filepath):
+    """
+    Utility function to read one JSON file from the `song_data` directory.
 
     Parameters
     ----------
-    cur :
-        Cursor object to `sparkifydb`.
     filepath : str
         Absolute path to a single data file from `song_data`.
 
     Returns
     -------
-    None
+    tuple of list
+        `(song_data, artist_data)` records for the `songs` and `artists` tables.
     """
     # open song file
-    df = pd.read_json(filepath, lines=True)
+    return transform_song_records(read_json_file(filepath))
 
-    # insert song record
+
+def transform_song_records(df):
+    """
+    Extracts the `songs` and `artists` records of a song file read by `read_json_file`.
+    """
     song_data = df[['song_id', 'title', 'artist_id', 'year', 'duration']].values[0].tolist()
+    artist_data = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']].values[0].tolist()
+
+    return song_data, artist_data
+
+
+def load_song_records(cur, song_data, artist_data, song_index=None):
+    """
+    Inserts the records of one song file into the `songs` and `artists` tables.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    song_data, artist_data : list
+        Records returned by `transform_song_file`.
+    song_index : SongIndex, optional
+        In-memory song/artist lookup index to refresh with the new song.
+
+    Returns
+    -------
+    int
+        Number of records written to the tables.
+    """
+    record(cur, 'song_records_read')
+
+    # insert song record
     cur.execute(song_table_insert, song_data)
 
     # insert artist record
-    artist_data = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']].values[0].tolist()
     cur.execute(artist_table_insert, artist_data)
 
+    if song_index is not None:
+        song_id, title, artist_id, year, duration = song_data
+        song_index.add(song_id, title, artist_id, artist_data[1], duration)
 
-def process_log_file(cur, filepath):
+    return 2
+
+
+@timed
+def process_song_file(cur, filepath, song_index=None):
     """
-    - Utility function to process one JSON file from the `log_data` directory.
+    - Utility function to process one JSON file from the `song_data` directory.
 
-    - Filters records based on the 'NextSong' page.
+    - Inserts a record into the `songs` and `artists` tables.
 
-    - Inserts record(s) into the `time`, `users` and `songplays` tables.
+    - Adds the song to `song_index` (if given) so that later songplays resolve without `song_select`.
 
     Parameters
     ----------
     cur :
         Cursor object to `sparkifydb`.
+    filepath : str
+        Absolute path to a single data file from `song_data`.
+    song_index : SongIndex, optional
+        In-memory song/artist lookup index to refresh with the new song.
+
+    Returns
+    -------
+    int
+        Number of records written to the tables.
+    """
+    return load_song_records(cur, *transform_song_file(filepath), song_index=song_index)
+
+
+def read_song_file(filepath):
+    """
+    Fast-path alternative to `transform_song_file`.
+
+    - Parses the JSON records of one `song_data` file directly into typed tuples,
+    without building a pandas DataFrame.
+
+    - Missing latitudes/longitudes become `None` (i.e. NULL) rather than NaN.
+
+    Parameters
+    ----------
+    filepath : str
+        Absolute path to a single data file from `song_data`.
+
+    Returns
+    -------
+    tuple of list
+        `(songs, artists)`: one `(song_id, title, artist_id, year, duration)` and one
+        `(artist_id, name, location, latitude, longitude)` tuple per record.
+    """
+    return song_tuples(read_json_records(filepath))
+
+
+def read_json_records(filepath):
+    """
+    Parses the JSON records (one per line) of a data file into a list of dicts.
+    """
+    with open(filepath, encoding='utf8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def song_tuples(records):
+    """
+    Turns the song records parsed by `read_json_records` into the typed tuples of `read_song_file`.
+    """
+    songs, artists = [], []
+    for record in records:
+        songs.append((record['song_id'], record['title'], record['artist_id'],
+                      int(record['year']), float(record['duration'])))
+        artists.append((record['artist_id'], record['artist_name'], record['artist_location'],
+                        _to_float(record['artist_latitude']), _to_float(record['artist_longitude'])))
+
+    return songs, artists
+
+
+def _to_float(value):
+    return None if value is None else float(value)
+
+
+def load_song_batch(cur, songs, artists, song_index=None):
+    """
+    Inserts many song and artist records with one multi-row `INSERT` per table.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    songs, artists : list of tuple
+        Records returned by `read_song_file` (possibly gathered from many files).
+    song_index : SongIndex, optional
+        In-memory song/artist lookup index to refresh with the new songs.
+
+    Returns
+    -------
+    int
+        Number of records written to the tables.
+    """
+    record(cur, 'song_records_read', len(songs))
+
+    execute_values(cur, song_table_insert_values, songs, page_size=1000)
+    execute_values(cur, artist_table_insert_values, artists, page_size=1000)
+
+    if song_index is not None:
+        for (song_id, title, artist_id, year, duration), artist in zip(songs, artists):
+            song_index.add(song_id, title, artist_id, artist[1], duration)
+
+    return len(songs) + len(artists)
+
+
+@timed
+def process_song_batch(cur, filepaths, song_index=None):
+    """
+    Reads many `song_data` files with `read_song_file` and loads them as one batch.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    filepaths : list of str
+        Absolute paths of data files from `song_data`.
+    song_index : SongIndex, optional
+        In-memory song/artist lookup index to refresh with the new songs.
+
+    Returns
+    -------
+    int
+        Number of records written to the tables.
+    """
+    songs, artists = [], []
+    for filepath in filepaths:
+        file_songs, file_artists = read_song_file(filepath)
+        songs.extend(file_songs)
+        artists.extend(file_artists)
+
+    return load_song_batch(cur, songs, artists, song_index=song_index)
+
+
+def transform_log_file(filepath):
+    """
+    - Utility function to read one JSON file from the `log_data` directory.
+
+    - Filters records based on the 'NextSong' page and splits them into the
+    `time`, `users` and `songplays` records.
+
+    Parameters
+    ----------
     filepath : str
         Absolute path to a single data file from `log_data`.
 
     Returns
     -------
-    None
+    tuple of pandas.DataFrame
+        `(time_df, user_df, songplay_df)` sharing the index of the filtered log records.
+        `songplay_df.attrs['rows_read']` holds the number of records in the file before filtering.
     """
     # open log file
-    df = pd.read_json(filepath, lines=True)
+    return transform_log_records(read_json_file(filepath))
+
+
+def transform_log_records(df):
+    """
+    Filters the records of a log file read by `read_json_file` and splits them into the `time`, `users`
+    and `songplays` records (see `transform_log_file`).
+    """
+    rows_read = len(df)
 
     # filter by NextSong action
     df = df[df['page'] == 'NextSong']
@@ -63,43 +262,382 @@ def process_log_file(cur, filepath):
     # convert timestamp column to datetime
     t = pd.to_datetime(df['ts'], unit='ms')
 
-    # insert time data records
+    # time data records
     time_data = list((t, t.dt.hour, t.dt.day, t.dt.weekofyear, t.dt.month, t.dt.year, t.dt.weekday))
     column_labels = list(('start_time', 'hour', 'day', 'week', 'month', 'year', 'weekday'))
     time_df = pd.DataFrame.from_dict(dict(zip(column_labels, time_data)))
 
-    for i, row in time_df.iterrows():
-        cur.execute(time_table_insert, list(row))
+    # user records, with the start time each 'level' was seen at
+    user_df = df[['userId', 'firstName', 'lastName', 'gender', 'level']].assign(level_ts=t)
+
+    # songplay records (song and artist are resolved to their IDs while loading)
+    songplay_df = pd.DataFrame({
+        'start_time': t,
+        'user_id': df['userId'],
+        'level': df['level'],
+        'song': df['song'],
+        'artist': df['artist'],
+        'length': df['length'],
+        'session_id': df['sessionId'],
+        'location': df['location'],
+        'user_agent': df['userAgent'],
+    })
+    songplay_df.attrs['rows_read'] = rows_read
 
-    # load user table
-    user_df = df[['userId', 'firstName', 'lastName', 'gender', 'level']]
+    return time_df, user_df, songplay_df
+
+
+def load_log_records(cur, time_df, user_df, songplay_df, song_index=None, dimension_cache=None, partitions=None):
+    """
+    Inserts the records of one log file row-by-row into the `time`, `users` and `songplays` tables.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    time_df, user_df, songplay_df : pandas.DataFrame
+        Records returned by `transform_log_file`.
+    song_index : SongIndex, optional
+        Resolves the songplays in memory instead of running `song_select` for each of them.
+    dimension_cache : DimensionCache, optional
+        Skips the time and user records already sent earlier in the run.
+    partitions : SongplayPartitions, optional
+        Creates the missing monthly partitions of `songplays` before the records are inserted.
+
+    Returns
+    -------
+    tuple
+        Number of records written to the tables, and the function to call once they are committed
+        (`None` without `dimension_cache`, see `split_load_result`).
+    """
+    count_log_records(cur, songplay_df)
+    on_commit = None
+    if dimension_cache is not None:
+        time_df, user_df, pending = dimension_cache.filter_log_records(time_df, user_df, songplay_df['start_time'])
+        # the cache only learns about the records once the caller committed them
+        on_commit = partial(dimension_cache.remember, pending)
+
+    if partitions is not None:
+        partitions.ensure(songplay_df['start_time'])
+    # held until the transaction ends, so that the songplay_id high-water marks wait for these rows
+    cur.execute(songplay_load_lock)
+    insert_log_records(cur, time_df, user_df, songplay_df, song_index)
+
+    return len(time_df) + len(user_df) + len(songplay_df), on_commit
+
+
+def insert_log_records(cur, time_df, user_df, songplay_df, song_index=None):
+    """
+    Runs the row-by-row `INSERT`s of `load_log_records`.
+    """
+    # insert time data records
+    # NOTE: The rows are upserted in key order, so that concurrent writers lock them in the same order and do not deadlock.
+    for i, row in time_df.sort_values('start_time').iterrows():
+        cur.execute(time_table_insert, list(row))
 
     # insert user records
-    for i, row in user_df.iterrows():
-        cur.execute(user_table_insert, row)
+    for i, row in user_df.sort_values('userId', kind='stable', key=lambda user_ids: user_ids.astype(int)).iterrows():
+        cur.execute(user_table_insert, list(row))
 
     # insert songplay records
-    for index, row in df.iterrows():
+    for index, row in songplay_df.iterrows():
         # get songid and artistid from song and artist tables
-        cur.execute(song_select, (row.song, row.artist, row.length))
-        results = cur.fetchone()
-
-        if results:
-            songid, artistid = results
+        if song_index is not None:
+            songid, artistid = song_index.lookup(row.song, row.artist, row.length)
         else:
-            songid, artistid = None, None
+            cur.execute(song_select, (row.song, row.artist, row.length))
+            results = cur.fetchone()
+
+            if results:
+                songid, artistid = results
+            else:
+                songid, artistid = None, None
 
         # insert songplay record
         # NOTE: Make sure to not include 'index' as the first column as it is set to be SERIAL which is "auto-increment".
-        songplay_data = (time_df['start_time'].loc[index], row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent)
+        songplay_data = (row.start_time, row.user_id, row.level, songid, artistid, row.session_id, row.location, row.user_agent)
 
         cur.execute(songplay_table_insert, songplay_data)
 
 
-def process_data(cur, conn, filepath, func):
+def count_log_records(cur, songplay_df):
+    """
+    Records the number of log records read and filtered out (non 'NextSong' pages) when `cur` is instrumented.
+    """
+    rows_read = songplay_df.attrs.get('rows_read', len(songplay_df))
+    record(cur, 'log_records_read', rows_read)
+    record(cur, 'log_records_filtered', rows_read - len(songplay_df))
+
+
+def copy_dataframe(cur, query, df):
+    """
+    Streams a DataFrame into a table with `COPY ... FROM STDIN` (CSV format, `\\N` as NULL).
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    query : str
+        `COPY` statement reading from STDIN.
+    df : pandas.DataFrame
+        Records to copy, in the column order of `query`.
+
+    Returns
+    -------
+    None
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False, na_rep='\\N')
+    buffer.seek(0)
+    cur.copy_expert(query, buffer)
+
+
+def copy_log_records(cur, time_df, user_df, songplay_df, song_index=None, dimension_cache=None, partitions=None):
+    """
+    Bulk counterpart of `load_log_records`.
+
+    - COPYs the records of one log file into TEMP staging tables.
+
+    - Applies them to the `time`, `users` and `songplays` tables with one set-based statement each.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    time_df, user_df, songplay_df : pandas.DataFrame
+        Records returned by `transform_log_file`.
+    song_index : SongIndex, optional
+        Resolves the songplays in memory before they are copied, instead of joining `songs` and `artists`.
+    dimension_cache : DimensionCache, optional
+        Skips the time and user records already sent earlier in the run.
+    partitions : SongplayPartitions, optional
+        Creates the missing monthly partitions of `songplays` before the records are inserted.
+
+    Returns
+    -------
+    tuple
+        Number of records written to the tables, and the function to call once they are committed
+        (`None` without `dimension_cache`, see `split_load_result`).
+    """
+    count_log_records(cur, songplay_df)
+    on_commit = None
+    if dimension_cache is not None:
+        time_df, user_df, pending = dimension_cache.filter_log_records(time_df, user_df, songplay_df['start_time'])
+        # the cache only learns about the records once the caller committed them
+        on_commit = partial(dimension_cache.remember, pending)
+
+    if partitions is not None:
+        partitions.ensure(songplay_df['start_time'])
+    # held until the transaction ends, so that the songplay_id high-water marks wait for these rows
+    cur.execute(songplay_load_lock)
+    stage_log_records(cur, time_df, user_df, songplay_df, song_index)
+
+    return len(time_df) + len(user_df) + len(songplay_df), on_commit
+
+
+def stage_log_records(cur, time_df, user_df, songplay_df, song_index=None):
+    """
+    Runs the `COPY` and set-based `INSERT`s of `copy_log_records`.
+    """
+    # (re)create the session-local staging tables and clear rows left over from the previous file
+    for query in staging_table_queries:
+        cur.execute(query)
+    cur.execute(staging_truncate)
+
+    copy_dataframe(cur, time_staging_copy, time_df)
+    copy_dataframe(cur, user_staging_copy, user_df)
+
+    if song_index is not None:
+        resolved = [song_index.lookup(song, artist, length)
+                    for song, artist, length in zip(songplay_df['song'], songplay_df['artist'], songplay_df['length'])]
+        songplay_df = songplay_df.assign(song_id=[r[0] for r in resolved], artist_id=[r[1] for r in resolved])
+        copy_dataframe(cur, songplay_staging_copy_resolved, songplay_df)
+    else:
+        copy_dataframe(cur, songplay_staging_copy, songplay_df)
+
+    cur.execute(time_table_bulk_insert)
+    cur.execute(user_table_bulk_insert)
+    cur.execute(songplay_table_bulk_insert_resolved if song_index is not None else songplay_table_bulk_insert)
+
+
+@timed
+def process_log_file(cur, filepath, song_index=None, dimension_cache=None, partitions=None):
+    """
+    - Utility function to process one JSON file from the `log_data` directory.
+
+    - Filters records based on the 'NextSong' page.
+
+    - Inserts record(s) into the `time`, `users` and `songplays` tables.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    filepath : str
+        Absolute path to a single data file from `log_data`.
+    song_index : SongIndex, optional
+        In-memory song/artist lookup index used to resolve the songplays.
+    dimension_cache : DimensionCache, optional
+        Skips the time and user records already sent earlier in the run.
+    partitions : SongplayPartitions, optional
+        Creates the missing monthly partitions of `songplays` before the records are inserted.
+
+    Returns
+    -------
+    tuple
+        Number of records written to the tables, and the function to call once they are committed.
+    """
+    return load_log_records(cur, *transform_log_file(filepath), song_index=song_index, dimension_cache=dimension_cache,
+                            partitions=partitions)
+
+
+@timed
+def process_log_file_bulk(cur, filepath, song_index=None, dimension_cache=None, partitions=None):
+    """
+    Same as `process_log_file`, but loads the records with `COPY` instead of one `INSERT` per row.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    filepath : str
+        Absolute path to a single data file from `log_data`.
+    song_index : SongIndex, optional
+        In-memory song/artist lookup index used to resolve the songplays.
+    dimension_cache : DimensionCache, optional
+        Skips the time and user records already sent earlier in the run.
+    partitions : SongplayPartitions, optional
+        Creates the missing monthly partitions of `songplays` before the records are inserted.
+
+    Returns
+    -------
+    tuple
+        Number of records written to the tables, and the function to call once they are committed.
+    """
+    return copy_log_records(cur, *transform_log_file(filepath), song_index=song_index, dimension_cache=dimension_cache,
+                            partitions=partitions)
+
+
+def get_files(filepath):
+    """
+    Collects all the JSON data files within a directory.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the `song_data` or `log_data` directory.
+
+    Returns
+    -------
+    list of str
+        Absolute paths of the data files.
+    """
+    all_files = []
+    for root, dirs, files in os.walk(filepath):
+        files = glob.glob(os.path.join(root, '*.json'))
+        for f in files :
+            all_files.append(os.path.abspath(f))
+
+    return all_files
+
+
+def hash_file(datafile):
+    """
+    Returns the SHA-256 hex digest of a data file's content.
+    """
+    sha = hashlib.sha256()
+    with open(datafile, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def select_new_files(cur, filepath, all_files):
+    """
+    Consults the `ingest_ledger` table to keep only the data files that are new or changed.
+
+    - A file whose size and mtime match its ledger entry is skipped without being read.
+
+    - A file whose size or mtime changed is hashed, and skipped if its content is the same
+    (its ledger entry is refreshed so that it is not hashed again next time).
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    filepath : str
+        Path to the `song_data` or `log_data` directory.
+    all_files : list of str
+        Absolute paths of the data files, as returned by `get_files`.
+
+    Returns
+    -------
+    list of tuple
+        `(datafile, ledger_entry)` for every file to process, where `ledger_entry` holds the
+        parameters of `ledger_upsert` to record once the file is loaded.
+    """
+    return list(iter_new_files(cur, filepath, all_files))
+
+
+def iter_new_files(cur, filepath, all_files):
+    """
+    Generator version of `select_new_files`, yielding each file to process as soon as it is checked.
+    """
+    # ledger paths are relative to the parent of `song_data`/`log_data`, so the data directory can move
+    root = os.path.dirname(os.path.abspath(filepath))
+    prefix = os.path.relpath(os.path.abspath(filepath), root)
+
+    cur.execute(ledger_select, (prefix + '/%',))
+    ledger = {path: (size, mtime, content_hash) for path, size, mtime, content_hash in cur.fetchall()}
+
+    for datafile in all_files:
+        key = os.path.relpath(datafile, root)
+        stat = os.stat(datafile)
+        known = ledger.get(key)
+
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            continue
+
+        content_hash = hash_file(datafile)
+        entry = (key, stat.st_size, stat.st_mtime, content_hash)
+        if known and known[2] == content_hash:
+            cur.execute(ledger_upsert, entry)
+            continue
+
+        yield datafile, entry
+
+
+def split_load_result(result):
+    """
+    Splits the value returned by a loader into `(rows, on_commit)`.
+
+    The log loaders also return a function to call once their records are committed (see `DimensionCache.remember`),
+    the other loaders only the number of records.
+    """
+    if isinstance(result, tuple):
+        return result
+    return result, None
+
+
+def bump_load_epoch(cur):
+    """
+    Moves the load epoch forward once loaded data is committed, so that `analytics.py` drops its cached results.
+    """
+    cur.execute(load_epoch_bump)
+
+
+@timed
+def process_data(cur, conn, filepath, func, commit_files=1, commit_rows=None, retries=0, ledger=True):
     """
     Process all the data files within a directory.
 
+    - Each file is processed inside its own savepoint, so a file that fails is rolled back alone
+    (after `retries` more attempts) and reported, without losing the rest of the transaction.
+
+    - The transaction is committed every `commit_files` files or as soon as `commit_rows` records
+    are pending, whichever comes first.
+
     Parameters
     ----------
     cur :
@@ -110,54 +648,627 @@ def process_data(cur, conn, filepath, func):
         Absolute path to a single data file (can be from `song_data` or `log_data`).
     func :
         Function object to indicate whether to process data files from `song_data` or `log_data`.
+    commit_files : int
+        Number of files per transaction.
+    commit_rows : int, optional
+        Number of records after which the transaction is committed early.
+    retries : int
+        Number of times a failed file is attempted again before it is rolled back for good.
+    ledger : bool
+        Only process the files that `ingest_ledger` does not list as loaded (see `select_new_files`),
+        and record each file in it in the same transaction as its data, so an interrupted run
+        resumes where it stopped.
 
     Returns
     -------
-    None
+    dict
+        Number of files `committed`, `rolled_back`, `retried` and `skipped`.
     """
     # get all files matching extension from directory
-    all_files = []
-    for root, dirs, files in os.walk(filepath):
-        files = glob.glob(os.path.join(root, '*.json'))
-        for f in files :
-            all_files.append(os.path.abspath(f))
+    all_files = get_files(filepath)
+    if ledger:
+        new_files = select_new_files(cur, filepath, all_files)
+    else:
+        new_files = [(datafile, None) for datafile in all_files]
 
     # get total number of files found
-    num_files = len(all_files)
-    print('{} files found in {}'.format(num_files, filepath))
+    num_files = len(new_files)
+    print('{} files found in {}'.format(len(all_files), filepath))
+    if ledger:
+        print('{} files already loaded, {} new or changed.'.format(len(all_files) - num_files, num_files))
+
+    summary = {'committed': 0, 'rolled_back': 0, 'retried': 0, 'skipped': len(all_files) - num_files}
+    pending_files, pending_rows, on_commits = 0, 0, []
 
     # iterate over files and process
-    for i, datafile in enumerate(all_files, 1):
-        func(cur, datafile)
-        conn.commit()
+    for i, (datafile, entry) in enumerate(new_files, 1):
+        for attempt in range(retries + 1):
+            cur.execute(file_savepoint)
+            try:
+                rows, on_commit = split_load_result(func(cur, datafile))
+            except Exception as e:
+                cur.execute(file_savepoint_rollback)
+                if attempt < retries:
+                    summary['retried'] += 1
+                    continue
+                summary['rolled_back'] += 1
+                record(cur, 'files_rolled_back')
+                print('Rolled back {}: {}'.format(datafile, e))
+            else:
+                if entry is not None:
+                    cur.execute(ledger_upsert, entry)
+                cur.execute(file_savepoint_release)
+                record(cur, 'files_processed')
+                pending_files += 1
+                pending_rows += rows or 0
+                if on_commit is not None:
+                    on_commits.append(on_commit)
+            break
+
+        if pending_files >= commit_files or (commit_rows and pending_rows >= commit_rows):
+            conn.commit()
+            for on_commit in on_commits:
+                on_commit()
+            bump_load_epoch(cur)
+            summary['committed'] += pending_files
+            pending_files, pending_rows, on_commits = 0, 0, []
+
         print('{}/{} files processed.'.format(i, num_files))
 
+    conn.commit()
+    for on_commit in on_commits:
+        on_commit()
+    if pending_files:
+        bump_load_epoch(cur)
+    summary['committed'] += pending_files
+
+    print('{} files committed, {} rolled back, {} retried.'.format(summary['committed'], summary['rolled_back'], summary['retried']))
+
+    return summary
+
+
+def load_file_batch(cur, func, batch):
+    """
+    Loads a batch of data files with `func` inside one savepoint, together with their ledger entries.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    func :
+        Function object processing a list of data files (e.g. `process_song_batch`).
+    batch : list of tuple
+        `(datafile, ledger_entry)` pairs, as returned by `select_new_files`.
+
+    Returns
+    -------
+    bool
+        Whether the batch was loaded (it is rolled back otherwise).
+    """
+    cur.execute(file_savepoint)
+    try:
+        func(cur, [datafile for datafile, entry in batch])
+        for datafile, entry in batch:
+            if entry is not None:
+                cur.execute(ledger_upsert, entry)
+    except Exception as e:
+        cur.execute(file_savepoint_rollback)
+        if len(batch) == 1:
+            print('Rolled back {}: {}'.format(batch[0][0], e))
+        return False
+
+    cur.execute(file_savepoint_release)
+    record(cur, 'files_processed', len(batch))
+    return True
+
+
+@timed
+def process_data_batched(cur, conn, filepath, func, batch_size=500, ledger=True):
+    """
+    Variant of `process_data` for functions that load many data files at once (e.g. `process_song_batch`).
+
+    - Every `batch_size` files are loaded in one savepoint and committed.
+
+    - When a batch fails, its files are loaded again one by one, so that only the bad file(s) are rolled back.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    conn :
+        Connection object to `sparkifydb`.
+    filepath : str
+        Path to the `song_data` or `log_data` directory.
+    func :
+        Function object processing a list of data files.
+    batch_size : int
+        Number of files per batch.
+    ledger : bool
+        Only process the files that `ingest_ledger` does not list as loaded, as in `process_data`.
+
+    Returns
+    -------
+    dict
+        Number of files `committed`, `rolled_back`, `retried` and `skipped`.
+    """
+    all_files = get_files(filepath)
+    if ledger:
+        new_files = select_new_files(cur, filepath, all_files)
+    else:
+        new_files = [(datafile, None) for datafile in all_files]
+
+    num_files = len(new_files)
+    print('{} files found in {}'.format(len(all_files), filepath))
+    if ledger:
+        print('{} files already loaded, {} new or changed.'.format(len(all_files) - num_files, num_files))
+
+    summary = {'committed': 0, 'rolled_back': 0, 'retried': 0, 'skipped': len(all_files) - num_files}
+
+    for start in range(0, num_files, batch_size):
+        batch = new_files[start:start + batch_size]
+
+        if load_file_batch(cur, func, batch):
+            summary['committed'] += len(batch)
+        else:
+            # isolate the bad file(s) by loading the batch again one file at a time
+            summary['retried'] += len(batch)
+            for item in batch:
+                if load_file_batch(cur, func, [item]):
+                    summary['committed'] += 1
+                else:
+                    summary['rolled_back'] += 1
+
+        conn.commit()
+        bump_load_epoch(cur)
+        print('{}/{} files processed.'.format(start + len(batch), num_files))
+
+    conn.commit()
+    print('{} files committed, {} rolled back, {} retried.'.format(summary['committed'], summary['rolled_back'], summary['retried']))
+
+    return summary
+
+
+def write_records(pool, load, records, entry=None, metrics=None, retries=3):
+    """
+    Loads the records of one data file on a connection borrowed from `pool` and commits them
+    (together with the file's `ingest_ledger` entry, if given).
+
+    - The writers upsert the shared `time` and `users` rows in key order, but a transaction that PostgreSQL
+    still aborts to resolve a deadlock (or a serialization failure) is attempted again, up to `retries` times.
+
+    Parameters
+    ----------
+    pool : psycopg2.pool.ThreadedConnectionPool
+        Pool of writer connections to `sparkifydb`.
+    load :
+        Function object loading the records (`load_song_records`, `load_log_records` or `copy_log_records`).
+    records : tuple
+        Records returned by the matching `transform_*` function.
+    entry : tuple, optional
+        Parameters of `ledger_upsert` for the file.
+    metrics : Metrics, optional
+        Records the statements of the writer connection.
+    retries : int
+        Number of times the file is attempted again after a deadlock or serialization failure.
+
+    Returns
+    -------
+    None
+    """
+    conn = pool.getconn()
+    try:
+        for attempt in range(retries + 1):
+            try:
+                cursor = conn.cursor()
+                with (InstrumentedCursor(cursor, metrics) if metrics is not None else cursor) as cur:
+                    rows, on_commit = split_load_result(load(cur, *records))
+                    if entry is not None:
+                        cur.execute(ledger_upsert, entry)
+                conn.commit()
+                break
+            except (DeadlockDetected, SerializationFailure):
+                if attempt == retries:
+                    raise
+                conn.rollback()
+                if metrics is not None:
+                    metrics.count('write_retries')
 
-def main():
+        if on_commit is not None:
+            on_commit()
+        if metrics is not None:
+            metrics.count('files_processed')
+        with conn.cursor() as cur:
+            bump_load_epoch(cur)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def process_data_parallel(pool, filepath, transform, load, workers, writers=1, ledger=True, metrics=None):
+    """
+    Parallel version of `process_data`.
+
+    - Parses and transforms the data files in a pool of `workers` processes.
+
+    - Loads the resulting records on `writers` connections from `pool` (one transaction per file).
+
+    - Reports progress in file order; a file that fails to parse or load is reported and skipped
+    without affecting the other files.
+
+    Parameters
+    ----------
+    pool : psycopg2.pool.ThreadedConnectionPool
+        Pool of (at least `writers`) connections to `sparkifydb`.
+    filepath : str
+        Path to the `song_data` or `log_data` directory.
+    transform :
+        Function object turning one data file into records (`transform_song_file` or `transform_log_file`).
+    load :
+        Function object loading those records (`load_song_records`, `load_log_records` or `copy_log_records`).
+    workers : int
+        Number of parser processes.
+    writers : int
+        Number of writer threads/connections.
+    ledger : bool
+        Only process the files that `ingest_ledger` does not list as loaded, as in `process_data`.
+    metrics : Metrics, optional
+        Records the statements of the writer connections.
+
+    Returns
+    -------
+    list of tuple
+        `(datafile, exception)` for every file that failed.
+    """
+    all_files = get_files(filepath)
+    if ledger:
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                new_files = select_new_files(cur, filepath, all_files)
+            conn.commit()
+        finally:
+            pool.putconn(conn)
+    else:
+        new_files = [(datafile, None) for datafile in all_files]
+
+    num_files = len(new_files)
+    print('{} files found in {}'.format(len(all_files), filepath))
+    if ledger:
+        print('{} files already loaded, {} new or changed.'.format(len(all_files) - num_files, num_files))
+
+    # bound the number of files in flight so that memory does not grow with the size of the directory
+    window = 2 * max(workers, writers)
+    files = iter(new_files)
+    failed = []
+    done = 0
+
+    def report(datafile, write):
+        nonlocal done
+        done += 1
+        try:
+            write.result()
+        except Exception as e:
+            failed.append((datafile, e))
+            print('{}/{} files processed. FAILED {}: {}'.format(done, num_files, datafile, e))
+        else:
+            print('{}/{} files processed.'.format(done, num_files))
+
+    with ProcessPoolExecutor(max_workers=workers) as parsers, ThreadPoolExecutor(max_workers=writers) as writer_threads:
+        parses = deque((f, entry, parsers.submit(transform, f)) for f, entry in islice(files, window))
+        writes = deque()
+
+        while parses:
+            datafile, entry, parse = parses.popleft()
+            next_file = next(files, None)
+            if next_file is not None:
+                parses.append((*next_file, parsers.submit(transform, next_file[0])))
+
+            try:
+                records = parse.result()
+            except Exception as e:
+                # keep the failure in line with the other files so that progress stays ordered
+                write = Future()
+                write.set_exception(e)
+            else:
+                write = writer_threads.submit(write_records, pool, load, records, entry, metrics)
+            writes.append((datafile, write))
+
+            while writes and (writes[0][1].done() or len(writes) > window):
+                report(*writes.popleft())
+
+        while writes:
+            report(*writes.popleft())
+
+    if failed:
+        print('{} of {} files in {} failed.'.format(len(failed), num_files, filepath))
+
+    return failed
+
+
+def discover_files(pool, filepath, ledger=True):
+    """
+    Yields the `(datafile, ledger_entry)` pairs of the files to process, checking the ledger on its own
+    connection from `pool` as the files are discovered.
+    """
+    all_files = get_files(filepath)
+    print('{} files found in {}'.format(len(all_files), filepath))
+    if not ledger:
+        yield from ((datafile, None) for datafile in all_files)
+        return
+
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            yield from iter_new_files(cur, filepath, all_files)
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+
+
+def process_data_pipelined(pool, filepath, parse, transform, load, parsers=1, writers=1, queue_size=8, ledger=True, metrics=None):
+    """
+    Streaming version of `process_data`, built on `pipeline.Pipeline`.
+
+    - File discovery (and the ledger check), JSON parsing, transformation and DB writing run as separate
+    stages in their own threads, connected by bounded queues, so disk, CPU and database work overlap.
+
+    - A full queue blocks the stage feeding it (backpressure), so at most `queue_size` files wait between two stages.
+
+    - The `writers` write the files through `write_records`, so they lock the shared `time` and `users` rows in key order
+    and a file aborted by a deadlock is written again before it is reported as failed.
+
+    - Prints the utilization and queue depth of every stage at the end, to show which stage limits the run.
+
+    Parameters
+    ----------
+    pool : psycopg2.pool.ThreadedConnectionPool
+        Pool of (at least `writers` + 1) connections to `sparkifydb`.
+    filepath : str
+        Path to the `song_data` or `log_data` directory.
+    parse :
+        Function object reading one data file (`read_json_file` or `read_json_records`).
+    transform :
+        Function object turning the parsed file into records (`transform_song_records`, `song_tuples` or `transform_log_records`).
+    load :
+        Function object loading those records (`load_song_records`, `load_song_batch`, `load_log_records` or `copy_log_records`).
+    parsers : int
+        Number of parser threads.
+    writers : int
+        Number of writer threads/connections.
+    queue_size : int
+        Capacity of the queues between the stages.
+    ledger : bool
+        Only process the files that `ingest_ledger` does not list as loaded, as in `process_data`.
+    metrics : Metrics, optional
+        Records the statements of the writer connections.
+
+    Returns
+    -------
+    dict
+        Per-stage statistics (see `Pipeline.report`), and the `failed` files as `(stage, datafile, exception)`.
+    """
+    stages = [
+        Stage('parse', lambda datafile, entry, payload: parse(datafile), threads=parsers),
+        Stage('transform', lambda datafile, entry, payload: transform(payload)),
+        Stage('write', lambda datafile, entry, payload: write_records(pool, load, payload, entry, metrics), threads=writers),
+    ]
+    pipeline = Pipeline(stages, queue_size=queue_size)
+    failed = pipeline.run(discover_files(pool, filepath, ledger))
+
+    print('{} files processed, {} failed.'.format(stages[-1].processed - len([f for f in failed if f[0] == 'write']), len(failed)))
+    print(pipeline.summary())
+
+    return dict(pipeline.report(), failed=failed)
+
+
+@timed
+def build_indexes(cur, conn, index_queries, analyze_queries):
+    """
+    - Creates the indexes of `index_queries` that do not exist yet (all of them after `create_tables.py --bulk-load`).
+
+    - Refreshes the planner statistics of the loaded tables with `analyze_queries`.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    conn :
+        Connection object to `sparkifydb`.
+    index_queries : list of str
+        e.g. `lookup_index_queries` or `songplay_index_queries`.
+    analyze_queries : list of str
+        e.g. `lookup_analyze_queries` or `songplay_analyze_queries`.
+
+    Returns
+    -------
+    None
+    """
+    for query in index_queries + analyze_queries:
+        cur.execute(query)
+        conn.commit()
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line options of the ETL pipeline.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Arguments to parse (defaults to `sys.argv[1:]`).
+
+    Returns
+    -------
+    argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='Load `song_data` and `log_data` into sparkifydb.')
+    parser.add_argument('--data-dir', default='data',
+                        help='Directory containing `song_data` and `log_data` (default: data).')
+    parser.add_argument('--loader', choices=['row', 'copy'], default='row',
+                        help="How log records are written: one INSERT per row ('row') or COPY into staging tables ('copy').")
+    parser.add_argument('--song-index', action='store_true',
+                        help='Resolve songplays with an in-memory song/artist index instead of one `song_select` query per event.')
+    parser.add_argument('--song-index-tolerance', type=float, default=0.0, metavar='SECONDS',
+                        help='Maximum difference between the song duration and the event length for an index match (default: exact).')
+    parser.add_argument('--dedup-cache', action='store_true',
+                        help='Only send time rows not sent earlier in the run and user rows whose level changed.')
+    parser.add_argument('--dedup-cache-size', type=int, default=1000000, metavar='N',
+                        help='Maximum number of start times remembered by --dedup-cache (default: 1000000).')
+    parser.add_argument('--song-reader', choices=['pandas', 'fast'], default='pandas',
+                        help="How song files are read: one pandas DataFrame per file ('pandas') or plain JSON parsing into tuples, "
+                             "loaded in batches of --song-batch files ('fast').")
+    parser.add_argument('--song-batch', type=int, default=500, metavar='N',
+                        help='Number of song files per batch with --song-reader fast (default: 500).')
+    parser.add_argument('--commit-files', type=int, default=1, metavar='N',
+                        help='Commit every N files (default: 1). Each file runs in its own savepoint either way.')
+    parser.add_argument('--commit-rows', type=int, default=None, metavar='M',
+                        help='Also commit as soon as M records are pending.')
+    parser.add_argument('--retries', type=int, default=0, metavar='N',
+                        help='Attempt a failed file N more times before rolling it back for good (default: 0).')
+    parser.add_argument('--no-ledger', dest='ledger', action='store_false',
+                        help='Process every data file, even those `ingest_ledger` lists as already loaded.')
+    parser.add_argument('--metrics-json', metavar='PATH',
+                        help='Write a JSON summary of the run metrics (stage times, row counts, round trips, latency histograms).')
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                        help='Write the run metrics in the Prometheus text format.')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help='Number of processes parsing and transforming the data files (default: 1, i.e. sequential).')
+    parser.add_argument('--writers', type=int, default=1, metavar='N',
+                        help='Number of connections loading the transformed records when --workers > 1 or --pipeline (default: 1).')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Stream the files through discovery, parsing (--workers threads), transformation and writing '
+                             '(--writers connections) stages connected by bounded queues, and report the queue depths.')
+    parser.add_argument('--queue-size', type=int, default=8, metavar='N',
+                        help='Capacity of the queues between the --pipeline stages (default: 8).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """
     - Establishes connection with the sparkify database and gets
     cursor to it.
 
     - Processes all the files in `song_data` and `log_data` consecutively.
 
+    - Builds the indexes each stage needs afterwards (they are only created here after `create_tables.py --bulk-load`)
+    and refreshes the planner statistics.
+
+    - Adds the songplays loaded by the run to the rollup tables (see `rollups.py`).
+
     - Finally, closes the connection.
 
     Parameters
     ----------
-    None
+    argv : list of str, optional
+        Command line options, see `parse_args`.
 
     Returns
     -------
-    None
+    dict
+        Wall time in seconds of the `song_data`, `song_indexes`, `log_data`, `log_indexes` and `rollups` stages.
     """
-    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    args = parse_args(argv)
+    song_data = os.path.join(args.data_dir, 'song_data')
+    log_data = os.path.join(args.data_dir, 'log_data')
+    metrics = Metrics()
+    instrument = bool(args.metrics_json or args.metrics_prom)
+
+    conn = psycopg2.connect(DSN)
     cur = conn.cursor()
+    if instrument:
+        cur = InstrumentedCursor(cur, metrics)
+
+    log_func = process_log_file_bulk if args.loader == 'copy' else process_log_file
+    log_load = copy_log_records if args.loader == 'copy' else load_log_records
+    if args.song_reader == 'fast':
+        song_func, song_transform, song_load = process_song_batch, read_song_file, load_song_batch
+        song_parse, song_records = read_json_records, song_tuples
+    else:
+        song_func, song_transform, song_load = process_song_file, transform_song_file, load_song_records
+        song_parse, song_records = read_json_file, transform_song_records
+
+    song_index = None
+    if args.song_index:
+        # start from the songs already loaded by previous runs, new ones are added while `song_data` is loaded
+        song_index = SongIndex(tolerance=args.song_index_tolerance)
+        song_index.refresh(cur)
+        song_func = partial(song_func, song_index=song_index)
+        log_func = partial(log_func, song_index=song_index)
+        song_load = partial(song_load, song_index=song_index)
+        log_load = partial(log_load, song_index=song_index)
+
+    dimension_cache = None
+    if args.dedup_cache:
+        dimension_cache = DimensionCache(max_times=args.dedup_cache_size)
+        log_func = partial(log_func, dimension_cache=dimension_cache)
+        log_load = partial(log_load, dimension_cache=dimension_cache)
 
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+    # `songplays` is partitioned by month: the months of the log files are created before any writer starts,
+    # the loaders only create the (unexpected) months still missing, on the partitions' own connection
+    partitions = SongplayPartitions(DSN)
+    partitions.ensure(log_file_months(get_files(log_data)))
+    log_func = partial(log_func, partitions=partitions)
+    log_load = partial(log_load, partitions=partitions)
 
+    if args.pipeline:
+        # one more connection for the discovery stage, which checks the ledger
+        pool = psycopg2.pool.ThreadedConnectionPool(1, args.writers + 1, DSN)
+        writer_metrics = metrics if instrument else None
+        pipelined = dict(parsers=args.workers, writers=args.writers, queue_size=args.queue_size, ledger=args.ledger, metrics=writer_metrics)
+        with metrics.stage('song_data'):
+            process_data_pipelined(pool, song_data, song_parse, song_records, song_load, **pipelined)
+        with metrics.stage('song_indexes'):
+            build_indexes(cur, conn, lookup_index_queries, lookup_analyze_queries)
+        with metrics.stage('log_data'):
+            process_data_pipelined(pool, log_data, read_json_file, transform_log_records, log_load, **pipelined)
+        pool.closeall()
+    elif args.workers > 1:
+        pool = psycopg2.pool.ThreadedConnectionPool(1, args.writers, DSN)
+        writer_metrics = metrics if instrument else None
+        with metrics.stage('song_data'):
+            process_data_parallel(pool, song_data, song_transform, song_load, args.workers, args.writers, args.ledger, writer_metrics)
+        with metrics.stage('song_indexes'):
+            build_indexes(cur, conn, lookup_index_queries, lookup_analyze_queries)
+        with metrics.stage('log_data'):
+            process_data_parallel(pool, log_data, transform_log_file, log_load, args.workers, args.writers, args.ledger, writer_metrics)
+        pool.closeall()
+    else:
+        batching = dict(commit_files=args.commit_files, commit_rows=args.commit_rows, retries=args.retries, ledger=args.ledger)
+        with metrics.stage('song_data'):
+            if args.song_reader == 'fast':
+                process_data_batched(cur, conn, filepath=song_data, func=song_func, batch_size=args.song_batch, ledger=args.ledger)
+            else:
+                process_data(cur, conn, filepath=song_data, func=song_func, **batching)
+        with metrics.stage('song_indexes'):
+            build_indexes(cur, conn, lookup_index_queries, lookup_analyze_queries)
+        with metrics.stage('log_data'):
+            process_data(cur, conn, filepath=log_data, func=log_func, **batching)
+
+    with metrics.stage('log_indexes'):
+        build_indexes(cur, conn, songplay_index_queries, songplay_analyze_queries)
+
+    # all the writers are done, so every songplay of the run is committed and gets counted
+    with metrics.stage('rollups'):
+        print('{} new songplays added to the rollups.'.format(refresh_rollups(cur, conn)))
+
+    if song_index is not None:
+        print(song_index.summary())
+    if dimension_cache is not None:
+        print(dimension_cache.summary())
+    print(partitions.summary())
+
+    partitions.close()
     conn.close()
 
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+
+    return dict(metrics.stages)
+
 
 
 if __name__ == "__main__":
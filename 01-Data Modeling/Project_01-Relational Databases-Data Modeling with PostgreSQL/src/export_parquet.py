@@ -0,0 +1,238 @@
+# Import all the necessary packages
+import os
+import json
+import shutil
+import argparse
+from datetime import datetime
+import psycopg2
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sql_queries import load_epoch_select, songplays_touched_months_select, songplays_max_id_select, songplays_export_select
+from sql_queries import users_export_select, songs_export_select, artists_export_select, time_export_select
+from sql_queries import songplay_high_water_lock, songplay_high_water_unlock
+from partitions import next_month
+
+
+DSN = "host=127.0.0.1 dbname=sparkifydb user=student password=student"
+
+STATE_FILE = '_export_state.json'
+
+SCHEMAS = {
+    'songplays': pa.schema([('songplay_id', pa.int64()), ('start_time', pa.timestamp('us')), ('user_id', pa.int32()),
+                            ('level', pa.string()), ('song_id', pa.string()), ('artist_id', pa.string()),
+                            ('session_id', pa.int32()), ('location', pa.string()), ('user_agent', pa.string())]),
+    'users': pa.schema([('user_id', pa.int32()), ('first_name', pa.string()), ('last_name', pa.string()),
+                        ('gender', pa.string()), ('level', pa.string())]),
+    'songs': pa.schema([('song_id', pa.string()), ('title', pa.string()), ('artist_id', pa.string()),
+                        ('year', pa.int32()), ('duration', pa.float64())]),
+    'artists': pa.schema([('artist_id', pa.string()), ('name', pa.string()), ('location', pa.string()),
+                          ('latitude', pa.float64()), ('longitude', pa.float64())]),
+    'time': pa.schema([('start_time', pa.timestamp('us')), ('hour', pa.int32()), ('day', pa.int32()), ('week', pa.int32()),
+                       ('month', pa.int32()), ('year', pa.int32()), ('weekday', pa.int32())]),
+}
+
+DIMENSION_QUERIES = {'users': users_export_select, 'songs': songs_export_select,
+                     'artists': artists_export_select, 'time': time_export_select}
+
+
+def write_query(conn, query, params, schema, path, batch_size=50000, compression='snappy'):
+    """
+    Streams the result of `query` into a Parquet file, one row group per batch.
+
+    - The rows are read through a server-side (named) cursor, `batch_size` at a time,
+    so memory stays flat whatever the size of the table.
+
+    - The file is written next to `path` and renamed once complete, so readers never see a partial file.
+
+    Parameters
+    ----------
+    conn :
+        Connection object to `sparkifydb`.
+    query : str
+        SELECT returning the columns of `schema`, in order.
+    params : tuple
+        Parameters of `query`.
+    schema : pyarrow.Schema
+        Schema of the Parquet file.
+    path : str
+        Path of the Parquet file (replaced if it exists).
+    batch_size : int
+        Number of rows fetched and written at a time.
+    compression : str
+        Parquet compression codec.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    rows = 0
+
+    with conn.cursor(name='export') as cur:
+        cur.itersize = batch_size
+        cur.execute(query, params)
+        with pq.ParquetWriter(tmp_path, schema, compression=compression) as writer:
+            while True:
+                batch = cur.fetchmany(batch_size)
+                if not batch:
+                    break
+                columns = list(zip(*batch))
+                writer.write_batch(pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                                   schema=schema))
+                rows += len(batch)
+
+    os.replace(tmp_path, path)
+    return rows
+
+
+def songplay_partition_path(out_dir, month):
+    """
+    Returns the path of the Parquet file holding the songplays of `month`, e.g. `songplays/year=2018/month=11/part-0.parquet`.
+    """
+    return os.path.join(out_dir, 'songplays', 'year={}'.format(month.year), 'month={:02d}'.format(month.month), 'part-0.parquet')
+
+
+def read_state(out_dir):
+    """
+    Returns the state of the last export into `out_dir` (empty if there was none).
+    """
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf8') as f:
+        return json.load(f)
+
+
+def write_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def export(conn, out_dir, full=False, batch_size=50000, compression='snappy'):
+    """
+    Exports the star schema to Parquet files in `out_dir`.
+
+    - `songplays` is partitioned by year/month of 'start_time' (one file per month), the dimensions are
+    written as one file per table.
+
+    - Incremental by default: only the months of the songplays loaded since the last export
+    (`songplay_id` above the one recorded in `_export_state.json`) are rewritten, and the dimensions only
+    when the load epoch moved (see `etl.py`). Nothing is written if nothing was loaded.
+
+    - A full export (`full`, no previous export, or a recreated database) first removes the songplay partitions.
+
+    - Everything is read in one REPEATABLE READ snapshot, so the files are consistent with each other.
+    The snapshot is taken under `songplay_high_water_lock` (see `sql_queries.py`), once the loads in progress
+    have committed: no songplay with an id below the recorded `last_songplay_id` can be committed after the export,
+    so none is skipped by the next one.
+
+    Parameters
+    ----------
+    conn :
+        Connection object to `sparkifydb`.
+    out_dir : str
+        Output directory.
+    full : bool
+        Rewrites every partition and table.
+    batch_size : int
+        Number of rows fetched and written at a time.
+    compression : str
+        Parquet compression codec.
+
+    Returns
+    -------
+    dict
+        Number of rows written per file (relative to `out_dir`).
+    """
+    state = {} if full else read_state(out_dir)
+
+    # session-level lock, taken before the snapshot (the first query of the REPEATABLE READ transaction)
+    with conn.cursor() as cur:
+        cur.execute(songplay_high_water_lock)
+    conn.commit()
+    locked = True
+
+    try:
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+
+        with conn.cursor() as cur:
+            cur.execute(load_epoch_select)
+            epoch = cur.fetchone()[0]
+            cur.execute(songplays_max_id_select)
+            last_id = cur.fetchone()[0]
+            cur.execute(songplay_high_water_unlock)
+            locked = False
+
+            since = state.get('last_songplay_id', 0)
+            if since > last_id:
+                # the database was recreated since the last export
+                since, state = 0, {}
+            cur.execute(songplays_touched_months_select, (since,))
+            months = [month for month, in cur.fetchall()]
+
+        if since == 0:
+            # full export: partitions of months no longer in `songplays` must not survive it
+            shutil.rmtree(os.path.join(out_dir, 'songplays'), ignore_errors=True)
+
+        written = {}
+        for month in months:
+            path = songplay_partition_path(out_dir, month)
+            written[os.path.relpath(path, out_dir)] = write_query(conn, songplays_export_select, (month, next_month(month)),
+                                                                  SCHEMAS['songplays'], path, batch_size, compression)
+
+        if epoch != state.get('load_epoch'):
+            for table, query in DIMENSION_QUERIES.items():
+                path = os.path.join(out_dir, table, 'part-0.parquet')
+                written[os.path.relpath(path, out_dir)] = write_query(conn, query, (), SCHEMAS[table], path, batch_size, compression)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # a session-level advisory lock survives the rollback
+        if locked:
+            with conn.cursor() as cur:
+                cur.execute(songplay_high_water_unlock)
+            conn.commit()
+
+    write_state(out_dir, {'last_songplay_id': last_id, 'load_epoch': epoch, 'exported_at': datetime.now().isoformat(timespec='seconds')})
+
+    return written
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Export the star schema of sparkifydb to Parquet files.')
+    parser.add_argument('--out', default='export', help='Output directory (default: export).')
+    parser.add_argument('--full', action='store_true', help='Rewrite every partition and table instead of the ones changed since the last export.')
+    parser.add_argument('--batch-size', type=int, default=50000, metavar='N',
+                        help='Rows fetched from the server-side cursor and written per row group (default: 50000).')
+    parser.add_argument('--compression', default='snappy', choices=['snappy', 'zstd', 'gzip', 'none'],
+                        help='Parquet compression codec (default: snappy).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Exports `songplays` (partitioned by year/month), `users`, `songs`, `artists` and `time` to Parquet.
+
+    - Prints the files written and their row counts.
+    """
+    args = parse_args(argv)
+    conn = psycopg2.connect(DSN)
+
+    written = export(conn, args.out, full=args.full, batch_size=args.batch_size, compression=args.compression)
+    conn.close()
+
+    for path, rows in sorted(written.items()):
+        print('{:<50} {:>10} rows'.format(path, rows))
+    print('{} files written to {}.'.format(len(written), args.out))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# Import all the necessary packages
+import os
+import json
+import math
+import random
+import string
+import argparse
+import itertools
+from datetime import datetime, timedelta
+
+
+# Sample values used to make the generated records look like the bundled `song_data` and `log_data`
+FIRST_NAMES = [('Walter', 'M'), ('Kaylee', 'F'), ('Ryan', 'M'), ('Chloe', 'F'), ('Jacob', 'M'), ('Lily', 'F'),
+               ('Aleena', 'F'), ('Tegan', 'F'), ('Jayden', 'M'), ('Mohammad', 'M'), ('Ava', 'F'), ('Cecilia', 'F')]
+LAST_NAMES = ['Frye', 'Summers', 'Smith', 'Cuevas', 'Levine', 'Koch', 'Kirby', 'Rodriguez', 'Fox', 'Owens', 'Bell', 'Robinson']
+LOCATIONS = ['San Francisco-Oakland-Hayward, CA', 'Phoenix-Mesa-Scottsdale, AZ', 'Chicago-Naperville-Elgin, IL-IN-WI',
+             'New York-Newark-Jersey City, NY-NJ-PA', 'Atlanta-Sandy Springs-Roswell, GA', 'Lansing-East Lansing, MI',
+             'Waterloo-Cedar Falls, IA', 'Sacramento--Roseville--Arden-Arcade, CA', 'Tampa-St. Petersburg-Clearwater, FL']
+USER_AGENTS = [
+    '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36"',
+    '"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.153 Safari/537.36"',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0',
+    '"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Ubuntu Chromium/36.0.1985.125 Chrome/36.0.1985.125 Safari/537.36"',
+]
+WORDS = ['love', 'night', 'heart', 'fire', 'dream', 'blue', 'river', 'summer', 'gold', 'rain', 'home', 'shadow',
+         'light', 'road', 'wild', 'city', 'angel', 'storm', 'moon', 'dance', 'broken', 'sweet', 'ghost', 'stone']
+# (page, method, status, weight) of the non-song events, NextSong gets the remaining share
+OTHER_PAGES = [('Home', 'GET', 200, 5), ('Logout', 'PUT', 307, 2), ('Settings', 'GET', 200, 1),
+               ('Thumbs Up', 'PUT', 307, 3), ('Add to Playlist', 'PUT', 200, 1), ('Downgrade', 'GET', 200, 1)]
+
+
+def random_id(prefix, rng, length=16):
+    return prefix + ''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(length))
+
+
+def random_title(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+
+
+def generate_songs(out_dir, num_songs, rng):
+    """
+    Writes `num_songs` song files (one JSON record each) under `out_dir/song_data`,
+    partitioned by the first three letters of the track ID like the Million Song Dataset.
+
+    Returns
+    -------
+    list of tuple
+        `(title, artist_name, duration)` of every song, used to generate matching events.
+    """
+    num_artists = max(1, num_songs // 3)
+    artists = []
+    for _ in range(num_artists):
+        has_location = rng.random() < 0.4
+        artists.append({
+            'artist_id': random_id('AR', rng),
+            'artist_name': random_title(rng),
+            'artist_location': rng.choice(LOCATIONS) if has_location else '',
+            'artist_latitude': round(rng.uniform(-60, 70), 5) if has_location else None,
+            'artist_longitude': round(rng.uniform(-150, 150), 5) if has_location else None,
+        })
+
+    catalog = []
+    for _ in range(num_songs):
+        track_id = random_id('TRA', rng, 15)
+        record = {'num_songs': 1}
+        record.update(rng.choice(artists))
+        record.update({
+            'song_id': random_id('SO', rng),
+            'title': random_title(rng),
+            'duration': round(rng.uniform(30, 600), 5),
+            'year': rng.choice([0, 0, rng.randint(1960, 2010)]),
+        })
+
+        folder = os.path.join(out_dir, 'song_data', *track_id[2:5])
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, track_id + '.json'), 'w', encoding='utf8') as f:
+            json.dump(record, f)
+
+        catalog.append((record['title'], record['artist_name'], record['duration']))
+
+    return catalog
+
+
+def generate_users(num_users, rng):
+    users = []
+    for user_id in range(1, num_users + 1):
+        first_name, gender = rng.choice(FIRST_NAMES)
+        users.append({
+            'userId': str(user_id),
+            'firstName': first_name,
+            'lastName': rng.choice(LAST_NAMES),
+            'gender': gender,
+            'level': rng.choice(['free', 'free', 'paid']),
+            'location': rng.choice(LOCATIONS),
+            'userAgent': rng.choice(USER_AGENTS),
+            'registration': float(1540000000000 + rng.randint(0, 10 ** 9)),
+        })
+
+    return users
+
+
+def generate_session(user, session_id, start_ms, catalog, match_rate, rng):
+    """
+    Generates the events of one listening session, mostly `NextSong` pages.
+    """
+    events = []
+    ts = start_ms
+    page_weights = [w for _, _, _, w in OTHER_PAGES]
+    for item in range(rng.randint(1, 40)):
+        event = {
+            'artist': None, 'auth': 'Logged In', 'firstName': user['firstName'], 'gender': user['gender'],
+            'itemInSession': item, 'lastName': user['lastName'], 'length': None, 'level': user['level'],
+            'location': user['location'], 'method': 'PUT', 'page': 'NextSong', 'registration': user['registration'],
+            'sessionId': session_id, 'song': None, 'status': 200, 'ts': ts, 'userAgent': user['userAgent'],
+            'userId': user['userId'],
+        }
+
+        if rng.random() < 0.8:
+            if catalog and rng.random() < match_rate:
+                title, artist_name, duration = rng.choice(catalog)
+            else:
+                title, artist_name, duration = random_title(rng), random_title(rng), round(rng.uniform(30, 600), 5)
+            event.update({'artist': artist_name, 'song': title, 'length': duration})
+            ts += int(duration * 1000)
+        else:
+            page, method, status, _ = rng.choices(OTHER_PAGES, weights=page_weights)[0]
+            event.update({'page': page, 'method': method, 'status': status})
+            ts += rng.randint(1000, 60000)
+
+        events.append(event)
+
+    # a few free users convert to paid subscribers, so that user levels change over time
+    if user['level'] == 'free' and rng.random() < 0.02:
+        user['level'] = 'paid'
+
+    return events
+
+
+def generate_logs(out_dir, num_events, num_days, users, catalog, match_rate, user_skew, rng):
+    """
+    Writes about `num_events` events under `out_dir/log_data/YYYY/MM/YYYY-MM-DD-events.json`,
+    one file per day, each sorted by `ts`. Only one day of events is held in memory at a time.
+
+    Returns
+    -------
+    dict
+        Number of events, songplays (`NextSong` events) and songplays matching a song of `catalog`.
+    """
+    # Zipf-like popularity: the user of rank r is picked with a weight of 1 / r^user_skew
+    cum_weights = list(itertools.accumulate(1.0 / rank ** user_skew for rank in range(1, len(users) + 1)))
+    catalog_keys = set(catalog)
+
+    counts = {'events': 0, 'songplays': 0, 'matched_songplays': 0}
+    session_ids = itertools.count(1)
+    first_day = datetime(2018, 11, 1)
+    per_day = math.ceil(num_events / num_days)
+
+    for day in range(num_days):
+        date = first_day + timedelta(days=day)
+        day_start = int((date - datetime(1970, 1, 1)).total_seconds() * 1000)
+        day_events = []
+        while len(day_events) < min(per_day, num_events - counts['events']):
+            user = rng.choices(users, cum_weights=cum_weights)[0]
+            start_ms = day_start + rng.randint(0, 86400000 - 1)
+            day_events.extend(generate_session(user, next(session_ids), start_ms, catalog, match_rate, rng))
+        if not day_events:
+            break
+
+        day_events.sort(key=lambda event: event['ts'])
+
+        folder = os.path.join(out_dir, 'log_data', date.strftime('%Y'), date.strftime('%m'))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, date.strftime('%Y-%m-%d-events.json')), 'w', encoding='utf8') as f:
+            for event in day_events:
+                f.write(json.dumps(event, separators=(',', ':')) + '\n')
+                if event['page'] == 'NextSong':
+                    counts['songplays'] += 1
+                    counts['matched_songplays'] += (event['song'], event['artist'], event['length']) in catalog_keys
+
+        counts['events'] += len(day_events)
+        print('{}: {} events written.'.format(date.strftime('%Y-%m-%d'), len(day_events)))
+
+    return counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic `song_data` and `log_data` for benchmarking `etl.py`.')
+    parser.add_argument('--out', default='generated_data', help='Output directory (default: generated_data).')
+    parser.add_argument('--songs', type=int, default=10000, help='Number of song files (default: 10000).')
+    parser.add_argument('--events', type=int, default=100000, help='Approximate number of log events (default: 100000).')
+    parser.add_argument('--users', type=int, default=1000, help='Number of distinct users (default: 1000).')
+    parser.add_argument('--days', type=int, default=None,
+                        help='Number of daily log files (default: enough for at most 50000 events per file, and at least 30).')
+    parser.add_argument('--match-rate', type=float, default=0.5,
+                        help='Share of NextSong events that refer to a song of `song_data` (default: 0.5).')
+    parser.add_argument('--user-skew', type=float, default=1.0,
+                        help='Zipf exponent of user activity, 0 means uniform (default: 1.0).')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Generates a song catalog, users and their listening sessions at the requested scale.
+
+    - Writes them in the layout of the bundled `data` directory, plus a `manifest.json`
+    describing the parameters and the generated volumes (read by `benchmark.py`).
+    """
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    num_days = args.days or max(30, math.ceil(args.events / 50000))
+
+    catalog = generate_songs(args.out, args.songs, rng)
+    print('{} song files written.'.format(len(catalog)))
+
+    users = generate_users(args.users, rng)
+    counts = generate_logs(args.out, args.events, num_days, users, catalog, args.match_rate, args.user_skew, rng)
+
+    manifest = dict(vars(args), days=num_days)
+    manifest['requested_events'] = manifest.pop('events')
+    manifest.update(counts)
+    with open(os.path.join(args.out, 'manifest.json'), 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=4)
+    print(json.dumps(manifest, indent=4))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# Import all the necessary packages
+import json
+import time
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+import sql_queries
+
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Maps the text of every query of `sql_queries.py` back to its name, e.g. 'songplay_table_insert'
+STATEMENT_NAMES = {query.strip(): name for name, query in vars(sql_queries).items()
+                   if isinstance(query, str) and not name.startswith('_')}
+
+
+def statement_name(query):
+    """
+    Returns the `sql_queries.py` name of a query, or its first three words for other statements
+    (e.g. the multi-row statements built by `execute_values`).
+    """
+    if isinstance(query, bytes):
+        query = query.decode('utf8', 'replace')
+    query = str(query).strip()
+
+    return STATEMENT_NAMES.get(query) or ' '.join(query.split()[:3])
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed buckets, in the Prometheus sense.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self):
+        cumulative, total = {}, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative['+Inf' if bound == float('inf') else repr(bound)] = total
+        return {'count': self.count, 'sum': round(self.sum, 6), 'mean': round(self.sum / self.count, 6) if self.count else 0.0,
+                'max': round(self.max, 6), 'buckets': cumulative}
+
+
+class Metrics:
+    """
+    Collects the metrics of one ETL run.
+
+    - `stages`: wall time of the main steps (e.g. `song_data`, `log_data`).
+
+    - `counters`: rows read, filtered and inserted, DB round trips, files, ...
+
+    - `statements` / `functions`: latency histograms per SQL statement and per instrumented function.
+
+    The results can be written as a JSON summary (`write_json`) and in the Prometheus text format (`write_prometheus`).
+
+    Parameters
+    ----------
+    namespace : str
+        Prefix of the Prometheus metric names.
+    """
+
+    def __init__(self, namespace='sparkify_etl'):
+        self.namespace = namespace
+        self.stages = {}
+        self.counters = {}
+        self.statements = {}
+        self.functions = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager timing the wall time of one stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe_statement(self, name, seconds):
+        with self._lock:
+            self.statements.setdefault(name, Histogram()).observe(seconds)
+            self.counters['db_round_trips'] = self.counters.get('db_round_trips', 0) + 1
+
+    def observe_function(self, name, seconds):
+        with self._lock:
+            self.functions.setdefault(name, Histogram()).observe(seconds)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'stages_seconds': {name: round(seconds, 6) for name, seconds in self.stages.items()},
+                'counters': dict(self.counters),
+                'statements': {name: histogram.to_dict() for name, histogram in self.statements.items()},
+                'functions': {name: histogram.to_dict() for name, histogram in self.functions.items()},
+            }
+
+    def write_json(self, path):
+        """
+        Writes the metrics as a JSON summary to `path`.
+        """
+        with open(path, 'w', encoding='utf8') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        summary = self.to_dict()
+        ns = self.namespace
+        lines = ['# HELP {}_stage_seconds Wall time of an ETL stage.'.format(ns),
+                 '# TYPE {}_stage_seconds gauge'.format(ns)]
+        for name, seconds in summary['stages_seconds'].items():
+            lines.append('{}_stage_seconds{{stage="{}"}} {}'.format(ns, _escape(name), seconds))
+
+        for name, value in summary['counters'].items():
+            lines.append('# TYPE {}_{}_total counter'.format(ns, name))
+            lines.append('{}_{}_total {}'.format(ns, name, value))
+
+        for metric, label, histograms in (('statement_seconds', 'statement', summary['statements']),
+                                          ('function_seconds', 'function', summary['functions'])):
+            lines.append('# HELP {}_{} Latency of each {}.'.format(ns, metric, label))
+            lines.append('# TYPE {}_{} histogram'.format(ns, metric))
+            for name, histogram in histograms.items():
+                for bound, count in histogram['buckets'].items():
+                    lines.append('{}_{}_bucket{{{}="{}",le="{}"}} {}'.format(ns, metric, label, _escape(name), bound, count))
+                lines.append('{}_{}_sum{{{}="{}"}} {}'.format(ns, metric, label, _escape(name), histogram['sum']))
+                lines.append('{}_{}_count{{{}="{}"}} {}'.format(ns, metric, label, _escape(name), histogram['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Writes the metrics in the Prometheus text format to `path` (e.g. for the node_exporter textfile collector).
+        """
+        with open(path, 'w', encoding='utf8') as f:
+            f.write(self.to_prometheus())
+
+
+def _is_insert(query):
+    if isinstance(query, bytes):
+        return query.lstrip()[:6].upper() == b'INSERT'
+    return str(query).lstrip()[:6].upper() == 'INSERT'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+class InstrumentedCursor:
+    """
+    Wraps a psycopg2 cursor to time every statement (`execute`, `executemany`, `copy_expert`),
+    count the round trips to the database and the rows inserted. Everything else is delegated to the wrapped cursor.
+
+    Parameters
+    ----------
+    cursor :
+        psycopg2 cursor object.
+    metrics : Metrics
+        Where the measurements are recorded.
+    """
+
+    def __init__(self, cursor, metrics):
+        self._cursor = cursor
+        self.metrics = metrics
+
+    def _timed(self, method, query, *args):
+        start = time.perf_counter()
+        try:
+            result = method(query, *args)
+        finally:
+            self.metrics.observe_statement(statement_name(query), time.perf_counter() - start)
+
+        # rows actually written (e.g. not skipped by `ON CONFLICT DO NOTHING`)
+        if _is_insert(query) and self._cursor.rowcount > 0:
+            self.metrics.count('rows_inserted', self._cursor.rowcount)
+
+        return result
+
+    def execute(self, query, vars=None):
+        return self._timed(self._cursor.execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(self._cursor.executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(self._cursor.copy_expert, sql, file, size)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+
+def record(cur, name, value=1):
+    """
+    Adds `value` to the counter `name` if `cur` is an `InstrumentedCursor` (does nothing otherwise).
+    """
+    if isinstance(cur, InstrumentedCursor):
+        cur.metrics.count(name, value)
+
+
+def timed(func):
+    """
+    Decorator recording the latency of a function whose first argument is a cursor,
+    when that cursor is an `InstrumentedCursor`.
+    """
+    @functools.wraps(func)
+    def wrapper(cur, *args, **kwargs):
+        if not isinstance(cur, InstrumentedCursor):
+            return func(cur, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return func(cur, *args, **kwargs)
+        finally:
+            cur.metrics.observe_function(func.__name__, time.perf_counter() - start)
+
+    return wrapper
@@ -0,0 +1,227 @@
+# Import all the necessary packages
+import os
+import argparse
+import threading
+from datetime import datetime, timedelta
+import psycopg2
+from sql_queries import songplay_partitions_select, songplay_partition_create, songplay_partition_detach, songplay_partition_drop
+
+
+DSN = "host=127.0.0.1 dbname=sparkifydb user=student password=student"
+
+
+def month_start(value):
+    """
+    Returns the first instant of the month of a timestamp (`datetime`, `pandas.Timestamp` or 'YYYY-MM' string).
+    """
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m')
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    """
+    Returns the name of the `songplays` partition holding the month `month`, e.g. 'songplays_y2018m11'.
+    """
+    return 'songplays_y{:04d}m{:02d}'.format(month.year, month.month)
+
+
+def month_range(first, last):
+    """
+    Returns the first instant of every month from `first` to `last` (both included).
+    """
+    months, month = [], month_start(first)
+    while month <= month_start(last):
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def log_file_months(files):
+    """
+    Returns the months of the songplays of the log files `files`, from their names ('YYYY-MM-DD-events.json'),
+    without reading them. The months of the day before and after are included, for events close to midnight.
+    Files named otherwise are ignored (their partitions are created when they are loaded).
+    """
+    months = set()
+    for datafile in files:
+        try:
+            day = datetime.strptime(os.path.basename(datafile)[:10], '%Y-%m-%d')
+        except ValueError:
+            continue
+        months.update(month_start(day + timedelta(days=delta)) for delta in (-1, 0, 1))
+    return sorted(months)
+
+
+class SongplayPartitions:
+    """
+    Keeps track of the monthly partitions of the `songplays` table and creates the missing ones
+    ahead of the records being loaded.
+
+    - The known partitions are cached, so a file whose months already exist costs no round trip.
+
+    - Partitions are created on a connection of their own, in autocommit mode and one at a time (under a lock):
+    the lock `CREATE TABLE ... PARTITION OF` takes on `songplays` is only held for that statement, never
+    for the transaction of a load, and a month is only marked as known once its partition is committed.
+    `etl.py` creates the months of the log files with `ensure` before loading them, so the writers
+    normally never wait on it.
+
+    - The statement waits at most `lock_timeout` for the transactions using `songplays`: a file that needs
+    a partition while its own connection has songplays pending fails instead of waiting for itself.
+
+    Parameters
+    ----------
+    dsn : str
+        Connection string of `sparkifydb`.
+    lock_timeout : str
+        Longest wait for the lock on `songplays`, e.g. '5s'.
+    """
+
+    def __init__(self, dsn=DSN, lock_timeout='5s'):
+        self.created = 0
+        self._months = set()
+        self._lock = threading.Lock()
+        self.conn = psycopg2.connect(dsn)
+        self.conn.set_session(autocommit=True)
+        with self.conn.cursor() as cur:
+            cur.execute('SET lock_timeout = %s', (lock_timeout,))
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reads the existing partitions of `songplays` from the catalog.
+
+        Returns
+        -------
+        int
+            Number of partitions.
+        """
+        with self._lock, self.conn.cursor() as cur:
+            cur.execute(songplay_partitions_select)
+            self._months = {datetime.strptime(name, 'songplays_y%Ym%m') for name, in cur.fetchall()
+                            if name.startswith('songplays_y')}
+            return len(self._months)
+
+    def create(self, month):
+        """
+        Creates (and commits) the partition of the month `month`, if it does not exist yet.
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(songplay_partition_create.format(partition_name(month)), (month, next_month(month)))
+
+    def ensure(self, start_times):
+        """
+        Creates the partitions needed by the songplays starting at `start_times` that do not exist yet.
+
+        Parameters
+        ----------
+        start_times : iterable of datetime
+            e.g. the 'start_time' column of `songplay_df`, or the months of `log_file_months`.
+
+        Returns
+        -------
+        list of datetime
+            Months whose partition was created.
+        """
+        months = {month_start(start_time) for start_time in set(start_times)}
+        created = []
+        with self._lock:
+            for month in sorted(months - self._months):
+                self.create(month)
+                self._months.add(month)
+                self.created += 1
+                created.append(month)
+
+        return created
+
+    def summary(self):
+        """
+        Returns a one-line report of the partitions known and created during the run.
+        """
+        return '{} songplays partitions ({} created during this run)'.format(len(self._months), self.created)
+
+    def close(self):
+        self.conn.close()
+
+
+def detach_partitions(cur, conn, before, drop=False):
+    """
+    Detaches (and optionally drops) the partitions of the months before `before`.
+
+    Detaching only updates the catalog, so old months leave `songplays` without the row-by-row
+    `DELETE` (and the `VACUUM` it calls for). A detached partition stays a regular table that can be archived.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    conn :
+        Connection object to `sparkifydb`.
+    before : str or datetime
+        First month to keep, e.g. '2018-11'.
+    drop : bool
+        Drops the detached partitions.
+
+    Returns
+    -------
+    list of str
+        Names of the detached partitions.
+    """
+    cur.execute(songplay_partitions_select)
+    limit = partition_name(month_start(before))
+    old = sorted(name for name, in cur.fetchall() if name.startswith('songplays_y') and name < limit)
+
+    for name in old:
+        cur.execute(songplay_partition_detach.format(name))
+        if drop:
+            cur.execute(songplay_partition_drop.format(name))
+        conn.commit()
+
+    return old
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the monthly partitions of the `songplays` table.')
+    parser.add_argument('--create', nargs=2, metavar=('FROM', 'TO'),
+                        help='Create the partitions of the months FROM to TO (YYYY-MM, both included).')
+    parser.add_argument('--detach-before', metavar='YYYY-MM',
+                        help='Detach the partitions of the months before YYYY-MM.')
+    parser.add_argument('--drop', action='store_true', help='Also drop the detached partitions.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Creates partitions ahead of a load (`--create`).
+
+    - Detaches (and drops) old partitions for retention (`--detach-before`, `--drop`).
+
+    - Lists the partitions of `songplays`.
+    """
+    args = parse_args(argv)
+    conn = psycopg2.connect(DSN)
+    cur = conn.cursor()
+
+    if args.create:
+        partitions = SongplayPartitions(DSN)
+        partitions.ensure(month_range(*args.create))
+        print(partitions.summary())
+        partitions.close()
+
+    if args.detach_before:
+        for name in detach_partitions(cur, conn, args.detach_before, drop=args.drop):
+            print('{} {}.'.format(name, 'dropped' if args.drop else 'detached'))
+
+    cur.execute(songplay_partitions_select)
+    print('Partitions: {}'.format(', '.join(name for name, in cur.fetchall()) or 'none'))
+
+    conn.close()
+
+
+
+if __name__ == "__main__":
+    main()
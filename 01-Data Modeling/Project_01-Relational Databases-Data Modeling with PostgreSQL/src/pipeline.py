@@ -0,0 +1,184 @@
+# Import all the necessary packages
+import time
+import queue
+import threading
+
+
+# Marks the end of the stream in a queue, one per consumer thread
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a `Pipeline`: `threads` threads taking items from `inbox`, applying `func` and putting the results
+    into `outbox` (bounded, so a slow downstream stage blocks this one instead of letting memory grow).
+
+    Parameters
+    ----------
+    name : str
+        Name used in the report.
+    func :
+        Function called as `func(datafile, entry, payload)` and returning the new payload.
+    threads : int
+        Number of threads running the stage.
+    """
+
+    def __init__(self, name, func, threads=1):
+        self.name = name
+        self.func = func
+        self.threads = threads
+        self.inbox = None
+        self.outbox = None
+        self.busy = 0.0
+        self.processed = 0
+        self.depths = []
+        self._lock = threading.Lock()
+
+
+class Pipeline:
+    """
+    Streaming producer/consumer runner for the data files.
+
+    - A source thread produces `(datafile, entry)` items (e.g. discovering the files and checking the ledger).
+
+    - Every stage runs in its own thread(s) and is connected to the next one by a bounded queue, so discovery,
+    parsing, transformation and writing overlap, and a slow stage applies backpressure to the ones before it.
+
+    - A file failing in any stage is reported and dropped, the other files go on.
+
+    - The depth of every queue is sampled while the pipeline runs: the stage right after a queue that is mostly
+    full is the one limiting the run, a queue that is mostly empty means the stages before it are the bottleneck.
+
+    Parameters
+    ----------
+    stages : list of Stage
+        Stages in order, the last one's results are discarded (e.g. writing to the database).
+    queue_size : int
+        Capacity of every queue.
+    sample_interval : float
+        Seconds between two samples of the queue depths.
+    """
+
+    def __init__(self, stages, queue_size=8, sample_interval=0.05):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.sample_interval = sample_interval
+        self.failed = []
+        self.wall = 0.0
+        self.next_threads = {}
+        self._failed_lock = threading.Lock()
+
+    def _produce(self, source, outbox, consumers):
+        try:
+            for datafile, entry in source:
+                outbox.put((datafile, entry, datafile))
+        except Exception as e:
+            with self._failed_lock:
+                self.failed.append(('discover', None, e))
+        finally:
+            for _ in range(consumers):
+                outbox.put(_DONE)
+
+    def _consume(self, stage, remaining):
+        while True:
+            item = stage.inbox.get()
+            if item is _DONE:
+                break
+
+            datafile, entry, payload = item
+            start = time.perf_counter()
+            try:
+                payload = stage.func(datafile, entry, payload)
+            except Exception as e:
+                with self._failed_lock:
+                    self.failed.append((stage.name, datafile, e))
+                print('FAILED {} ({}): {}'.format(datafile, stage.name, e))
+                payload = None
+            finally:
+                with stage._lock:
+                    stage.busy += time.perf_counter() - start
+                    stage.processed += 1
+
+            if payload is not None and stage.outbox is not None:
+                stage.outbox.put((datafile, entry, payload))
+
+        # the last thread of a stage to finish tells the next stage that the stream is over
+        with stage._lock:
+            remaining[stage.name] -= 1
+            last = remaining[stage.name] == 0
+        if last and stage.outbox is not None:
+            for _ in range(self.next_threads[stage.name]):
+                stage.outbox.put(_DONE)
+
+    def _sample(self, stop):
+        while not stop.wait(self.sample_interval):
+            for stage in self.stages:
+                stage.depths.append(stage.inbox.qsize())
+
+    def run(self, source):
+        """
+        Streams the items of `source` through the stages.
+
+        Parameters
+        ----------
+        source : iterable of tuple
+            `(datafile, entry)` items, consumed in a thread of its own.
+
+        Returns
+        -------
+        list of tuple
+            `(stage name, datafile, exception)` for every file that failed.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        for i, stage in enumerate(self.stages):
+            stage.inbox = queues[i]
+            stage.outbox = queues[i + 1] if i + 1 < len(queues) else None
+            self.next_threads[stage.name] = self.stages[i + 1].threads if i + 1 < len(self.stages) else 0
+        remaining = {stage.name: stage.threads for stage in self.stages}
+
+        start = time.perf_counter()
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._produce, args=(source, queues[0], self.stages[0].threads), daemon=True)]
+        for stage in self.stages:
+            threads += [threading.Thread(target=self._consume, args=(stage, remaining), daemon=True) for _ in range(stage.threads)]
+        sampler = threading.Thread(target=self._sample, args=(stop,), daemon=True)
+
+        for thread in threads + [sampler]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop.set()
+        sampler.join()
+        self.wall = time.perf_counter() - start
+
+        return self.failed
+
+    def report(self):
+        """
+        Returns the per-stage statistics of the last run: files processed, utilization of the stage's threads
+        and mean/max depth of its input queue.
+        """
+        stats = {}
+        for stage in self.stages:
+            depths = stage.depths or [0]
+            stats[stage.name] = {
+                'threads': stage.threads,
+                'processed': stage.processed,
+                'busy_seconds': round(stage.busy, 3),
+                'utilization': round(stage.busy / (self.wall * stage.threads), 3) if self.wall else 0.0,
+                'queue_mean': round(sum(depths) / len(depths), 2),
+                'queue_max': max(depths),
+                'queue_size': self.queue_size,
+            }
+        return stats
+
+    def summary(self):
+        """
+        Returns a multi-line report of `report`, one line per stage.
+        """
+        lines = []
+        for name, stats in self.report().items():
+            lines.append('{:>10}: {} files, {} thread(s) {:.0%} busy, input queue {:.1f}/{} on average (max {})'.format(
+                name, stats['processed'], stats['threads'], stats['utilization'],
+                stats['queue_mean'], stats['queue_size'], stats['queue_max']))
+        return '\n'.join(lines)
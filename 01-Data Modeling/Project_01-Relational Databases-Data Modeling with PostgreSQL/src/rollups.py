@@ -0,0 +1,155 @@
+# Import all the necessary packages
+import argparse
+import psycopg2
+from sql_queries import rollup_bounds_select, rollup_new_rows_select, rollup_upsert_queries, rollup_state_upsert, rollup_check_queries, rollup_truncate
+from sql_queries import songplay_high_water_lock, songplay_high_water_unlock
+from sql_queries import plays_per_day_select, top_songs_select, top_artists_select
+
+
+def refresh_rollups(cur, conn):
+    """
+    Adds the songplays loaded since the last refresh to the rollup tables, in one transaction
+    (the counts and `rollup_state` move together, so an interrupted refresh is simply done again next time).
+
+    The upper bound is read under `songplay_high_water_lock`: it waits for the loads in progress to commit,
+    so a songplay is never left below the bound uncounted, even when the refresh runs during a load.
+    The lock is held by the session, so it is released even when the refresh fails and is rolled back.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+    conn :
+        Connection object to `sparkifydb`.
+
+    Returns
+    -------
+    int
+        Number of songplays added to the rollups.
+    """
+    cur.execute(songplay_high_water_lock)
+    locked = True
+    try:
+        cur.execute(rollup_bounds_select)
+        low, high = cur.fetchone()
+        cur.execute(songplay_high_water_unlock)
+        locked = False
+
+        rows = 0
+        if high > low:
+            cur.execute(rollup_new_rows_select, (low, high))
+            rows = cur.fetchone()[0]
+            for query in rollup_upsert_queries:
+                cur.execute(query, (low, high))
+            cur.execute(rollup_state_upsert, (high,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # a session-level advisory lock survives the rollback
+        if locked:
+            cur.execute(songplay_high_water_unlock)
+            conn.commit()
+
+    return rows
+
+
+def check_rollups(cur):
+    """
+    Compares every rollup table with the same aggregate recomputed from `songplays`.
+
+    The comparison covers the songplays already counted (up to `rollup_state.last_songplay_id`). A rollup
+    also differs once months of `songplays` have been detached, since the rollups keep their plays:
+    `rebuild_rollups` recomputes them from the remaining rows.
+
+    Parameters
+    ----------
+    cur :
+        Cursor object to `sparkifydb`.
+
+    Returns
+    -------
+    dict
+        Number of differing rows per rollup table (0 when consistent).
+    """
+    cur.execute(rollup_bounds_select)
+    last = cur.fetchone()[0]
+
+    mismatches = {}
+    for table, query in rollup_check_queries.items():
+        cur.execute(query, (0, last, 0, last))
+        mismatches[table] = cur.fetchone()[0]
+
+    return mismatches
+
+
+def rebuild_rollups(cur, conn):
+    """
+    Empties the rollup tables and recomputes them from all of `songplays`.
+
+    Returns
+    -------
+    int
+        Number of songplays counted.
+    """
+    cur.execute(rollup_truncate)
+    return refresh_rollups(cur, conn)
+
+
+def print_report(cur, top=10):
+    """
+    Prints the plays per day and level, and the `top` songs and artists, from the rollup tables.
+    """
+    cur.execute(plays_per_day_select)
+    for day, level, plays in cur.fetchall():
+        print('{:%Y-%m-%d} {:<8} {:>8} plays'.format(day, level, plays))
+
+    for title, query in (('songs', top_songs_select), ('artists', top_artists_select)):
+        print('Top {} {}:'.format(top, title))
+        cur.execute(query, (top,))
+        for key, name, plays in cur.fetchall():
+            print('    {:>8} {} ({})'.format(plays, name, key))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Maintain the songplay rollup tables.')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute the rollups from all of `songplays`.')
+    parser.add_argument('--check', action='store_true', help='Compare the rollups with the aggregates of `songplays`.')
+    parser.add_argument('--report', action='store_true', help='Print plays per day and the top songs and artists.')
+    parser.add_argument('--top', type=int, default=10, metavar='N', help='Number of songs/artists in the report (default: 10).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Adds the songplays not counted yet to the rollups (or recomputes them with `--rebuild`).
+
+    - Checks the rollups against `songplays` (`--check`), exits with an error if they differ.
+
+    - Prints the reports read from the rollups (`--report`).
+    """
+    args = parse_args(argv)
+    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    cur = conn.cursor()
+
+    if args.rebuild:
+        print('{} songplays counted.'.format(rebuild_rollups(cur, conn)))
+    else:
+        print('{} new songplays counted.'.format(refresh_rollups(cur, conn)))
+
+    if args.report:
+        print_report(cur, args.top)
+
+    mismatches = check_rollups(cur) if args.check else {}
+    conn.close()
+
+    for table, count in mismatches.items():
+        print('{}: {}'.format(table, 'consistent' if count == 0 else '{} rows differ'.format(count)))
+    if any(mismatches.values()):
+        raise SystemExit(1)
+
+
+
+if __name__ == "__main__":
+    main()
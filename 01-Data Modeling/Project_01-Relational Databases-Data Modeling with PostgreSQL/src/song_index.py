@@ -0,0 +1,129 @@
+# Import all the necessary packages
+import math
+import struct
+import threading
+from sql_queries import song_lookup_select
+
+
+def to_real(value):
+    """
+    Rounds a duration to the precision of `songs.duration` (`FLOAT(5)`, i.e. a 4-byte `REAL`).
+    """
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+
+class SongIndex:
+    """
+    In-memory replacement for the `song_select` query.
+
+    - Maps `(title, artist name)` to the known `(duration, song_id, artist_id)` candidates,
+    so a songplay is resolved with one hash lookup instead of one round trip to `sparkifydb`.
+
+    - A candidate matches when its duration is within `tolerance` seconds of the event's `length`
+    (`tolerance=0` keeps the exact match of `song_select`). Durations and lengths are compared at the precision
+    `songs.duration` is stored with, so a song matches the same events whether it was indexed from its JSON file
+    during the run (`add`) or read back from `songs` by a later run (`refresh`).
+
+    - Songs can be added from several writer threads.
+
+    - Keeps hit/miss counters so that the match rate of a run can be reported.
+
+    Parameters
+    ----------
+    tolerance : float
+        Maximum absolute difference (in seconds) between the song duration and the event length.
+    """
+
+    def __init__(self, tolerance=0.0):
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+        self._songs = {}
+        self._song_ids = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._song_ids)
+
+    def add(self, song_id, title, artist_id, artist_name, duration):
+        """
+        Adds one song to the index (songs already indexed are ignored).
+
+        Parameters
+        ----------
+        song_id, title, artist_id, artist_name : str
+            Song and artist attributes, as stored in the `songs` and `artists` tables.
+        duration : float
+            Song duration in seconds.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            if song_id in self._song_ids:
+                return
+            self._song_ids.add(song_id)
+            self._songs.setdefault((title, artist_name), []).append((to_real(duration), song_id, artist_id))
+
+    def refresh(self, cur):
+        """
+        Adds the songs of the `songs` and `artists` tables that are not indexed yet.
+
+        Parameters
+        ----------
+        cur :
+            Cursor object to `sparkifydb`.
+
+        Returns
+        -------
+        int
+            Number of songs added to the index.
+        """
+        size = len(self)
+        cur.execute(song_lookup_select)
+        for song_id, title, artist_id, artist_name, duration in cur.fetchall():
+            self.add(song_id, title, artist_id, artist_name, duration)
+        return len(self) - size
+
+    def lookup(self, title, artist_name, length):
+        """
+        Resolves a songplay to its song and artist.
+
+        Parameters
+        ----------
+        title : str
+            Song title of the event (`song`).
+        artist_name : str
+            Artist name of the event (`artist`).
+        length : float
+            Song length of the event (`length`).
+
+        Returns
+        -------
+        tuple
+            `(song_id, artist_id)`, or `(None, None)` when no song matches.
+        """
+        match = None, None
+        if length is not None and not math.isnan(length):
+            length = to_real(length)
+            for duration, song_id, artist_id in self._songs.get((title, artist_name), ()):
+                if abs(duration - length) <= self.tolerance:
+                    match = song_id, artist_id
+                    break
+
+        with self._lock:
+            if match[0] is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return match
+
+    def summary(self):
+        """
+        Returns a one-line report of the index size and its hit/miss counts.
+        """
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return '{} songs indexed, {} lookups: {} hits, {} misses ({:.2f}% hit rate)'.format(
+            len(self), lookups, self.hits, self.misses, rate)
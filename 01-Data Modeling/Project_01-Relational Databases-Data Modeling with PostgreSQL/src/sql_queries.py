@@ -5,6 +5,12 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+ledger_table_drop = "DROP TABLE IF EXISTS ingest_ledger"
+hour_rollup_table_drop = "DROP TABLE IF EXISTS songplay_hour_rollup"
+song_rollup_table_drop = "DROP TABLE IF EXISTS songplay_song_rollup"
+artist_rollup_table_drop = "DROP TABLE IF EXISTS songplay_artist_rollup"
+rollup_state_table_drop = "DROP TABLE IF EXISTS rollup_state"
+load_epoch_drop = "DROP SEQUENCE IF EXISTS load_epoch"
 
 
 # CREATE TABLES
@@ -42,9 +48,14 @@ time_table_drop = "DROP TABLE IF EXISTS time"
 # From `test.ipynb`, for 'songplays' table: -
 #     - Initially used `REAL` data type for both 'latitude' and 'longitude' columns.
 #     - Check the columns 'start_time' and 'user_id' for correct data type. Check columns 'start_time' and 'user_id' for not-NULL constraint.
+# Range-partitioned by month of 'start_time' (one partition per month, e.g. `songplays_y2018m11`, see `partitions.py`):
+#     - Queries filtering on 'start_time' only scan the matching months (partition pruning).
+#     - Old months are removed with `ALTER TABLE ... DETACH PARTITION` instead of row deletes.
+#     - The primary key has to include the partition key, 'songplay_id' alone stays unique thanks to its sequence.
+#     - https://www.postgresql.org/docs/current/ddl-partitioning.html
 songplay_table_create = ("""
     CREATE TABLE IF NOT EXISTS songplays (
-    songplay_id SERIAL PRIMARY KEY, 
+    songplay_id SERIAL, 
     start_time TIMESTAMP NOT NULL, 
     user_id INT NOT NULL, 
     level VARCHAR(20), 
@@ -52,7 +63,27 @@ songplay_table_create = ("""
     artist_id VARCHAR(30), 
     session_id INT, 
     location VARCHAR(200), 
-    user_agent VARCHAR);
+    user_agent VARCHAR,
+    PRIMARY KEY (songplay_id, start_time))
+    PARTITION BY RANGE (start_time);
+""")
+
+# Monthly partitions of `songplays`, the partition name is filled in with `str.format`.
+songplay_partition_create = ("""
+CREATE TABLE IF NOT EXISTS {} PARTITION OF songplays
+FOR VALUES FROM (%s) TO (%s);
+""")
+
+songplay_partition_detach = "ALTER TABLE songplays DETACH PARTITION {}"
+songplay_partition_drop = "DROP TABLE IF EXISTS {}"
+
+songplay_partitions_select = ("""
+SELECT c.relname
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+JOIN pg_class p ON p.oid = i.inhparent
+WHERE p.relname = 'songplays'
+ORDER BY c.relname;
 """)
 
 user_table_create = ("""
@@ -61,7 +92,8 @@ CREATE TABLE IF NOT EXISTS users (
     first_name VARCHAR(100), 
     last_name VARCHAR(100), 
     gender CHAR(10),
-    level VARCHAR(20));
+    level VARCHAR(20),
+    level_ts TIMESTAMP);
 """)
 
 
@@ -116,6 +148,95 @@ CREATE TABLE IF NOT EXISTS time (
     weekday INT);
 """)
 
+# Bookkeeping table (not part of the star schema): one row per data file already loaded, so that
+# `etl.py` only processes new or changed files. 'filepath' is relative to the `data` directory.
+ledger_table_create = ("""
+CREATE TABLE IF NOT EXISTS ingest_ledger (
+    filepath VARCHAR PRIMARY KEY,
+    size BIGINT NOT NULL,
+    mtime DOUBLE PRECISION NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    loaded_at TIMESTAMP NOT NULL DEFAULT NOW());
+""")
+
+
+# Rollup tables (not part of the star schema): plays pre-aggregated per hour and level, per song and per artist,
+# so the dashboards read a few thousand rows instead of scanning `songplays` joined to `time` and `users`.
+# Per day/week plays are sums of the hourly rows. 'level' is the level of the user at the time of the play.
+# They are updated by `rollups.py` with the songplays loaded since the last update only (see `rollup_state`).
+hour_rollup_table_create = ("""
+CREATE TABLE IF NOT EXISTS songplay_hour_rollup (
+    start_hour TIMESTAMP NOT NULL,
+    level VARCHAR(20) NOT NULL,
+    plays BIGINT NOT NULL,
+    PRIMARY KEY (start_hour, level));
+""")
+
+song_rollup_table_create = ("""
+CREATE TABLE IF NOT EXISTS songplay_song_rollup (
+    song_id VARCHAR(30) PRIMARY KEY,
+    artist_id VARCHAR(30),
+    plays BIGINT NOT NULL);
+""")
+
+artist_rollup_table_create = ("""
+CREATE TABLE IF NOT EXISTS songplay_artist_rollup (
+    artist_id VARCHAR(30) PRIMARY KEY,
+    plays BIGINT NOT NULL);
+""")
+
+# Highest 'songplay_id' already counted in the rollups. 'songplay_id' comes from a sequence, so the songplays
+# loaded since are the ones above it, whatever the date of their log file.
+rollup_state_table_create = ("""
+CREATE TABLE IF NOT EXISTS rollup_state (
+    source VARCHAR PRIMARY KEY,
+    last_songplay_id BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW());
+""")
+
+
+# Load epoch: bumped by `etl.py` after every commit of loaded data, so that `analytics.py` knows its cached
+# results are stale. A sequence rather than a table row: `nextval` never blocks (concurrent writers do not
+# queue on a row lock) and is not rolled back.
+load_epoch_create = "CREATE SEQUENCE IF NOT EXISTS load_epoch"
+load_epoch_bump = "SELECT nextval('load_epoch')"
+# 'last_value' is already 1 before the first `nextval`, 'is_called' tells the two apart
+load_epoch_select = "SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM load_epoch"
+
+
+# INDEXES
+
+# Secondary indexes, kept out of the CREATE TABLE statements so that `create_tables.py --bulk-load` can
+# create them only once the data is loaded (see `build_indexes` in `etl.py`).
+#     - https://www.postgresql.org/docs/current/populate.html
+# The primary keys of 'users', 'songs', 'artists' and 'time' stay in the tables, since the upserts rely on them.
+songplay_pkey_drop = "ALTER TABLE songplays DROP CONSTRAINT IF EXISTS songplays_pkey"
+
+# `ADD PRIMARY KEY` has no `IF NOT EXISTS`, so it is guarded to keep the statement idempotent.
+songplay_pkey_create = ("""
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'songplays_pkey') THEN
+        ALTER TABLE songplays ADD PRIMARY KEY (songplay_id, start_time);
+    END IF;
+END $$;
+""")
+
+# Lookup indexes for the songplay resolution path (`song_select`, `songplay_table_bulk_insert`):
+# the artists are found by 'name', then their songs by 'title' and 'duration'.
+artist_name_index_create = "CREATE INDEX IF NOT EXISTS artists_name_idx ON artists (name)"
+song_title_index_create = "CREATE INDEX IF NOT EXISTS songs_title_duration_idx ON songs (title, duration)"
+
+songplay_start_time_index_create = "CREATE INDEX IF NOT EXISTS songplays_start_time_idx ON songplays (start_time)"
+songplay_user_index_create = "CREATE INDEX IF NOT EXISTS songplays_user_id_idx ON songplays (user_id)"
+songplay_song_index_create = "CREATE INDEX IF NOT EXISTS songplays_song_id_idx ON songplays (song_id)"
+
+songs_analyze = "ANALYZE songs"
+artists_analyze = "ANALYZE artists"
+songplays_analyze = "ANALYZE songplays"
+users_analyze = "ANALYZE users"
+time_analyze = "ANALYZE time"
+
 
 # INSERT RECORDS
 
@@ -128,11 +249,14 @@ ON CONFLICT DO NOTHING;
 
 # From Knowledge: https://knowledge.udacity.com/questions/804945
 # Intuition: - A customer currently on free-tier might convert to a paid subscriber in future!
+# 'level_ts' is the start time of the play the level was read from: a file committed after a more recent one
+# (e.g. by another writer) does not set the level back.
 user_table_insert = ("""
-INSERT INTO users (user_id, first_name, last_name, gender, level)
-VALUES (%s, %s, %s, %s, %s)
+INSERT INTO users (user_id, first_name, last_name, gender, level, level_ts)
+VALUES (%s, %s, %s, %s, %s, %s)
 ON CONFLICT (user_id) 
-DO UPDATE SET level = EXCLUDED.level;
+DO UPDATE SET level = EXCLUDED.level, level_ts = EXCLUDED.level_ts
+WHERE users.level_ts IS NULL OR users.level_ts <= EXCLUDED.level_ts;
 """)
 
 song_table_insert = ("""
@@ -147,6 +271,19 @@ VALUES (%s, %s, %s, %s, %s)
 ON CONFLICT DO NOTHING;
 """)
 
+# Multi-row variants used with `psycopg2.extras.execute_values` to load a whole batch of song files at once.
+song_table_insert_values = ("""
+INSERT INTO songs (song_id, title, artist_id, year, duration)
+VALUES %s
+ON CONFLICT DO NOTHING;
+""")
+
+artist_table_insert_values = ("""
+INSERT INTO artists (artist_id, name, location, latitude, longitude)
+VALUES %s
+ON CONFLICT DO NOTHING;
+""")
+
 # Encountered the error: -
 #     psycopg2.IntegrityError: duplicate key value violates unique constraint "time_pkey"
 #     DETAIL:  Key (start_time)=(2018-11-23 14:41:51.796) already exists.
@@ -157,6 +294,131 @@ ON CONFLICT DO NOTHING;
 """)
 
 
+# BULK LOAD (COPY)
+
+# Instead of one `cur.execute` per row, each log file is streamed into session-local TEMP tables with
+# `COPY ... FROM STDIN` and then applied to the star schema with a single set-based statement per table.
+# The `seq` columns keep the original row order of the file so that the result matches the row-by-row path.
+#     - https://www.postgresql.org/docs/current/sql-copy.html
+time_staging_create = ("""
+CREATE TEMP TABLE IF NOT EXISTS time_staging (
+    start_time TIMESTAMP,
+    hour INT,
+    day INT,
+    week INT,
+    month INT,
+    year INT,
+    weekday INT);
+""")
+
+user_staging_create = ("""
+CREATE TEMP TABLE IF NOT EXISTS user_staging (
+    seq BIGSERIAL,
+    user_id INT,
+    first_name VARCHAR(100),
+    last_name VARCHAR(100),
+    gender CHAR(10),
+    level VARCHAR(20),
+    level_ts TIMESTAMP);
+""")
+
+# NOTE: 'length' is kept as DOUBLE PRECISION so that the comparison with `songs.duration` behaves exactly like `song_select`.
+songplay_staging_create = ("""
+CREATE TEMP TABLE IF NOT EXISTS songplay_staging (
+    seq BIGSERIAL,
+    start_time TIMESTAMP,
+    user_id INT,
+    level VARCHAR(20),
+    song VARCHAR,
+    artist VARCHAR,
+    length DOUBLE PRECISION,
+    session_id INT,
+    location VARCHAR(200),
+    user_agent VARCHAR,
+    song_id VARCHAR(30),
+    artist_id VARCHAR(30));
+""")
+
+staging_truncate = "TRUNCATE time_staging, user_staging, songplay_staging"
+
+time_staging_copy = "COPY time_staging (start_time, hour, day, week, month, year, weekday) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+user_staging_copy = "COPY user_staging (user_id, first_name, last_name, gender, level, level_ts) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+songplay_staging_copy = "COPY songplay_staging (start_time, user_id, level, song, artist, length, session_id, location, user_agent) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+# Used when the songplays were already resolved against the in-memory `SongIndex` (see `song_index.py`).
+songplay_staging_copy_resolved = "COPY songplay_staging (start_time, user_id, level, song, artist, length, session_id, location, user_agent, song_id, artist_id) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+
+# The rows are inserted (and their keys locked) in key order, like the row-by-row path, so that concurrent
+# writers wait for each other instead of deadlocking.
+time_table_bulk_insert = ("""
+INSERT INTO time (start_time, hour, day, week, month, year, weekday)
+SELECT DISTINCT start_time, hour, day, week, month, year, weekday
+FROM time_staging
+ORDER BY start_time
+ON CONFLICT DO NOTHING;
+""")
+
+# `ON CONFLICT DO UPDATE` cannot touch the same row twice in one statement, so only the latest row
+# of each user in the file is applied (the row-by-row path ends up with that same 'level').
+user_table_bulk_insert = ("""
+INSERT INTO users (user_id, first_name, last_name, gender, level, level_ts)
+SELECT DISTINCT ON (user_id) user_id, first_name, last_name, gender, level, level_ts
+FROM user_staging
+ORDER BY user_id, level_ts DESC, seq DESC
+ON CONFLICT (user_id)
+DO UPDATE SET level = EXCLUDED.level, level_ts = EXCLUDED.level_ts
+WHERE users.level_ts IS NULL OR users.level_ts <= EXCLUDED.level_ts;
+""")
+
+# Same lookup as `song_select` (first match wins), but resolved for the whole file in one statement.
+songplay_table_bulk_insert = ("""
+INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+SELECT sp.start_time, sp.user_id, sp.level, m.song_id, m.artist_id, sp.session_id, sp.location, sp.user_agent
+FROM songplay_staging sp
+LEFT JOIN LATERAL (
+    SELECT s.song_id, a.artist_id
+    FROM songs s
+    JOIN artists a ON s.artist_id = a.artist_id
+    WHERE s.title = sp.song AND a.name = sp.artist AND s.duration = sp.length
+    LIMIT 1
+) m ON TRUE
+ORDER BY sp.seq
+ON CONFLICT DO NOTHING;
+""")
+
+songplay_table_bulk_insert_resolved = ("""
+INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+SELECT start_time, user_id, level, song_id, artist_id, session_id, location, user_agent
+FROM songplay_staging
+ORDER BY seq
+ON CONFLICT DO NOTHING;
+""")
+
+
+# INGESTION LEDGER
+
+ledger_select = ("""
+SELECT filepath, size, mtime, content_hash
+FROM ingest_ledger
+WHERE filepath LIKE %s;
+""")
+
+ledger_upsert = ("""
+INSERT INTO ingest_ledger (filepath, size, mtime, content_hash)
+VALUES (%s, %s, %s, %s)
+ON CONFLICT (filepath)
+DO UPDATE SET size = EXCLUDED.size, mtime = EXCLUDED.mtime, content_hash = EXCLUDED.content_hash, loaded_at = NOW();
+""")
+
+
+# TRANSACTION CONTROL
+
+# Every data file is processed in its own savepoint, so that one bad file can be rolled back
+# without losing the other files of the (batched) transaction.
+file_savepoint = "SAVEPOINT datafile"
+file_savepoint_release = "RELEASE SAVEPOINT datafile"
+file_savepoint_rollback = "ROLLBACK TO SAVEPOINT datafile"
+
+
 # FIND SONGS
 
 # From `etl.ipynb`, for 'songplays' table: -
@@ -168,8 +430,229 @@ JOIN artists a ON s.artist_id = a.artist_id
 WHERE s.title = %s AND a.name = %s AND s.duration = %s;
 """)
 
+# Loads every known song at once to build the in-memory `SongIndex` (see `song_index.py`).
+song_lookup_select = ("""
+SELECT s.song_id, s.title, a.artist_id, a.name, s.duration
+FROM songs s
+JOIN artists a ON s.artist_id = a.artist_id;
+""")
+
+
+# ROLLUPS
+
+# 'songplay_id' comes from a sequence when a row is inserted, not when it is committed: while a load is running,
+# rows with an id below MAX(songplay_id) can still be committed. The transactions loading songplays hold this
+# advisory lock in shared mode (until they end), and the readers of a songplay_id high-water mark (rollups,
+# Parquet export) hold it exclusively while they read MAX(songplay_id): every row below it is then committed,
+# and the rows inserted after they release it get higher ids.
+SONGPLAY_LOAD_LOCK = 7301
+songplay_load_lock = "SELECT pg_advisory_xact_lock_shared({})".format(SONGPLAY_LOAD_LOCK)
+songplay_high_water_lock = "SELECT pg_advisory_lock({})".format(SONGPLAY_LOAD_LOCK)
+songplay_high_water_unlock = "SELECT pg_advisory_unlock({})".format(SONGPLAY_LOAD_LOCK)
+
+# Songplays to add: 'songplay_id' in (last_songplay_id, MAX(songplay_id)], read once at the start of the update
+# (under `songplay_high_water_lock`) so that rows inserted meanwhile are left for the next one.
+rollup_bounds_select = ("""
+SELECT COALESCE((SELECT last_songplay_id FROM rollup_state WHERE source = 'songplays'), 0),
+    COALESCE((SELECT MAX(songplay_id) FROM songplays), 0);
+""")
+
+# Number of songplays in that range (the ids have gaps where loads were rolled back).
+rollup_new_rows_select = "SELECT COUNT(*) FROM songplays WHERE songplay_id > %s AND songplay_id <= %s"
+
+# Aggregates of the songplays with `songplay_id > %s AND songplay_id <= %s`, as the rollup tables store them.
+hour_rollup_select = ("""
+SELECT date_trunc('hour', start_time) AS start_hour, COALESCE(level, 'unknown') AS level, COUNT(*) AS plays
+FROM songplays
+WHERE songplay_id > %s AND songplay_id <= %s
+GROUP BY 1, 2
+""")
+
+song_rollup_select = ("""
+SELECT song_id, MAX(artist_id) AS artist_id, COUNT(*) AS plays
+FROM songplays
+WHERE songplay_id > %s AND songplay_id <= %s AND song_id IS NOT NULL
+GROUP BY song_id
+""")
+
+artist_rollup_select = ("""
+SELECT artist_id, COUNT(*) AS plays
+FROM songplays
+WHERE songplay_id > %s AND songplay_id <= %s AND artist_id IS NOT NULL
+GROUP BY artist_id
+""")
+
+# The new plays are added to the existing counts.
+hour_rollup_upsert = ("""
+INSERT INTO songplay_hour_rollup (start_hour, level, plays)
+{}
+ON CONFLICT (start_hour, level)
+DO UPDATE SET plays = songplay_hour_rollup.plays + EXCLUDED.plays;
+""").format(hour_rollup_select)
+
+song_rollup_upsert = ("""
+INSERT INTO songplay_song_rollup (song_id, artist_id, plays)
+{}
+ON CONFLICT (song_id)
+DO UPDATE SET plays = songplay_song_rollup.plays + EXCLUDED.plays;
+""").format(song_rollup_select)
+
+artist_rollup_upsert = ("""
+INSERT INTO songplay_artist_rollup (artist_id, plays)
+{}
+ON CONFLICT (artist_id)
+DO UPDATE SET plays = songplay_artist_rollup.plays + EXCLUDED.plays;
+""").format(artist_rollup_select)
+
+rollup_state_upsert = ("""
+INSERT INTO rollup_state (source, last_songplay_id)
+VALUES ('songplays', %s)
+ON CONFLICT (source)
+DO UPDATE SET last_songplay_id = EXCLUDED.last_songplay_id, updated_at = NOW();
+""")
+
+# Consistency checks: number of rows differing between a rollup table and the same aggregate recomputed from
+# `songplays` (up to 'last_songplay_id'), in either direction. Parameters: `(0, last_songplay_id)` twice.
+rollup_check = ("""
+SELECT COUNT(*) FROM (
+    (SELECT {columns} FROM {table} EXCEPT {select})
+    UNION ALL
+    ({select} EXCEPT SELECT {columns} FROM {table})
+) diff;
+""")
+
+hour_rollup_check = rollup_check.format(table='songplay_hour_rollup', columns='start_hour, level, plays', select=hour_rollup_select)
+song_rollup_check = rollup_check.format(table='songplay_song_rollup', columns='song_id, artist_id, plays', select=song_rollup_select)
+artist_rollup_check = rollup_check.format(table='songplay_artist_rollup', columns='artist_id, plays', select=artist_rollup_select)
+
+rollup_truncate = "TRUNCATE songplay_hour_rollup, songplay_song_rollup, songplay_artist_rollup, rollup_state"
+
+# Reports read from the rollups
+plays_per_day_select = ("""
+SELECT date_trunc('day', start_hour) AS day, level, SUM(plays) AS plays
+FROM songplay_hour_rollup
+GROUP BY 1, 2
+ORDER BY 1, 2;
+""")
+
+top_songs_select = ("""
+SELECT r.song_id, s.title, r.plays
+FROM songplay_song_rollup r
+LEFT JOIN songs s ON s.song_id = r.song_id
+ORDER BY r.plays DESC, r.song_id
+LIMIT %s;
+""")
+
+top_artists_select = ("""
+SELECT r.artist_id, a.name, r.plays
+FROM songplay_artist_rollup r
+LEFT JOIN artists a ON a.artist_id = r.artist_id
+ORDER BY r.plays DESC, r.artist_id
+LIMIT %s;
+""")
+
+
+# ANALYTICS (see `analytics.py`)
+
+# Every query takes a `[%s, %s)` range of 'start_time', so that only the matching monthly partitions are scanned.
+plays_per_period_select = ("""
+SELECT date_trunc(%s, start_time) AS period, level, COUNT(*) AS plays
+FROM songplays
+WHERE start_time >= %s AND start_time < %s
+GROUP BY 1, 2
+ORDER BY 1, 2;
+""")
+
+top_songs_period_select = ("""
+SELECT sp.song_id, s.title, a.name, COUNT(*) AS plays
+FROM songplays sp
+JOIN songs s ON s.song_id = sp.song_id
+LEFT JOIN artists a ON a.artist_id = sp.artist_id
+WHERE sp.start_time >= %s AND sp.start_time < %s
+GROUP BY sp.song_id, s.title, a.name
+ORDER BY plays DESC, sp.song_id
+LIMIT %s;
+""")
+
+top_artists_period_select = ("""
+SELECT sp.artist_id, a.name, COUNT(*) AS plays
+FROM songplays sp
+JOIN artists a ON a.artist_id = sp.artist_id
+WHERE sp.start_time >= %s AND sp.start_time < %s
+GROUP BY sp.artist_id, a.name
+ORDER BY plays DESC, sp.artist_id
+LIMIT %s;
+""")
+
+top_users_period_select = ("""
+SELECT sp.user_id, u.first_name, u.last_name, u.level, COUNT(*) AS plays
+FROM songplays sp
+JOIN users u ON u.user_id = sp.user_id
+WHERE sp.start_time >= %s AND sp.start_time < %s
+GROUP BY sp.user_id, u.first_name, u.last_name, u.level
+ORDER BY plays DESC, sp.user_id
+LIMIT %s;
+""")
+
+# Plays per hour of the day (0-23) and weekday, through the `time` dimension
+plays_by_hour_of_day_select = ("""
+SELECT t.weekday, t.hour, COUNT(*) AS plays
+FROM songplays sp
+JOIN time t ON t.start_time = sp.start_time
+WHERE sp.start_time >= %s AND sp.start_time < %s
+GROUP BY t.weekday, t.hour
+ORDER BY t.weekday, t.hour;
+""")
+
+user_activity_select = ("""
+SELECT date_trunc('day', start_time) AS day, level, COUNT(*) AS plays, COUNT(DISTINCT session_id) AS sessions
+FROM songplays
+WHERE user_id = %s AND start_time >= %s AND start_time < %s
+GROUP BY 1, 2
+ORDER BY 1, 2;
+""")
+
+
+# PARQUET EXPORT (see `export_parquet.py`)
+
+# Months of the songplays with `songplay_id > %s`, i.e. the partitions touched since the last export
+songplays_touched_months_select = ("""
+SELECT DISTINCT date_trunc('month', start_time)
+FROM songplays
+WHERE songplay_id > %s
+ORDER BY 1;
+""")
+
+songplays_max_id_select = "SELECT COALESCE(MAX(songplay_id), 0) FROM songplays"
+
+# One month of songplays (only its partition is scanned)
+songplays_export_select = ("""
+SELECT songplay_id, start_time, user_id, level, song_id, artist_id, session_id, location, user_agent
+FROM songplays
+WHERE start_time >= %s AND start_time < %s
+ORDER BY start_time, songplay_id;
+""")
+
+users_export_select = "SELECT user_id, first_name, last_name, gender, level FROM users ORDER BY user_id"
+songs_export_select = "SELECT song_id, title, artist_id, year, duration FROM songs ORDER BY song_id"
+artists_export_select = "SELECT artist_id, name, location, latitude, longitude FROM artists ORDER BY artist_id"
+time_export_select = "SELECT start_time, hour, day, week, month, year, weekday FROM time ORDER BY start_time"
+
 
 # QUERY LISTS
 
-create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
\ No newline at end of file
+create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, ledger_table_create,
+                        hour_rollup_table_create, song_rollup_table_create, artist_rollup_table_create, rollup_state_table_create, load_epoch_create]
+drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, ledger_table_drop,
+                      hour_rollup_table_drop, song_rollup_table_drop, artist_rollup_table_drop, rollup_state_table_drop, load_epoch_drop]
+staging_table_queries = [time_staging_create, user_staging_create, songplay_staging_create]
+# Built once `song_data` is loaded, before the songplays are resolved
+lookup_index_queries = [artist_name_index_create, song_title_index_create]
+lookup_analyze_queries = [songs_analyze, artists_analyze]
+# Built once `log_data` is loaded
+songplay_index_queries = [songplay_pkey_create, songplay_start_time_index_create, songplay_user_index_create, songplay_song_index_create]
+songplay_analyze_queries = [songplays_analyze, users_analyze, time_analyze]
+create_index_queries = lookup_index_queries + songplay_index_queries
+deferred_index_queries = [songplay_pkey_drop]
+rollup_upsert_queries = [hour_rollup_upsert, song_rollup_upsert, artist_rollup_upsert]
+rollup_check_queries = {'songplay_hour_rollup': hour_rollup_check, 'songplay_song_rollup': song_rollup_check, 'songplay_artist_rollup': artist_rollup_check}
@@ -0,0 +1,367 @@
+# Import all the necessary packages
+import csv
+import time
+import argparse
+import threading
+from operator import attrgetter
+from collections import namedtuple, OrderedDict, Counter
+from cql_queries import keyspace_create, create_table_queries, drop_table_queries
+from cql_queries import song_details_insert, listening_history_insert, user_history_insert
+from cql_queries import listening_history_bucketed_insert, user_history_bucketed_insert
+
+
+EVENT_FILE = 'event_datafile_new.csv'
+
+# One row of `event_datafile_new.csv`, with its values converted
+Event = namedtuple('Event', ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+                             'level', 'location', 'sessionId', 'song', 'userId'])
+
+# Buckets of the bucketed variants (see `partition_analyzer.py` for the sizes they lead to)
+SESSION_BUCKET_SIZE = 100
+USER_HISTORY_BUCKETS = 8
+
+
+def session_bucket(event):
+    return event.sessionId // SESSION_BUCKET_SIZE
+
+
+def user_bucket(event):
+    return event.userId % USER_HISTORY_BUCKETS
+
+
+class QueryTable:
+    """
+    Declaration of a query table fed from `event_datafile_new.csv`.
+
+    Adding a table to `QUERY_TABLES` is enough for the loader to fill it, in the same pass over the file
+    as the other tables.
+
+    Parameters
+    ----------
+    name : str
+        Name of the table.
+    insert : str
+        Prepared INSERT of the table (see `cql_queries.py`).
+    columns : tuple of str
+        `Event` fields bound to the markers of `insert`, in order.
+    partition_key : tuple of str
+        `Event` fields making up the partition key of the table (rows are batched on it).
+    bucket : callable
+        For bucketed tables: computes the value of the 'bucket' column (listed in `columns` and `partition_key`)
+        from an event.
+    """
+
+    def __init__(self, name, insert, columns, partition_key, bucket=None):
+        self.name = name
+        self.insert = insert
+        self.columns = columns
+        self.partition_key = partition_key
+        self.bucket = bucket
+        if bucket is None:
+            # `attrgetter` of a single field returns the value itself, the markers are always bound to a tuple
+            self.values = attrgetter(*columns) if len(columns) > 1 else lambda event: (getattr(event, columns[0]),)
+            self.key = attrgetter(*partition_key)
+        else:
+            self.values = self._getter(columns)
+            self.key = self._getter(partition_key)
+
+    def _getter(self, fields):
+        return lambda event: tuple(self.bucket(event) if field == 'bucket' else getattr(event, field) for field in fields)
+
+
+QUERY_TABLES = [
+    QueryTable('song_details', song_details_insert,
+               columns=('sessionId', 'itemInSession', 'artist', 'song', 'length'),
+               partition_key=('sessionId',)),
+    QueryTable('listening_history', listening_history_insert,
+               columns=('userId', 'sessionId', 'itemInSession', 'artist', 'song', 'firstName', 'lastName'),
+               partition_key=('userId',)),
+    QueryTable('user_history', user_history_insert,
+               columns=('song', 'userId', 'firstName', 'lastName'),
+               partition_key=('song',)),
+    QueryTable('listening_history_bucketed', listening_history_bucketed_insert,
+               columns=('userId', 'bucket', 'sessionId', 'itemInSession', 'artist', 'song', 'firstName', 'lastName'),
+               partition_key=('userId', 'bucket'), bucket=session_bucket),
+    QueryTable('user_history_bucketed', user_history_bucketed_insert,
+               columns=('song', 'bucket', 'userId', 'firstName', 'lastName'),
+               partition_key=('song', 'bucket'), bucket=user_bucket),
+]
+
+TABLES = OrderedDict((table.name, table) for table in QUERY_TABLES)
+
+
+def read_events(path=EVENT_FILE):
+    """
+    Yields the rows of `event_datafile_new.csv` as `Event`s, with the integer and float columns converted.
+    """
+    with open(path, encoding='utf8', newline='') as f:
+        csvreader = csv.reader(f)
+        next(csvreader)  # skip header
+
+        for line in csvreader:
+            yield Event(line[0], line[1], line[2], int(line[3]), line[4], float(line[5]),
+                        line[6], line[7], int(line[8]), line[9], int(line[10]))
+
+
+def unlogged_batch(prepared, rows):
+    """
+    UNLOGGED batch of the statement `prepared` with every values of `rows`.
+
+    Only rows of one partition should be batched together: the batch is then applied as a single mutation
+    by the replicas of that partition, instead of being spread by the coordinator over the cluster.
+    """
+    # the driver is only needed against a real cluster, the stub runs without it
+    from cassandra.query import BatchStatement, BatchType
+
+    batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+    for values in rows:
+        batch.add(prepared, values)
+    return batch
+
+
+class ConcurrentWriter:
+    """
+    Executes statements asynchronously, with at most `concurrency` requests in flight.
+
+    `submit` blocks while the limit is reached, and a slot is freed as soon as the response of a request
+    arrives (in the driver's callback), so the session is kept busy without queuing an unbounded number of requests.
+
+    Parameters
+    ----------
+    session :
+        `cassandra.cluster.Session` (or `stub_session.StubSession`).
+    concurrency : int
+        Maximum number of requests in flight.
+    """
+
+    def __init__(self, session, concurrency=32):
+        self.session = session
+        self.concurrency = concurrency
+        self.rows = Counter()
+        self.requests = Counter()
+        self.errors = []
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+
+    def submit(self, statement, parameters=None, rows=1, table=None):
+        """
+        Sends `statement` (covering `rows` rows of `table`) once a slot is free.
+        """
+        if self.errors:
+            self.wait()
+        self._slots.acquire()
+        try:
+            future = self.session.execute_async(statement, parameters)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_callbacks(self._done, self._failed, callback_args=(table, rows))
+
+    def _done(self, result, table, rows):
+        with self._lock:
+            self.rows[table] += rows
+            self.requests[table] += 1
+        self._slots.release()
+
+    def _failed(self, error):
+        with self._lock:
+            self.errors.append(error)
+        self._slots.release()
+
+    def wait(self):
+        """
+        Waits for every request in flight, and raises the first error of a failed request.
+        """
+        for _ in range(self.concurrency):
+            self._slots.acquire()
+        for _ in range(self.concurrency):
+            self._slots.release()
+        if self.errors:
+            raise self.errors[0]
+
+
+class TableWriter:
+    """
+    Sends the rows of one query table through a `ConcurrentWriter`, one by one or in per-partition batches.
+
+    With `batch_size` above 1, the rows are grouped by partition key and sent as UNLOGGED batches of up to
+    `batch_size` rows of the same partition. Rows wait for their batch in at most `max_pending` partitions:
+    when more are pending, the oldest one is sent as is, so memory stays bounded whatever the data.
+    """
+
+    def __init__(self, session, table, writer, batch_size=1, max_pending=1000, batch_factory=unlogged_batch):
+        self.table = table
+        self.prepared = session.prepare(table.insert)
+        self.writer = writer
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.batch_factory = batch_factory
+        self.pending = OrderedDict()
+
+    def add(self, event):
+        if self.batch_size <= 1:
+            self.writer.submit(self.prepared, self.table.values(event), table=self.table.name)
+            return
+
+        key = self.table.key(event)
+        rows = self.pending.setdefault(key, [])
+        rows.append(self.table.values(event))
+        if len(rows) >= self.batch_size:
+            self.send(self.pending.pop(key))
+        elif len(self.pending) > self.max_pending:
+            self.send(self.pending.popitem(last=False)[1])
+
+    def send(self, rows):
+        self.writer.submit(self.batch_factory(self.prepared, rows), rows=len(rows), table=self.table.name)
+
+    def flush(self):
+        while self.pending:
+            self.send(self.pending.popitem(last=False)[1])
+
+
+def load_tables(session, tables, events, concurrency=32, batch_size=1, max_pending=1000, batch_factory=unlogged_batch):
+    """
+    Inserts the rows of `events` into every query table of `tables`, in a single pass over `events`.
+
+    - Every event is read and converted once, then fanned out to the tables: the cost of parsing does not
+    grow with the number of query tables.
+
+    - The prepared INSERTs of all the tables share the same limit of requests in flight.
+
+    Parameters
+    ----------
+    session :
+        `cassandra.cluster.Session` (or `stub_session.StubSession`), with the keyspace set.
+    tables : list of QueryTable
+        Query tables to fill (see `QUERY_TABLES`).
+    events : iterable of Event
+        Rows to insert (see `read_events`).
+    concurrency : int
+        Maximum number of requests in flight.
+    batch_size : int
+        Maximum number of rows per batch (1: no batches).
+    max_pending : int
+        Maximum number of partitions with rows waiting for their batch, per table.
+    batch_factory : callable
+        Builds a batch from a prepared statement and rows (`stub_session.stub_batch` for a `StubSession`).
+
+    Returns
+    -------
+    tuple
+        Number of events read, and number of rows inserted and of requests sent per table.
+    """
+    writer = ConcurrentWriter(session, concurrency)
+    table_writers = [TableWriter(session, table, writer, batch_size, max_pending, batch_factory) for table in tables]
+
+    read = 0
+    for event in events:
+        read += 1
+        for table_writer in table_writers:
+            table_writer.add(event)
+    for table_writer in table_writers:
+        table_writer.flush()
+
+    writer.wait()
+    return read, dict(writer.rows), dict(writer.requests)
+
+
+def load_table(session, table, events, concurrency=32, batch_size=1, max_pending=1000, batch_factory=unlogged_batch):
+    """
+    Inserts the rows of `events` into the query table named `table` (see `load_tables`).
+
+    Returns
+    -------
+    tuple
+        Number of rows inserted and number of requests sent.
+    """
+    read, rows, requests = load_tables(session, [TABLES[table]], events, concurrency, batch_size, max_pending, batch_factory)
+    return rows.get(table, 0), requests.get(table, 0)
+
+
+def reset_tables(session):
+    """
+    Drops and creates the query tables using the queries in `drop_table_queries` and `create_table_queries`.
+    """
+    for query in drop_table_queries + create_table_queries:
+        session.execute(query)
+
+
+def connect(hosts=('127.0.0.1',), stub=False, latency=0.0005):
+    """
+    - Connects to the Cassandra cluster at `hosts` (or creates a `StubSession`).
+    - Creates the `sparkifydb` keyspace and sets it on the session.
+    - Returns the cluster (None for the stub) and the session.
+    """
+    if stub:
+        from stub_session import StubSession
+        cluster, session = None, StubSession(latency=latency)
+    else:
+        from cassandra.cluster import Cluster
+        cluster = Cluster(list(hosts))
+        session = cluster.connect()
+
+    session.execute(keyspace_create)
+    session.set_keyspace('sparkifydb')
+
+    return cluster, session
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load event_datafile_new.csv into the Cassandra query tables and report rows/sec.')
+    parser.add_argument('--file', default=EVENT_FILE, help='Event data file (default: {}).'.format(EVENT_FILE))
+    parser.add_argument('--hosts', nargs='+', default=['127.0.0.1'], help='Contact points of the cluster (default: 127.0.0.1).')
+    parser.add_argument('--tables', nargs='+', default=list(TABLES), choices=list(TABLES), help='Query tables to load (default: all).')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128], metavar='N',
+                        help='Maximum requests in flight; the load is repeated for every value (default: 1 8 32 128).')
+    parser.add_argument('--batch-size', type=int, default=1, metavar='N',
+                        help='Send UNLOGGED batches of up to N rows of the same partition (default: 1, no batches).')
+    parser.add_argument('--separate-passes', action='store_true',
+                        help='Read the file once per table, as the notebook does, instead of once for all the tables.')
+    parser.add_argument('--stub', action='store_true', help='Load into an in-memory stub session instead of a cluster.')
+    parser.add_argument('--latency', type=float, default=0.0005, help='Round trip time of the stub session in seconds (default: 0.0005).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Recreates the query tables and loads `event_datafile_new.csv` into them, once per `--concurrency` level:
+    in a single pass over the file, or in one pass per table with `--separate-passes`.
+
+    - Prints the rows and requests of every table, and the events read and rows written per second
+    (the time includes reading and converting the file).
+    """
+    args = parse_args(argv)
+    cluster, session = connect(args.hosts, args.stub, args.latency)
+    if args.stub:
+        from stub_session import stub_batch
+        batch_factory = stub_batch
+    else:
+        batch_factory = unlogged_batch
+
+    tables = [TABLES[name] for name in args.tables]
+    passes = [[table] for table in tables] if args.separate_passes else [tables]
+
+    for concurrency in args.concurrency:
+        reset_tables(session)
+        read, rows, requests = 0, Counter(), Counter()
+        start = time.perf_counter()
+        for pass_tables in passes:
+            pass_read, pass_rows, pass_requests = load_tables(session, pass_tables, read_events(args.file), concurrency,
+                                                              args.batch_size, batch_factory=batch_factory)
+            read += pass_read
+            rows.update(pass_rows)
+            requests.update(pass_requests)
+        seconds = time.perf_counter() - start
+
+        for table in tables:
+            print('{:<28} {:>8} rows {:>8} requests'.format(table.name, rows[table.name], requests[table.name]))
+        print('concurrency {:>4}: {} events read in {} pass(es), {:.0f} events/sec, {:.0f} rows/sec'.format(
+            concurrency, read, len(passes), read / seconds, sum(rows.values()) / seconds))
+
+    session.shutdown()
+    if cluster is not None:
+        cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
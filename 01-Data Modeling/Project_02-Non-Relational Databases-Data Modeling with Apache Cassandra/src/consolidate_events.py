@@ -0,0 +1,154 @@
+# Import all the necessary packages
+import os
+import csv
+import sys
+import glob
+import time
+import argparse
+import resource
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+EVENTS_DIR = 'event_data'
+OUTPUT_FILE = 'event_datafile_new.csv'
+
+HEADER = ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level', 'location', 'sessionId', 'song', 'userId']
+# Positions of the `HEADER` columns in the original event files
+COLUMNS = (0, 2, 3, 4, 5, 6, 7, 8, 12, 13, 16)
+
+csv.register_dialect('myDialect', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+
+def event_files(events_dir=EVENTS_DIR):
+    """
+    Returns the paths of the event files, sorted so that the output is the same on every run and platform.
+    """
+    return sorted(glob.glob(os.path.join(events_dir, '**', '*.csv'), recursive=True))
+
+
+def project_rows(path):
+    """
+    Yields the song plays of one event file (rows with an artist), projected on the `HEADER` columns.
+    """
+    with open(path, 'r', encoding='utf8', newline='') as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader)
+
+        for row in csvreader:
+            if row[0] == '':
+                continue
+            yield tuple(row[i] for i in COLUMNS)
+
+
+def read_file(path):
+    """
+    Returns the projected rows of one event file (run in the worker processes).
+    """
+    return list(project_rows(path))
+
+
+def stream_rows(paths, workers=1):
+    """
+    Yields the projected rows of `paths`, file by file and in the order of `paths`.
+
+    - With one worker, the files are read lazily, a row at a time.
+
+    - With more, the files are parsed in `workers` processes. At most `2 * workers` files are parsed ahead of
+    the one being written, so memory is bounded by a few files whatever the number of files.
+    """
+    if workers <= 1:
+        for path in paths:
+            yield from project_rows(path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        paths = iter(paths)
+        in_flight = deque()
+        for path in paths:
+            in_flight.append(executor.submit(read_file, path))
+            if len(in_flight) >= 2 * workers:
+                break
+
+        while in_flight:
+            rows = in_flight.popleft().result()
+            path = next(paths, None)
+            if path is not None:
+                in_flight.append(executor.submit(read_file, path))
+            yield from rows
+
+
+def consolidate(paths, output=OUTPUT_FILE, workers=1):
+    """
+    Writes the song plays of the event files `paths` to `output`, streamed file by file.
+
+    The file is written under a temporary name and renamed once complete.
+
+    Parameters
+    ----------
+    paths : list of str
+        Event files, in the order of the output.
+    output : str
+        Path of the consolidated file.
+    workers : int
+        Number of processes parsing the event files.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+    """
+    tmp_output = output + '.tmp'
+    written = 0
+
+    with open(tmp_output, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f, dialect='myDialect')
+        writer.writerow(HEADER)
+        for row in stream_rows(paths, workers):
+            writer.writerow(row)
+            written += 1
+
+    os.replace(tmp_output, output)
+    return written
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size (in MB) of this process and of its finished child processes.
+    """
+    # `ru_maxrss` is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(max(own, children), 1)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Merge the event files into event_datafile_new.csv in constant memory.')
+    parser.add_argument('--events-dir', default=EVENTS_DIR, help='Folder of the event files (default: {}).'.format(EVENTS_DIR))
+    parser.add_argument('--output', default=OUTPUT_FILE, help='Consolidated file (default: {}).'.format(OUTPUT_FILE))
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help='Parse the event files in N processes; the output order does not change (default: 1).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Writes the song plays of every event file to `event_datafile_new.csv`.
+
+    - Prints the number of files and rows, the rows/sec and the peak RSS.
+    """
+    args = parse_args(argv)
+    paths = event_files(args.events_dir)
+
+    start = time.perf_counter()
+    written = consolidate(paths, args.output, args.workers)
+    seconds = time.perf_counter() - start
+
+    print('{} files, {} rows written to {} in {:.2f}s ({:.0f} rows/sec), peak RSS {} MB'.format(
+        len(paths), written, args.output, seconds, written / seconds if seconds else 0.0, peak_rss_mb()))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# KEYSPACE
+
+keyspace_create = ("""
+CREATE KEYSPACE IF NOT EXISTS sparkifydb
+WITH REPLICATION = { 'class' : 'SimpleStrategy', 'replication_factor' : 1 }
+""")
+
+
+# DROP TABLES
+
+song_details_drop = "DROP TABLE IF EXISTS song_details"
+listening_history_drop = "DROP TABLE IF EXISTS listening_history"
+user_history_drop = "DROP TABLE IF EXISTS user_history"
+listening_history_bucketed_drop = "DROP TABLE IF EXISTS listening_history_bucketed"
+user_history_bucketed_drop = "DROP TABLE IF EXISTS user_history_bucketed"
+
+
+# CREATE TABLES
+
+###   References:   ###
+#         - https://cassandra.apache.org/doc/latest/cassandra/cql/ddl.html#primary-key
+#         - https://docs.datastax.com/en/developer/python-driver/latest/getting_started/#prepared-statements
+
+
+#----- Columns of `event_datafile_new.csv` -----#
+# `artist`: 0, `firstName`: 1, `gender`: 2,
+# `itemInSession`: 3, `lastName`: 4, `length`: 5,
+# `level`: 6, `location`: 7, `sessionId`: 8, `song`: 9, `userId`: 10
+
+
+# QUERY-1: artist, song and length of the song heard during a given sessionId and itemInSession
+song_details_create = ("""
+CREATE TABLE IF NOT EXISTS song_details (
+sessionId INT, itemInSession INT,
+artist TEXT, song TEXT, length FLOAT,
+PRIMARY KEY (sessionId, itemInSession))
+""")
+
+# QUERY-2: artist, song (sorted by itemInSession) and user name for a given userId and sessionId
+listening_history_create = ("""
+CREATE TABLE IF NOT EXISTS listening_history (
+userId INT, sessionId INT, itemInSession INT,
+artist TEXT, song TEXT, firstName TEXT, lastName TEXT,
+PRIMARY KEY (userId, sessionId, itemInSession))
+""")
+
+# QUERY-3: every user name who listened to a given song
+user_history_create = ("""
+CREATE TABLE IF NOT EXISTS user_history (
+song TEXT, userId INT, firstName TEXT, lastName TEXT,
+PRIMARY KEY ((song), userId))
+""")
+
+
+# BUCKETED VARIANTS (see `partition_analyzer.py`)
+
+# QUERY-2 with the history of a user split in buckets of consecutive sessions (sessionId // SESSION_BUCKET_SIZE):
+# sessions are numbered in time order, so a partition stops growing once the user has moved on to later sessions,
+# and the bucket of a query is known from its sessionId
+listening_history_bucketed_create = ("""
+CREATE TABLE IF NOT EXISTS listening_history_bucketed (
+userId INT, bucket INT, sessionId INT, itemInSession INT,
+artist TEXT, song TEXT, firstName TEXT, lastName TEXT,
+PRIMARY KEY ((userId, bucket), sessionId, itemInSession))
+""")
+
+# QUERY-3 with the listeners of a song spread over USER_HISTORY_BUCKETS partitions (userId % USER_HISTORY_BUCKETS),
+# read back in parallel
+user_history_bucketed_create = ("""
+CREATE TABLE IF NOT EXISTS user_history_bucketed (
+song TEXT, bucket INT, userId INT, firstName TEXT, lastName TEXT,
+PRIMARY KEY ((song, bucket), userId))
+""")
+
+
+# INSERT RECORDS
+
+# `?` markers: the statements are prepared once, then only the values are sent for every row
+song_details_insert = ("""
+INSERT INTO song_details (sessionId, itemInSession, artist, song, length)
+VALUES (?, ?, ?, ?, ?)
+""")
+
+listening_history_insert = ("""
+INSERT INTO listening_history (userId, sessionId, itemInSession, artist, song, firstName, lastName)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+""")
+
+user_history_insert = ("""
+INSERT INTO user_history (song, userId, firstName, lastName)
+VALUES (?, ?, ?, ?)
+""")
+
+listening_history_bucketed_insert = ("""
+INSERT INTO listening_history_bucketed (userId, bucket, sessionId, itemInSession, artist, song, firstName, lastName)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+""")
+
+user_history_bucketed_insert = ("""
+INSERT INTO user_history_bucketed (song, bucket, userId, firstName, lastName)
+VALUES (?, ?, ?, ?, ?)
+""")
+
+
+# SELECT QUERIES
+
+song_details_select = "SELECT artist, song, length FROM song_details WHERE sessionId = ? AND itemInSession = ?"
+listening_history_select = "SELECT artist, song, firstName, lastName FROM listening_history WHERE userId = ? AND sessionId = ?"
+user_history_select = "SELECT firstName, lastName FROM user_history WHERE song = ?"
+listening_history_bucketed_select = ("SELECT artist, song, firstName, lastName FROM listening_history_bucketed "
+                                     "WHERE userId = ? AND bucket = ? AND sessionId = ?")
+user_history_bucketed_select = "SELECT userId, firstName, lastName FROM user_history_bucketed WHERE song = ? AND bucket = ?"
+
+
+# QUERY LISTS
+
+create_table_queries = [song_details_create, listening_history_create, user_history_create,
+                        listening_history_bucketed_create, user_history_bucketed_create]
+drop_table_queries = [song_details_drop, listening_history_drop, user_history_drop,
+                      listening_history_bucketed_drop, user_history_bucketed_drop]
@@ -0,0 +1,243 @@
+# Import all the necessary packages
+import math
+import argparse
+from cql_queries import create_table_queries, listening_history_select, user_history_select
+from cql_queries import listening_history_bucketed_select, user_history_bucketed_select
+from cassandra_loader import EVENT_FILE, TABLES, SESSION_BUCKET_SIZE, USER_HISTORY_BUCKETS
+from cassandra_loader import read_events, connect, reset_tables, load_tables
+from stub_session import Table, stub_batch
+
+
+# Bytes of the fixed size CQL types (TEXT is its UTF-8 length)
+TYPE_SIZES = {'INT': 4, 'BIGINT': 8, 'FLOAT': 4, 'DOUBLE': 8, 'BOOLEAN': 1, 'TIMESTAMP': 8}
+# Approximate storage overhead of a row (flags, size, clustering header) and of every cell (flags, timestamp delta)
+ROW_OVERHEAD = 8
+CELL_OVERHEAD = 8
+
+# Tables whose partition key includes the session (or a bucket of consecutive sessions): sessions are numbered
+# in time order, so a larger history adds partitions instead of growing them
+TIME_BOUNDED = {'song_details', 'listening_history_bucketed'}
+
+# Bucketed variant of the tables that have one
+VARIANTS = {'listening_history': 'listening_history_bucketed', 'user_history': 'user_history_bucketed'}
+
+
+def value_size(value, cql_type):
+    if cql_type in TYPE_SIZES:
+        return TYPE_SIZES[cql_type]
+    return len(str(value).encode('utf8'))
+
+
+class KeyDesign:
+    """
+    Primary key of a query table, as declared in `cql_queries.py`, with the `Event` fields of its columns.
+    """
+
+    def __init__(self, table, ddl):
+        self.name = table.name
+        self.table = table
+        self.ddl = Table.from_ddl(ddl)
+        field = {column.lower(): column for column in table.columns}
+        self.clustering = [field[column] for column in self.ddl.clustering]
+        self.regular = [field[column] for column in self.ddl.columns
+                        if column not in self.ddl.partition_key and column not in self.ddl.clustering]
+        self.types = {field[column]: cql_type for column, cql_type in self.ddl.types.items()}
+
+    def primary_key(self):
+        return '(({}){})'.format(', '.join(self.ddl.partition_key), ''.join(', ' + column for column in self.ddl.clustering))
+
+    def value(self, event, column):
+        return self.table.bucket(event) if column == 'bucket' else getattr(event, column)
+
+    def row_bytes(self, event):
+        size = ROW_OVERHEAD + sum(value_size(self.value(event, column), self.types[column]) for column in self.clustering)
+        return size + sum(CELL_OVERHEAD + value_size(self.value(event, column), self.types[column]) for column in self.regular)
+
+    def key_bytes(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        return sum(value_size(value, self.types[column]) for value, column in zip(key, self.table.partition_key))
+
+
+def key_designs(tables):
+    ddls = {Table.from_ddl(query).name: query for query in create_table_queries}
+    return [KeyDesign(table, ddls[table.name]) for table in tables]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)] if ordered else 0
+
+
+def analyze(designs, events):
+    """
+    Computes the partitions of every key design from `events`, in one pass.
+
+    Rows with the same primary key are counted once (an INSERT of an existing key is an upsert).
+
+    Returns
+    -------
+    dict
+        Per table: number of partitions and rows, mean/p99/max rows per partition, mean/max estimated bytes
+        per partition, skew (max / mean bytes) and the largest partition keys.
+    """
+    partitions = {design.name: {} for design in designs}
+    for event in events:
+        for design in designs:
+            partition = partitions[design.name].setdefault(design.table.key(event), {})
+            partition[tuple(design.value(event, column) for column in design.clustering)] = design.row_bytes(event)
+
+    results = {}
+    for design in designs:
+        sizes = {key: (len(rows), design.key_bytes(key) + sum(rows.values())) for key, rows in partitions[design.name].items()}
+        rows = [count for count, size in sizes.values()]
+        sizes_bytes = [size for count, size in sizes.values()]
+        mean_bytes = sum(sizes_bytes) / len(sizes_bytes) if sizes_bytes else 0.0
+        results[design.name] = {
+            'partitions': len(sizes),
+            'rows': sum(rows),
+            'mean_rows': sum(rows) / len(rows) if rows else 0.0,
+            'p99_rows': percentile(rows, 0.99),
+            'max_rows': max(rows, default=0),
+            'mean_bytes': mean_bytes,
+            'max_bytes': max(sizes_bytes, default=0),
+            'skew': max(sizes_bytes, default=0) / mean_bytes if mean_bytes else 0.0,
+            'largest': sorted(sizes, key=lambda key: sizes[key][1], reverse=True)[:3],
+        }
+    return results
+
+
+def flag(name, stats, scale, max_bytes, max_rows, max_skew):
+    """
+    Returns the problems of a table once the history is `scale` times larger:
+    'oversized' if its largest partition exceeds `max_bytes` or `max_rows`, 'skewed' if it is more than
+    `max_skew` times the mean partition while growing with the history (the partitions of `TIME_BOUNDED`
+    tables stop growing, however uneven they are).
+    """
+    bounded = name in TIME_BOUNDED
+    growth = 1 if bounded else scale
+    flags = []
+    if stats['max_bytes'] * growth > max_bytes or stats['max_rows'] * growth > max_rows:
+        flags.append('oversized')
+    if stats['skew'] > max_skew and not bounded:
+        flags.append('skewed')
+    return flags
+
+
+def recommend_buckets(stats, scale, max_bytes, max_rows, max_skew):
+    """
+    Number of hash buckets keeping the largest partition, `scale` times larger, under half of the limits,
+    and within `max_skew` times the mean partition.
+    """
+    needed = max(stats['max_bytes'] * scale / (max_bytes / 2), stats['max_rows'] * scale / (max_rows / 2),
+                 stats['skew'] / max_skew)
+    return max(1, int(math.ceil(needed)))
+
+
+def songs_by_user_session(session, prepared, user_id, session_id):
+    """
+    QUERY-2 on `listening_history_bucketed`: the bucket follows from the sessionId, a single partition is read.
+    """
+    return list(session.execute(prepared, (user_id, session_id // SESSION_BUCKET_SIZE, session_id)))
+
+
+def users_by_song(session, prepared, song, buckets=USER_HISTORY_BUCKETS):
+    """
+    QUERY-3 on `user_history_bucketed`: the `buckets` partitions of the song are read in parallel
+    and their rows merged in userId order.
+    """
+    futures = [session.execute_async(prepared, (song, bucket)) for bucket in range(buckets)]
+    rows = [row for future in futures for row in future.result()]
+    return sorted(rows, key=lambda row: row.userid)
+
+
+def check_reads(events, samples=200):
+    """
+    Loads the tables into a stub session and compares the bucketed reads with the reads of the original tables,
+    for up to `samples` songs and sessions. Returns the number of keys compared and of mismatches.
+    """
+    cluster, session = connect(stub=True, latency=0)
+    reset_tables(session)
+    load_tables(session, list(TABLES.values()), events, batch_factory=stub_batch)
+
+    songs = sorted({event.song for event in events})[:samples]
+    sessions = sorted({(event.userId, event.sessionId) for event in events})[:samples]
+    prepared = {query: session.prepare(query) for query in (listening_history_select, user_history_select,
+                                                             listening_history_bucketed_select, user_history_bucketed_select)}
+
+    mismatches = 0
+    for song in songs:
+        expected = [tuple(row) for row in session.execute(prepared[user_history_select], (song,))]
+        found = [(row.firstname, row.lastname) for row in users_by_song(session, prepared[user_history_bucketed_select], song)]
+        mismatches += expected != found
+    for user_id, session_id in sessions:
+        expected = session.execute(prepared[listening_history_select], (user_id, session_id))
+        found = songs_by_user_session(session, prepared[listening_history_bucketed_select], user_id, session_id)
+        mismatches += [tuple(row) for row in expected] != [tuple(row) for row in found]
+
+    session.shutdown()
+    return len(songs) + len(sessions), mismatches
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Partition sizes of the Cassandra query tables, computed from event_datafile_new.csv.')
+    parser.add_argument('--file', default=EVENT_FILE, help='Event data file (default: {}).'.format(EVENT_FILE))
+    parser.add_argument('--tables', nargs='+', default=list(TABLES), choices=list(TABLES), help='Tables to analyze (default: all).')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Project the partition sizes for a history SCALE times larger than the file (default: 1).')
+    parser.add_argument('--max-mb', type=float, default=100, help='Largest acceptable partition in MB (default: 100).')
+    parser.add_argument('--max-rows', type=int, default=100000, help='Largest acceptable partition in rows (default: 100000).')
+    parser.add_argument('--max-skew', type=float, default=10,
+                        help='Largest acceptable ratio between the largest and the mean partition (default: 10).')
+    parser.add_argument('--check-reads', action='store_true',
+                        help='Load a stub session and check that the bucketed reads return the same rows as the original tables.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Prints the partitions, rows and estimated bytes per partition of every table, and flags the
+    oversized and skewed ones.
+
+    - For the flagged tables with a bucketed variant, prints the variant and the number of buckets it needs.
+    """
+    args = parse_args(argv)
+    max_bytes = args.max_mb * 1024 * 1024
+    events = list(read_events(args.file))
+    designs = key_designs([TABLES[name] for name in args.tables])
+    results = analyze(designs, events)
+
+    print('{:<28} {:<44} {:>10} {:>8} {:>9} {:>8} {:>8} {:>12} {:>7}  {}'.format(
+        'table', 'primary key', 'partitions', 'rows', 'mean rows', 'p99 rows', 'max rows', 'max bytes', 'skew', 'flags'))
+    for design in designs:
+        stats = results[design.name]
+        print('{:<28} {:<44} {:>10} {:>8} {:>9.1f} {:>8} {:>8} {:>12} {:>7.1f}  {}'.format(
+            design.name, design.primary_key(), stats['partitions'], stats['rows'], stats['mean_rows'], stats['p99_rows'], stats['max_rows'],
+            stats['max_bytes'], stats['skew'], ', '.join(flag(design.name, stats, args.scale, max_bytes, args.max_rows, args.max_skew))))
+
+    for design in designs:
+        stats = results[design.name]
+        flags = flag(design.name, stats, args.scale, max_bytes, args.max_rows, args.max_skew)
+        if not flags or design.name not in VARIANTS:
+            continue
+        variant = VARIANTS[design.name]
+        print('\n{} is {}: largest partitions {}'.format(design.name, ' and '.join(flags), stats['largest']))
+        if variant == 'user_history_bucketed':
+            print('    use {} with USER_HISTORY_BUCKETS = {} (currently {})'.format(
+                variant, recommend_buckets(stats, args.scale, max_bytes, args.max_rows, args.max_skew), USER_HISTORY_BUCKETS))
+        else:
+            print('    use {} (SESSION_BUCKET_SIZE = {}): its partitions only grow with the sessions of one bucket'.format(
+                variant, SESSION_BUCKET_SIZE))
+        if variant in results:
+            print('    {}: largest partition {} rows / {} bytes, skew {:.1f}'.format(
+                variant, results[variant]['max_rows'], results[variant]['max_bytes'], results[variant]['skew']))
+
+    if args.check_reads:
+        compared, mismatches = check_reads(events)
+        print('\n{} keys read from the bucketed variants, {} mismatches'.format(compared, mismatches))
+        if mismatches:
+            raise SystemExit(1)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# Import all the necessary packages
+import time
+import random
+import argparse
+import threading
+from collections import OrderedDict, defaultdict
+from cql_queries import song_details_select, listening_history_select, user_history_select
+from cql_queries import listening_history_bucketed_select, user_history_bucketed_select
+from cassandra_loader import EVENT_FILE, TABLES, SESSION_BUCKET_SIZE, USER_HISTORY_BUCKETS
+from cassandra_loader import read_events, reset_tables, load_tables, unlogged_batch
+from cassandra_loader import connect as loader_connect
+
+
+class ResultCache:
+    """
+    LRU cache of query results, bounded by number of entries, whose entries expire after `ttl` seconds.
+
+    Cassandra does not tell when a partition changes: `ttl` bounds how stale a cached result can be.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of cached results.
+    ttl : float
+        Seconds a result stays valid.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the rows cached for `key`, or None if there are none or they expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, rows):
+        with self._lock:
+            self._entries[key] = (rows, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class QueryAPI:
+    """
+    The three Sparkify queries as functions, for low-latency serving.
+
+    - The SELECTs are prepared once: every call only sends the values, and the driver knows the partition
+    key of the request, so a token-aware session sends it straight to a replica of the partition (see `connect`).
+
+    - Results are read in pages of `fetch_size` rows: a large partition is never returned in one response
+    (`users_by_song_page` returns one page at a time).
+
+    - With `cache_size`, results are kept in a `ResultCache` for `cache_ttl` seconds.
+
+    - With `bucketed`, the bucketed variants of `listening_history` and `user_history` are read
+    (see `partition_analyzer.py`), the buckets of a song in parallel.
+
+    Parameters
+    ----------
+    session :
+        `cassandra.cluster.Session` (or `stub_session.StubSession`), with the keyspace set.
+    cache_size : int
+        Maximum number of cached results (0: no cache).
+    cache_ttl : float
+        Seconds a cached result stays valid.
+    fetch_size : int
+        Rows per page.
+    bucketed : bool
+        Read the bucketed variants of the tables.
+    """
+
+    def __init__(self, session, cache_size=0, cache_ttl=60.0, fetch_size=1000, bucketed=False):
+        self.session = session
+        self.bucketed = bucketed
+        self.cache = ResultCache(cache_size, cache_ttl) if cache_size else None
+
+        self.prepared = {}
+        for name, query in (('song_details', song_details_select),
+                            ('listening_history', listening_history_bucketed_select if bucketed else listening_history_select),
+                            ('user_history', user_history_bucketed_select if bucketed else user_history_select),
+                            ('user_history_pages', user_history_select)):
+            self.prepared[name] = session.prepare(query)
+            self.prepared[name].fetch_size = fetch_size
+
+    def _query(self, name, parameters, read):
+        key = (name, parameters)
+        if self.cache is not None:
+            rows = self.cache.get(key)
+            if rows is not None:
+                return rows
+        rows = read()
+        if self.cache is not None:
+            self.cache.put(key, rows)
+        return rows
+
+    def song_in_session(self, session_id, item_in_session):
+        """
+        QUERY-1: artist, song and length of the song heard at `item_in_session` of `session_id`, or None.
+        """
+        rows = self._query('song_details', (session_id, item_in_session),
+                           lambda: list(self.session.execute(self.prepared['song_details'], (session_id, item_in_session))))
+        return rows[0] if rows else None
+
+    def songs_in_user_session(self, user_id, session_id):
+        """
+        QUERY-2: artist, song and user name of every song of `session_id` of `user_id`, sorted by itemInSession.
+        """
+        parameters = (user_id, session_id // SESSION_BUCKET_SIZE, session_id) if self.bucketed else (user_id, session_id)
+        return self._query('listening_history', (user_id, session_id),
+                           lambda: list(self.session.execute(self.prepared['listening_history'], parameters)))
+
+    def users_by_song(self, song):
+        """
+        QUERY-3: first and last name of every user who listened to `song`, sorted by userId.
+        """
+        return self._query('user_history', (song,), lambda: self._read_users(song))
+
+    def _read_users(self, song):
+        if not self.bucketed:
+            return list(self.session.execute(self.prepared['user_history'], (song,)))
+        futures = [self.session.execute_async(self.prepared['user_history'], (song, bucket)) for bucket in range(USER_HISTORY_BUCKETS)]
+        return sorted((row for future in futures for row in future.result()), key=lambda row: row.userid)
+
+    def users_by_song_page(self, song, paging_state=None):
+        """
+        One page of QUERY-3 on `user_history`, for songs with too many listeners to return at once.
+
+        Returns
+        -------
+        tuple
+            The rows of the page, and the `paging_state` of the next page (None after the last page).
+        """
+        result = self.session.execute(self.prepared['user_history_pages'], (song,), paging_state=paging_state)
+        return list(result.current_rows), result.paging_state
+
+
+def connect(hosts=('127.0.0.1',), stub=False, latency=0.0005):
+    """
+    - Connects to the Cassandra cluster at `hosts` with token-aware routing: every request goes to a replica
+    of its partition (computed from the bound values of the prepared statement), which saves a hop through
+    a coordinator. Reads are served by the first replica (LOCAL_ONE).
+
+    - With `stub`, creates a `StubSession` instead.
+
+    - Returns the cluster (None for the stub) and the session, with the `sparkifydb` keyspace set.
+    """
+    if stub:
+        return loader_connect(stub=True, latency=latency)
+
+    # the driver is only needed against a real cluster, the stub runs without it
+    from cassandra import ConsistencyLevel
+    from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+    from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
+
+    profile = ExecutionProfile(load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy()),
+                               consistency_level=ConsistencyLevel.LOCAL_ONE)
+    cluster = Cluster(list(hosts), execution_profiles={EXEC_PROFILE_DEFAULT: profile})
+    session = cluster.connect('sparkifydb')
+
+    return cluster, session
+
+
+def workload(events, requests, seed=0):
+    """
+    Returns `requests` random calls `(query name, arguments)` of the three queries, in equal shares,
+    on keys drawn from `events` (so popular songs and heavy users are requested more often, as in production).
+    """
+    rng = random.Random(seed)
+    calls = []
+    for _ in range(requests):
+        event = rng.choice(events)
+        query = rng.randrange(3)
+        if query == 0:
+            calls.append(('song_in_session', (event.sessionId, event.itemInSession)))
+        elif query == 1:
+            calls.append(('songs_in_user_session', (event.userId, event.sessionId)))
+        else:
+            calls.append(('users_by_song', (event.song,)))
+    return calls
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def run_load(api, calls, threads=16):
+    """
+    Runs `calls` against `api` from `threads` threads, each waiting for its response before the next call.
+
+    Returns
+    -------
+    dict
+        Number of requests, seconds, QPS, and the p50/p99/max latency in milliseconds, overall and per query.
+    """
+    latencies = defaultdict(list)
+    calls = iter(calls)
+    lock = threading.Lock()
+
+    def worker():
+        own = defaultdict(list)
+        while True:
+            with lock:
+                call = next(calls, None)
+            if call is None:
+                break
+            name, arguments = call
+            start = time.perf_counter()
+            getattr(api, name)(*arguments)
+            own[name].append(time.perf_counter() - start)
+        with lock:
+            for name, values in own.items():
+                latencies[name].extend(values)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    summary = lambda values: {'requests': len(values), 'p50_ms': percentile(values, 0.50) * 1000,
+                              'p99_ms': percentile(values, 0.99) * 1000, 'max_ms': max(values, default=0.0) * 1000}
+    everything = [value for values in latencies.values() for value in values]
+    result = summary(everything)
+    result.update(seconds=seconds, qps=len(everything) / seconds if seconds else 0.0,
+                  queries={name: summary(values) for name, values in sorted(latencies.items())})
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the latency and QPS of the Sparkify read path.')
+    parser.add_argument('--file', default=EVENT_FILE, help='Event data file the keys are drawn from (default: {}).'.format(EVENT_FILE))
+    parser.add_argument('--hosts', nargs='+', default=['127.0.0.1'], help='Contact points of the cluster (default: 127.0.0.1).')
+    parser.add_argument('--stub', action='store_true', help='Query an in-memory stub session (loaded first) instead of a cluster.')
+    parser.add_argument('--latency', type=float, default=0.0005, help='Round trip time of the stub session in seconds (default: 0.0005).')
+    parser.add_argument('--load', action='store_true', help='Recreate and load the query tables first (always done with --stub).')
+    parser.add_argument('--requests', type=int, default=20000, help='Number of requests (default: 20000).')
+    parser.add_argument('--threads', type=int, default=16, help='Number of concurrent clients (default: 16).')
+    parser.add_argument('--cache-size', type=int, default=0, help='Cache up to N results (default: 0, no cache).')
+    parser.add_argument('--cache-ttl', type=float, default=60.0, help='Seconds a cached result stays valid (default: 60).')
+    parser.add_argument('--fetch-size', type=int, default=1000, help='Rows per page (default: 1000).')
+    parser.add_argument('--bucketed', action='store_true', help='Read the bucketed variants of listening_history and user_history.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random workload (default: 0).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Loads the query tables if needed, then runs a random mix of the three queries from `--threads` clients.
+
+    - Prints the QPS, the p50/p99/max latency overall and per query, and the cache hit rate.
+    """
+    args = parse_args(argv)
+    cluster, session = connect(args.hosts, args.stub, args.latency)
+    events = list(read_events(args.file))
+
+    if args.stub or args.load:
+        if args.stub:
+            from stub_session import stub_batch
+            batch_factory = stub_batch
+        else:
+            batch_factory = unlogged_batch
+        reset_tables(session)
+        load_tables(session, list(TABLES.values()), events, batch_factory=batch_factory)
+
+    api = QueryAPI(session, args.cache_size, args.cache_ttl, args.fetch_size, args.bucketed)
+    result = run_load(api, workload(events, args.requests, args.seed), args.threads)
+
+    print('{requests} requests in {seconds:.2f}s: {qps:.0f} QPS, p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms, max {max_ms:.2f} ms'.format(**result))
+    for name, stats in result['queries'].items():
+        print('    {:<24} {requests:>7} requests, p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms, max {max_ms:.2f} ms'.format(name, **stats))
+    if api.cache is not None:
+        calls = api.cache.hits + api.cache.misses
+        print('cache: {} hits / {} misses ({:.1%}), {} results cached'.format(
+            api.cache.hits, api.cache.misses, api.cache.hits / calls if calls else 0.0, len(api.cache)))
+
+    session.shutdown()
+    if cluster is not None:
+        cluster.shutdown()
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# Import all the necessary packages
+import re
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+CREATE_PATTERN = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\((.*)\)\s*$', re.IGNORECASE | re.DOTALL)
+PRIMARY_KEY_PATTERN = re.compile(r'PRIMARY\s+KEY\s*\((.*)\)\s*$', re.IGNORECASE | re.DOTALL)
+INSERT_PATTERN = re.compile(r'INSERT\s+INTO\s+(\w+)\s*\(([^)]*)\)\s*VALUES', re.IGNORECASE)
+SELECT_PATTERN = re.compile(r'SELECT\s+(.*?)\s+FROM\s+(\w+)(?:\s+WHERE\s+(.*?))?\s*;?\s*$', re.IGNORECASE | re.DOTALL)
+TABLE_PATTERN = re.compile(r'(?:DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?|TRUNCATE\s+(?:TABLE\s+)?)(\w+)', re.IGNORECASE)
+
+
+class Table:
+    """
+    In-memory Cassandra table: rows grouped by partition key, and by clustering columns within a partition.
+    """
+
+    def __init__(self, name, columns, partition_key, clustering, types=None):
+        self.name = name
+        self.columns = columns
+        self.types = types or {}
+        self.partition_key = partition_key
+        self.clustering = clustering
+        self.partitions = {}
+
+    @classmethod
+    def from_ddl(cls, query):
+        name, body = CREATE_PATTERN.search(query.strip()).groups()
+        key = PRIMARY_KEY_PATTERN.search(body).group(1).strip()
+        definitions = [line.split() for line in body[:PRIMARY_KEY_PATTERN.search(body).start()].split(',') if line.strip()]
+        types = {words[0].lower(): words[1].upper() for words in definitions}
+
+        if key.startswith('('):
+            partition, clustering = key[1:].split(')', 1)
+        else:
+            partition, _, clustering = key.partition(',')
+        split = lambda names: [column.strip().lower() for column in names.split(',') if column.strip()]
+        return cls(name.lower(), list(types), split(partition), split(clustering), types)
+
+    def upsert(self, row):
+        partition = self.partitions.setdefault(tuple(row[column] for column in self.partition_key), {})
+        clustering = tuple(row[column] for column in self.clustering)
+        partition.setdefault(clustering, {}).update(row)
+
+    def rows(self, conditions):
+        """
+        Rows of the partition selected by `conditions` (`{column: value}` on the whole partition key,
+        and optionally on clustering columns), in clustering order.
+        """
+        missing = [column for column in self.partition_key if column not in conditions]
+        if missing:
+            raise ValueError('Cannot execute this query: the partition key column(s) {} of {} are not restricted'.format(
+                ', '.join(missing), self.name))
+        partition = self.partitions.get(tuple(conditions[column] for column in self.partition_key), {})
+        rows = [partition[key] for key in sorted(partition)]
+        return [row for row in rows if all(row.get(column) == value for column, value in conditions.items())]
+
+
+class StubPreparedStatement:
+    """
+    Prepared statement of a `StubSession`: the query text, parsed once.
+    """
+
+    def __init__(self, query):
+        self.query_string = query
+        self.fetch_size = None
+
+    def bind(self, values):
+        return StubBoundStatement(self, values)
+
+
+class StubBoundStatement:
+
+    def __init__(self, prepared, values):
+        self.prepared_statement = prepared
+        self.values = tuple(values)
+
+
+class StubBatch:
+    """
+    Batch of a `StubSession`, with the same `add` as `cassandra.query.BatchStatement`.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, statement, parameters=None):
+        self.entries.append((statement, parameters))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class StubResultSet:
+    """
+    Rows of a SELECT, in pages of `fetch_size` rows like the driver's `ResultSet`: `current_rows` is the page
+    returned by the request, and iterating goes on with the next pages, one more request each.
+    """
+
+    def __init__(self, session, rows, fetch_size, start=0):
+        self._session = session
+        self._rows = rows
+        self._fetch_size = fetch_size
+        end = start + fetch_size if fetch_size else len(rows)
+        self.current_rows = rows[start:end]
+        self.paging_state = end if end < len(rows) else None
+
+    @property
+    def has_more_pages(self):
+        return self.paging_state is not None
+
+    def one(self):
+        return self.current_rows[0] if self.current_rows else None
+
+    def __iter__(self):
+        page = self
+        while True:
+            yield from page.current_rows
+            if not page.has_more_pages:
+                return
+            page = self._session._next_page(page)
+
+
+def stub_batch(prepared, rows):
+    """
+    Batch of the statement `prepared` with every values of `rows`, for `StubSession`
+    (the counterpart of `cassandra_loader.unlogged_batch`).
+    """
+    batch = StubBatch()
+    for values in rows:
+        batch.add(prepared, values)
+    return batch
+
+
+class StubFuture:
+    """
+    Result of `StubSession.execute_async`, with the `result` and `add_callbacks` of the driver's `ResponseFuture`.
+    """
+
+    def __init__(self, future):
+        self._future = future
+
+    def result(self):
+        return self._future.result()
+
+    def add_callbacks(self, callback, errback, callback_args=(), callback_kwargs=None, errback_args=(), errback_kwargs=None):
+        def done(future):
+            error = future.exception()
+            if error is None:
+                callback(future.result(), *callback_args, **(callback_kwargs or {}))
+            else:
+                errback(error, *errback_args, **(errback_kwargs or {}))
+        self._future.add_done_callback(done)
+
+
+class StubSession:
+    """
+    Single-node stand-in for a `cassandra.cluster.Session`, to run the loaders and queries without a cluster.
+
+    - Understands the statements of `cql_queries.py`: CREATE/DROP/TRUNCATE TABLE, INSERT (plain, prepared or
+    in a batch) and SELECT restricted on the partition key (and optionally clustering columns).
+
+    - SELECTs are paged: `fetch_size` rows per request (the `fetch_size` of the statement, or
+    `default_fetch_size`), the following pages are requested with `paging_state`.
+
+    - Every request takes `latency` seconds, served by a pool of `workers` threads, so that the effect of
+    concurrent requests and batching on throughput is the same as with a real node.
+
+    Parameters
+    ----------
+    latency : float
+        Round trip time of every request, in seconds.
+    workers : int
+        Maximum number of requests served at the same time.
+    """
+
+    def __init__(self, latency=0.0005, workers=128):
+        self.latency = latency
+        self.default_fetch_size = 5000
+        self.tables = {}
+        self.keyspace = None
+        self.requests = 0
+        self.batches = 0
+        self.multi_partition_batches = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def set_keyspace(self, keyspace):
+        self.keyspace = keyspace
+
+    def prepare(self, query):
+        return StubPreparedStatement(query)
+
+    def execute(self, query, parameters=None, paging_state=None):
+        return self._run(query, parameters, paging_state)
+
+    def execute_async(self, query, parameters=None, paging_state=None):
+        return StubFuture(self._pool.submit(self._run, query, parameters, paging_state))
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+    def _run(self, query, parameters, paging_state=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            if isinstance(query, StubBatch):
+                return self._run_batch(query)
+            return self._statement(query, parameters, paging_state)
+
+    def _next_page(self, result):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+        return StubResultSet(self, result._rows, result._fetch_size, result.paging_state)
+
+    def _run_batch(self, batch):
+        self.batches += 1
+        partitions = set()
+        for statement, parameters in batch.entries:
+            table = self._statement(statement, parameters)
+            partitions.add(table)
+        if len(partitions) > 1:
+            self.multi_partition_batches += 1
+        return []
+
+    def _statement(self, query, parameters, paging_state=None):
+        """
+        Runs one statement (under the lock). INSERTs return `(table, partition key)`, SELECTs a `StubResultSet`.
+        """
+        fetch_size = getattr(query, 'fetch_size', None) or self.default_fetch_size
+        if isinstance(query, StubBoundStatement):
+            fetch_size = query.prepared_statement.fetch_size or self.default_fetch_size
+            query, parameters = query.prepared_statement, query.values
+        if isinstance(query, StubPreparedStatement):
+            query = query.query_string
+        query = query.strip()
+        words = query.split(None, 2)
+        command = ' '.join(words[:2]).upper()
+
+        if command == 'CREATE TABLE':
+            table = Table.from_ddl(query)
+            self.tables.setdefault(table.name, table)
+        elif command in ('DROP TABLE', 'TRUNCATE TABLE') or words[0].upper() == 'TRUNCATE':
+            name = TABLE_PATTERN.match(query).group(1).lower()
+            if command == 'DROP TABLE':
+                self.tables.pop(name, None)
+            elif name in self.tables:
+                self.tables[name].partitions.clear()
+        elif words[0].upper() == 'INSERT':
+            name, columns = INSERT_PATTERN.match(query).groups()
+            table = self.tables[name.lower()]
+            row = dict(zip([column.strip().lower() for column in columns.split(',')], parameters))
+            table.upsert(row)
+            return table.name, tuple(row[column] for column in table.partition_key)
+        elif words[0].upper() == 'SELECT':
+            return StubResultSet(self, self._select(query, parameters or ()), fetch_size, paging_state or 0)
+        # CREATE KEYSPACE, USE, ...: nothing to do
+        return []
+
+    def _select(self, query, parameters):
+        columns, name, where = SELECT_PATTERN.match(query).groups()
+        table = self.tables[name.lower()]
+
+        conditions, values = {}, iter(parameters)
+        for condition in re.split(r'\s+AND\s+', where or '', flags=re.IGNORECASE):
+            if condition:
+                column, value = [part.strip() for part in condition.split('=')]
+                conditions[column.lower()] = next(values) if value in ('?', '%s') else eval_literal(value)
+
+        names = table.columns if columns.strip() == '*' else [column.strip().lower() for column in columns.split(',')]
+        Row = namedtuple('Row', names)
+        return [Row(*(row.get(column) for column in names)) for row in table.rows(conditions)]
+
+
+def eval_literal(value):
+    """
+    Value of a CQL literal of a WHERE clause: 'text' or a number.
+    """
+    if value.startswith("'"):
+        return value[1:-1].replace("''", "'")
+    return float(value) if '.' in value else int(value)
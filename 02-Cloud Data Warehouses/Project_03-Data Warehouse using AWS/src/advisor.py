@@ -0,0 +1,272 @@
+# Import all the necessary packages
+import re
+import argparse
+import configparser
+
+import sql_queries
+from etl import connect
+
+
+# Joins of the star schema (and of the songplay insert between the staging tables): (table, column, table, column)
+JOINS = [
+    ('fact_songplay', 'song_id', 'dim_song', 'song_id'),
+    ('fact_songplay', 'artist_id', 'dim_artist', 'artist_id'),
+    ('fact_songplay', 'user_id', 'dim_user', 'user_id'),
+    ('fact_songplay', 'start_time', 'dim_time', 'start_time'),
+    ('staging_events_keyed', 'match_key', 'staging_songs_keyed', 'match_key'),
+]
+
+# Columns the analytical queries filter on by range, preferred as sort keys
+RANGE_FILTERS = {'fact_songplay': 'start_time', 'dim_time': 'start_time', 'staging_events': 'ts', 'staging_events_keyed': 'ts'}
+
+CREATE_PATTERN = re.compile(r'CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(\w+)\s*\((.*)\);', re.IGNORECASE | re.DOTALL)
+AZ64_TYPES = ('SMALLINT', 'INT', 'INTEGER', 'BIGINT', 'DECIMAL', 'DATE', 'TIMESTAMP')
+
+
+def parse_ddl(query):
+    '''
+        Split a CREATE TABLE statement of `sql_queries.py` into its table name and `(column, definition)` pairs,
+        without the distkey/sortkey attributes.
+    '''
+    name, body = CREATE_PATTERN.search(query).groups()
+    columns = []
+    # commas inside parentheses belong to the type, e.g. IDENTITY(0,1)
+    for line in re.split(r',(?![^(]*\))', body):
+        words = line.split()
+        if not words:
+            continue
+        definition = ' '.join(word for word in words[1:] if word.lower() not in ('distkey', 'sortkey'))
+        columns.append((words[0], definition))
+    return name, columns
+
+
+def base_type(definition):
+    return re.match(r'\w+', definition).group(0).upper()
+
+
+def slice_expression(column, slices):
+    '''
+        Slice of the rows when the table is distributed on `column` (FNV_HASH is translated for the local engines).
+    '''
+    return 'MOD(MOD(FNV_HASH(CAST({} AS VARCHAR)), {slices}) + {slices}, {slices})'.format(column, slices=slices)
+
+
+def slice_skew(cur, table, column, slices, not_null):
+    '''
+        Ratio between the rows of the fullest slice and the average, when the rows are distributed on `column`
+        (1.0 is a perfectly even distribution).
+    '''
+    if not not_null:
+        return float('inf')
+    cur.execute('SELECT MAX(slice_rows) FROM (SELECT COUNT(*) AS slice_rows FROM {} WHERE {} IS NOT NULL GROUP BY {}) AS slices;'.format(
+        table, column, slice_expression(column, slices)))
+    return cur.fetchone()[0] / (not_null / slices)
+
+
+def run_lengths(cur, table, columns, sortkey):
+    '''
+        Average number of consecutive equal values of every column, in `sortkey` order (in storage order without one).
+    '''
+    names = [name for name, definition in columns]
+    window = 'ORDER BY {} NULLS LAST'.format(sortkey) if sortkey else ''
+    cur.execute('SELECT COUNT(*), {} FROM (SELECT {}, ROW_NUMBER() OVER ({window}) AS row_position FROM {}) AS ordered;'.format(
+        ', '.join('SUM(CASE WHEN row_position = 1 OR {0} IS DISTINCT FROM previous_{0} THEN 1 ELSE 0 END)'.format(name) for name in names),
+        ', '.join('{0}, LAG({0}) OVER ({window}) AS previous_{0}'.format(name, window=window) for name in names),
+        table, window=window))
+    rows, *runs = cur.fetchone()
+    return {name: rows / count if count else 0.0 for name, count in zip(names, runs)}
+
+
+def profile_table(cur, table, columns, slices):
+    '''
+        Profile every column of a table: rows, distinct values, NULL fraction and skew over `slices` slices.
+        Everything is aggregated by the database, only the statistics are fetched.
+    '''
+    cur.execute('SELECT COUNT(*), {} FROM {};'.format(
+        ', '.join('COUNT(DISTINCT {0}), COUNT({0})'.format(name) for name, definition in columns), table))
+    rows, *counts = cur.fetchone()
+
+    profile = {'rows': rows, 'columns': {}}
+    for (name, definition), distinct, not_null in zip(columns, counts[::2], counts[1::2]):
+        profile['columns'][name] = {
+            'type': base_type(definition),
+            'distinct': distinct,
+            'null_fraction': 1 - not_null / rows if rows else 0.0,
+            'skew': slice_skew(cur, table, name, slices, not_null),
+        }
+    return profile
+
+
+def choose_sortkey(table, profile):
+    '''
+        Range-filtered column if any, otherwise the column the table is joined on.
+    '''
+    if table in RANGE_FILTERS:
+        return RANGE_FILTERS[table]
+    for fact, fact_column, dim, dim_column in JOINS:
+        if table == dim:
+            return dim_column
+    return None
+
+
+def choose_distribution(profiles, all_threshold, max_skew):
+    '''
+        - Small dimensions are copied on every node (DISTSTYLE ALL).
+        - Every other table is distributed on the join column of its largest join partner that is not ALL,
+          when that column is not too skewed, otherwise evenly.
+
+        Returns `{table: (diststyle, distkey)}`.
+    '''
+    distribution = {}
+    dimensions = {dim for fact, fact_column, dim, dim_column in JOINS if dim.startswith('dim_')}
+    for table in dimensions:
+        if profiles[table]['rows'] <= all_threshold:
+            distribution[table] = ('ALL', None)
+
+    for table, profile in profiles.items():
+        if table in distribution:
+            continue
+        # join partners by decreasing size, only those that are not replicated on every node
+        candidates = []
+        for left, left_column, right, right_column in JOINS:
+            if table == left and distribution.get(right, (None,))[0] != 'ALL':
+                candidates.append((profiles[right]['rows'], left_column, right_column, right))
+            elif table == right and distribution.get(left, (None,))[0] != 'ALL':
+                candidates.append((profiles[left]['rows'], right_column, left_column, left))
+
+        distribution[table] = ('EVEN', None)
+        for partner_rows, column, partner_column, partner in sorted(candidates, reverse=True):
+            stats = profile['columns'][column]
+            if stats['skew'] <= max_skew and stats['null_fraction'] < 0.5:
+                distribution[table] = ('KEY', column)
+                break
+    return distribution
+
+
+def choose_encoding(column, stats, run_length, sortkey):
+    '''
+        Column encoding from the profile (`run_length` in the recommended sort order).
+    '''
+    if column == sortkey:
+        # the first sort key column is left uncompressed so that range-restricted scans stay effective
+        return 'RAW'
+    if run_length >= 4:
+        return 'RUNLENGTH'
+    if stats['type'] in AZ64_TYPES:
+        return 'AZ64'
+    if stats['type'] == 'VARCHAR' and stats['distinct'] < 256:
+        return 'BYTEDICT'
+    return 'ZSTD'
+
+
+def recommend(cur, slices=8, all_threshold=100000, max_skew=1.5):
+    '''
+        Profile every table of `create_table_queries` and return the recommended DDL and the co-location report.
+    '''
+    tables = dict(parse_ddl(query) for query in sql_queries.create_table_queries if query is not sql_queries.watermark_table_create)
+    profiles = {table: profile_table(cur, table, columns, slices) for table, columns in tables.items()}
+    distribution = choose_distribution(profiles, all_threshold, max_skew)
+
+    statements = []
+    for table, columns in tables.items():
+        profile = profiles[table]
+        diststyle, distkey = distribution[table]
+        sortkey = choose_sortkey(table, profile)
+        runs = run_lengths(cur, table, columns, sortkey)
+
+        lines = []
+        for name, definition in columns:
+            stats = profile['columns'][name]
+            encoding = choose_encoding(name, stats, runs[name], sortkey)
+            lines.append('    {} {} ENCODE {}'.format(name, definition, encoding))
+
+        attributes = 'DISTSTYLE {}'.format(diststyle)
+        if distkey:
+            attributes += ' DISTKEY ({})'.format(distkey)
+        if sortkey:
+            attributes += ' SORTKEY ({})'.format(sortkey)
+        statements.append('CREATE TABLE IF NOT EXISTS {} (\n{})\n{};'.format(table, ', \n'.join(lines), attributes))
+
+    return statements, colocation_report(cur, profiles, distribution)
+
+
+def match_fraction(cur, left, left_column, right, right_column):
+    '''
+        Fraction of the rows of `left` whose join column has a match in `right`.
+    '''
+    cur.execute('SELECT COUNT(*), COUNT(r.match_value) FROM {} l LEFT JOIN (SELECT DISTINCT {} AS match_value FROM {}) r ON l.{} = r.match_value;'.format(
+        left, right_column, right, left_column))
+    rows, matches = cur.fetchone()
+    return matches / rows if rows else 0.0
+
+
+def colocation_report(cur, profiles, distribution):
+    '''
+        Expected data movement of every join with the recommended distribution.
+    '''
+    report = []
+    for left, left_column, right, right_column in JOINS:
+        left_style, left_key = distribution[left]
+        right_style, right_key = distribution[right]
+        if right_style == 'ALL' or left_style == 'ALL':
+            movement = 'co-located (DISTSTYLE ALL)'
+        elif left_key == left_column and right_key == right_column:
+            movement = 'co-located (DISTKEY on both sides)'
+        elif left_key == left_column:
+            movement = 'redistribute {} ({} rows)'.format(right, profiles[right]['rows'])
+        elif right_key == right_column:
+            movement = 'redistribute {} ({} rows)'.format(left, profiles[left]['rows'])
+        else:
+            smaller = min((left, right), key=lambda table: profiles[table]['rows'])
+            movement = 'broadcast {} ({} rows)'.format(smaller, profiles[smaller]['rows'])
+
+        left_stats = profiles[left]['columns'][left_column]
+        report.append('{}.{} = {}.{}: {}; {} distinct values (skew {:.2f}, {:.0%} NULL), {:.0%} of the rows find a match'.format(
+            left, left_column, right, right_column, movement, left_stats['distinct'], left_stats['skew'],
+            left_stats['null_fraction'], match_fraction(cur, left, left_column, right, right_column)))
+    return report
+
+
+def parse_args(argv=None):
+    '''
+        Parse the command line options.
+    '''
+    parser = argparse.ArgumentParser(description='Recommend DISTSTYLE/DISTKEY/SORTKEY/ENCODE DDL from the data of a local load.')
+    parser.add_argument('--local', action='store_true', help='Profile the tables of the local PostgreSQL stand-in (default: the embedded engine).')
+    parser.add_argument('--slices', type=int, default=8, help='Number of slices of the target cluster (default: 8).')
+    parser.add_argument('--all-threshold', type=int, default=100000, metavar='ROWS',
+                        help='Dimensions up to this many rows are copied to every node with DISTSTYLE ALL (default: 100000).')
+    parser.add_argument('--max-skew', type=float, default=1.5,
+                        help='Maximum ratio between the fullest slice and the average for a distribution key (default: 1.5).')
+    parser.add_argument('--output', metavar='PATH', help='Also write the recommended DDL to PATH.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    '''
+        Profile the staged and loaded tables of a local run (`local_engine.py` or `etl.py --local`)
+        and print the recommended DDL and the expected co-location of the joins.
+    '''
+    args = parse_args(argv)
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    conn = connect(config, local=args.local, embedded=not args.local)
+    cur = conn.cursor()
+    statements, report = recommend(cur, args.slices, args.all_threshold, args.max_skew)
+    conn.close()
+
+    ddl = '\n\n'.join(statements)
+    print(ddl)
+    print('\n-- Joins:')
+    for line in report:
+        print('--   ' + line)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            f.write(ddl + '\n')
+
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 # Import all the necessary packages
+import argparse
 import configparser
 import psycopg2
 
+import local_standin
 from sql_queries import create_table_queries, drop_table_queries
 
 
@@ -23,13 +25,34 @@ def create_tables(cur, conn):
         conn.commit()
 
 
-def main():
+def parse_args(argv=None):
+    '''
+        Parse the command line options.
+    '''
+    parser = argparse.ArgumentParser(description='Recreate the staging and star schema tables on Redshift.')
+    parser.add_argument('--local', action='store_true',
+                        help='Create the tables on the local PostgreSQL stand-in of the [LOCAL] section of dwh.cfg.')
+    parser.add_argument('--embedded', action='store_true',
+                        help='Create the tables in the embedded DuckDB database of the [LOCAL] section of dwh.cfg.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
     # Load the config file
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    # Connect to the Redshift cluster that has access to S3 through IAM
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    # Connect to the Redshift cluster that has access to S3 through IAM (or to the local stand-in)
+    if args.embedded:
+        # optional dependency, only needed for the embedded engine
+        import local_engine
+        conn = local_engine.connect(config)
+    elif args.local:
+        conn = local_standin.connect(config)
+    else:
+        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
     cur = conn.cursor()
 
     # Delete tables if they already exist
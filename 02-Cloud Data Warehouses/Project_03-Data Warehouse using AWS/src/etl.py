@@ -1,44 +1,245 @@
 # Import all the necessary packages
+import argparse
 import configparser
+from datetime import date, datetime, timedelta, timezone
+from functools import partial
 import psycopg2
 
-from sql_queries import copy_table_queries, insert_table_queries
+import local_standin
+from sql_queries import copy_table_queries, match_key_queries, insert_table_queries, etl_dag
+from sql_queries import incremental_staging_queries, incremental_keying_queries, merge_table_queries, staging_events_trim, watermark_select
+from sql_queries import staging_events_copy_from
+from sql_queries import rollup_table_queries
+from metrics import Metrics, InstrumentedCursor, record, timed
+from scheduler import run_dag
 
 
+@timed
 def load_staging_tables(cur, conn):
     '''
-        Load data from staging tables to analytics tables on Redshift.
+        Load data from S3 to staging tables on Redshift, then compute the match keys of the songplay join.
     '''
     for query in copy_table_queries:
+        cur.execute(query)
+        if isinstance(cur, InstrumentedCursor):
+            # COPY does not report its row count through the cursor
+            cur.execute("SELECT pg_last_copy_count();")
+            record(cur, 'rows_copied', cur.fetchone()[0])
+        conn.commit()
+
+    for query in match_key_queries:
         cur.execute(query)
         conn.commit()
 
 
+@timed
 def insert_tables(cur, conn):
     '''
-        Load data from S3 to staging tables on Redshift.
+        Load data from staging tables to analytics tables on Redshift.
     '''
     for query in insert_table_queries:
         cur.execute(query)
         conn.commit()
 
 
-def main():
+def log_data_prefixes(log_data, high_water, until):
+    '''
+        S3 prefixes of the days of `log_data` (log_data/YYYY/MM/YYYY-MM-DD) from the day of `high_water` to `until`,
+        with a whole month (log_data/YYYY/MM/) for the months entirely in between. All of `log_data` without a high-water mark.
+    '''
+    if high_water is None:
+        return [log_data]
+
+    prefixes, day = [], high_water.date()
+    while day <= until:
+        next_month = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+        if day.day == 1 and next_month - timedelta(days=1) <= until:
+            prefixes.append('{}/{:%Y/%m}/'.format(log_data, day))
+            day = next_month
+        else:
+            prefixes.append('{}/{:%Y/%m/%Y-%m-%d}'.format(log_data, day))
+            day += timedelta(days=1)
+    return prefixes
+
+
+def copy_new_events(cur, conn, log_data, until):
+    '''
+        COPY the days of `log_data` from the high-water mark to `until` into `staging_events`, one COPY per prefix
+        (see `log_data_prefixes`). A prefix without log file ("The specified S3 prefix ... does not exist") is skipped.
+        Returns the number of prefixes loaded.
+    '''
+    cur.execute(watermark_select)
+    row = cur.fetchone()
+    prefixes = log_data_prefixes(log_data, row[0] if row else None, until)
+
+    loaded = 0
+    for prefix in prefixes:
+        try:
+            cur.execute(staging_events_copy_from.format("'{}'".format(prefix)))
+        except Exception as e:
+            if 'S3 prefix' not in str(e):
+                raise
+            conn.rollback()
+            continue
+        if isinstance(cur, InstrumentedCursor):
+            cur.execute("SELECT pg_last_copy_count();")
+            record(cur, 'rows_copied', cur.fetchone()[0])
+        conn.commit()
+        loaded += 1
+
+    print('{} of {} log_data prefixes copied.'.format(loaded, len(prefixes)))
+    return loaded
+
+
+@timed
+def load_incremental(cur, conn, log_data, until):
+    '''
+        Stage only the days of `log_data` from the high-water mark of `etl_watermark` to `until`, drop the events
+        not newer than the mark, then merge the staged data into the star schema (delete-then-insert by key),
+        add the new songplays to the rollups and move the high-water marks, all in one transaction.
+    '''
+    for query in incremental_staging_queries:
+        cur.execute(query)
+        if query in copy_table_queries and isinstance(cur, InstrumentedCursor):
+            cur.execute("SELECT pg_last_copy_count();")
+            record(cur, 'rows_copied', cur.fetchone()[0])
+        conn.commit()
+
+    copy_new_events(cur, conn, log_data, until)
+
+    for query in incremental_keying_queries:
+        cur.execute(query)
+        if query == staging_events_trim:
+            print('{} events already loaded dropped from staging.'.format(max(cur.rowcount, 0)))
+        conn.commit()
+
+    try:
+        for query in merge_table_queries + rollup_table_queries:
+            cur.execute(query)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    cur.execute(watermark_select)
+    row = cur.fetchone()
+    print('High-water mark: {}'.format(row[0] if row else None))
+
+
+@timed
+def update_rollups(cur, conn):
+    '''
+        Add the songplays newer than the 'rollups' high-water mark to the rollup tables, in one transaction.
+    '''
+    try:
+        for query in rollup_table_queries:
+            cur.execute(query)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def parse_args(argv=None):
+    '''
+        Parse the command line options of the ETL pipeline.
+    '''
+    parser = argparse.ArgumentParser(description='Load the Sparkify data from S3 into the Redshift star schema.')
+    parser.add_argument('--metrics-json', metavar='PATH',
+                        help='Write a JSON summary of the run metrics (stage times, rows copied/inserted, per-statement latency).')
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                        help='Write the run metrics in the Prometheus text format.')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help='Run the independent COPY/INSERT statements concurrently on N pooled connections, '
+                             'following the dependencies of `etl_dag` (default: 1, i.e. one statement at a time).')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only load the events newer than the last run and merge them into the star schema '
+                             'in one transaction, instead of inserting from the full staging tables.')
+    parser.add_argument('--until', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        default=datetime.now(timezone.utc).date(), metavar='YYYY-MM-DD',
+                        help='Last day of `log_data` copied by --incremental (default: today, UTC).')
+    parser.add_argument('--local', action='store_true',
+                        help='Run against the local PostgreSQL stand-in of the [LOCAL] section of dwh.cfg, '
+                             'with COPY emulated from local files (see `local_standin.py`).')
+    parser.add_argument('--embedded', action='store_true',
+                        help='Run in-process with DuckDB on the local files of the [LOCAL] section of dwh.cfg (see `local_engine.py`).')
+    args = parser.parse_args(argv)
+    if args.incremental and args.workers > 1:
+        parser.error('--incremental merges in a single transaction and cannot be combined with --workers')
+    return args
+
+
+def connect(config, local=False, embedded=False):
+    '''
+        Connect to the Redshift cluster, to the local stand-in or to the embedded engine.
+    '''
+    if embedded:
+        # optional dependency, only needed for the embedded engine
+        import local_engine
+        return local_engine.connect(config)
+    if local:
+        return local_standin.connect(config)
+    return psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics = Metrics()
+
     # Load the config file
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    # Connect to the Database on the Redshift cluster
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
+    instrument = bool(args.metrics_json or args.metrics_prom)
+
+    if args.incremental:
+        conn = connect(config, args.local, args.embedded)
+        cur = conn.cursor()
+        if instrument:
+            cur = InstrumentedCursor(cur, metrics)
+
+        # Stage the new data and merge it into the star schema
+        with metrics.stage('load_incremental'):
+            load_incremental(cur, conn, config.get('S3', 'LOG_DATA').strip("'"), args.until)
+
+        conn.close()
+    elif args.workers > 1:
+        # Run the COPY and INSERT statements as a DAG on pooled connections
+        with metrics.stage('etl_dag'):
+            run_dag(etl_dag, partial(connect, config, args.local, args.embedded), workers=args.workers, metrics=metrics if instrument else None)
+
+        conn = connect(config, args.local, args.embedded)
+        cur = conn.cursor()
+        if instrument:
+            cur = InstrumentedCursor(cur, metrics)
+        with metrics.stage('update_rollups'):
+            update_rollups(cur, conn)
+        conn.close()
+    else:
+        # Connect to the Database on the Redshift cluster
+        conn = connect(config, args.local, args.embedded)
+        cur = conn.cursor()
+        if instrument:
+            cur = InstrumentedCursor(cur, metrics)
+
+        # Load data from S3 to staging tables on Redshift
+        with metrics.stage('load_staging_tables'):
+            load_staging_tables(cur, conn)
+        # Load data from staging tables to analytics tables on Redshift
+        with metrics.stage('insert_tables'):
+            insert_tables(cur, conn)
+        # Add the new songplays to the rollup tables
+        with metrics.stage('update_rollups'):
+            update_rollups(cur, conn)
 
-    # Load data from S3 to staging tables on Redshift
-    load_staging_tables(cur, conn)
-    # Load data from staging tables to analytics tables on Redshift
-    insert_tables(cur, conn)
+        # Close the connection
+        conn.close()
 
-    # Close the connection
-    conn.close()
+    # Write the metrics of the run
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
 
 
 
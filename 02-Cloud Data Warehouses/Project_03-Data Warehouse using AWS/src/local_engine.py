@@ -0,0 +1,253 @@
+# Import all the necessary packages
+import os
+import re
+import time
+import argparse
+import tempfile
+import configparser
+import duckdb
+
+from local_standin import DDL_REPLACEMENTS, COPY_PATTERN, translate_ddl, write_copy_csv, local_locations
+from sql_queries import create_table_queries, drop_table_queries, copy_table_queries, match_key_queries, insert_table_queries
+from sql_queries import rollup_table_queries
+
+
+# On top of the PostgreSQL translation: DuckDB has no SERIAL (a sequence is used instead),
+# and its FLOAT is single precision while Redshift's is double precision.
+ENGINE_DDL_REPLACEMENTS = [
+    (re.compile(r'INT\s+IDENTITY\s*\(\s*\d+\s*,\s*\d+\s*\)', re.IGNORECASE), "INTEGER DEFAULT nextval('{table}_seq')"),
+    (re.compile(r'\bFLOAT\b', re.IGNORECASE), 'DOUBLE'),
+] + DDL_REPLACEMENTS[1:]
+
+TABLE_PATTERN = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE)
+TRUNCATE_PATTERN = re.compile(r'^\s*TRUNCATE\s+(\w+)', re.IGNORECASE)
+DML_PATTERN = re.compile(r'^\s*(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+ENGINE_TABLES = ['staging_events', 'staging_songs', 'staging_events_keyed', 'staging_songs_keyed',
+                 'fact_songplay', 'dim_user', 'dim_song', 'dim_artist', 'dim_time',
+                 'songplay_hour_rollup', 'songplay_song_rollup', 'songplay_artist_rollup']
+
+# Replicate the staged data `{copies}` times, to time the songplay join on more than the sample data:
+# every event is copied as is, every song gets a different title so that only the original matches.
+SCALE_QUERIES = [
+    "INSERT INTO staging_events SELECT se.* FROM staging_events se, range(1, {copies});",
+    "INSERT INTO staging_songs SELECT ss.* REPLACE (ss.title || ' #' || CAST(r.range AS VARCHAR) AS title) "
+    "FROM staging_songs ss, range(1, {copies}) r;",
+]
+
+# SELECT of the songplay insert before the match keys: join on the wide VARCHAR columns of the staging tables,
+# with the TO_TIMESTAMP(TO_CHAR(ts)) round trip written with DuckDB's strftime/strptime.
+SONGPLAY_SELECT_BEFORE = '''
+    SELECT strptime(strftime(se.ts, '%Y-%m-%d %H:%M:%S'), '%Y-%m-%d %H:%M:%S'), se.userId, se.level,
+        ss.song_id, ss.artist_id, se.sessionId, se.location, se.userAgent
+    FROM staging_events se
+    JOIN staging_songs ss ON se.song=ss.title AND se.artist=ss.artist_name
+'''
+
+SONGPLAY_SELECT_AFTER = '''
+    SELECT se.ts, se.userId, se.level, ss.song_id, ss.artist_id, se.sessionId, se.location, se.userAgent
+    FROM staging_events_keyed se
+    JOIN staging_songs_keyed ss ON se.match_key = ss.match_key
+'''
+
+
+def translate(query):
+    '''
+        Translate a Redshift statement of `sql_queries.py` into DuckDB SQL.
+    '''
+    match = TABLE_PATTERN.match(query.strip())
+    if match:
+        return translate_ddl(query, [(pattern, replacement.replace('{table}', match.group(1)))
+                                     for pattern, replacement in ENGINE_DDL_REPLACEMENTS])
+    return TRUNCATE_PATTERN.sub(r'DELETE FROM \1', translate_ddl(query))
+
+
+class EngineCursor:
+    '''
+        Cursor running the Redshift statements in-process with DuckDB, emulating COPY like `local_standin.py`.
+    '''
+    def __init__(self, conn, locations):
+        self._conn = conn
+        self._locations = locations
+        self.last_copy_count = 0
+        self.rowcount = -1
+
+    def execute(self, query, vars=None):
+        self.rowcount = -1
+        match = COPY_PATTERN.match(query)
+        if match:
+            return self.copy(match.group(1), match.group(2), query)
+        if 'pg_last_copy_count()' in query:
+            return self._conn.execute('SELECT ?;', [self.last_copy_count])
+
+        sql = translate(query)
+        table = TABLE_PATTERN.match(sql.strip())
+        if table and 'nextval' in sql:
+            # replaces the IDENTITY(0,1) column
+            self._conn.execute('CREATE SEQUENCE IF NOT EXISTS {}_seq START 0 MINVALUE 0;'.format(table.group(1)))
+        result = self._conn.execute(sql, vars)
+        if DML_PATTERN.match(sql):
+            # DuckDB returns the number of rows changed as the result of the statement
+            self.rowcount = result.fetchone()[0]
+        return result
+
+    def columns(self, table):
+        return self._conn.execute("SELECT column_name, data_type FROM information_schema.columns "
+                                  "WHERE table_name = ? ORDER BY ordinal_position;", [table]).fetchall()
+
+    def copy(self, table, source, query):
+        '''
+            Emulate a Redshift COPY of JSON files into `table` through a temporary CSV file.
+        '''
+        columns = self.columns(table)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, table + '.csv')
+            with open(path, 'w', encoding='utf8', newline='') as f:
+                count = write_copy_csv(f, self._locations, source, query, columns)
+            self._conn.execute("COPY {} FROM '{}' (FORMAT csv, HEADER false, NULLSTR '\\N');".format(table, path))
+        self.last_copy_count = count
+        self.rowcount = count
+
+    def fetchone(self):
+        return self._conn.fetchone()
+
+    def fetchall(self):
+        return self._conn.fetchall()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class EngineConnection:
+    '''
+        psycopg2-like connection to the embedded DuckDB database: every statement runs in a transaction
+        that is only made visible by `commit`.
+    '''
+    def __init__(self, conn, locations):
+        self._conn = conn
+        self._locations = locations
+        self._conn.begin()
+
+    def cursor(self):
+        return EngineCursor(self._conn, self._locations)
+
+    def commit(self):
+        self._conn.commit()
+        self._conn.begin()
+
+    def rollback(self):
+        self._conn.rollback()
+        self._conn.begin()
+
+    def close(self):
+        self._conn.rollback()
+        self._conn.close()
+
+
+# One database instance per process, every connection is a DuckDB cursor on it (safe to use from several threads)
+_databases = {}
+
+
+def connect(config):
+    '''
+        Connect to the embedded DuckDB database of the `[LOCAL]` section of `dwh.cfg` (`ENGINE_DB`).
+    '''
+    path = config['LOCAL'].get('ENGINE_DB', ':memory:')
+    if path not in _databases:
+        _databases[path] = duckdb.connect(path)
+        # FNV_HASH is translated to PostgreSQL's hashtext (see `local_standin.py`)
+        _databases[path].execute('CREATE MACRO IF NOT EXISTS hashtext(value) AS hash(value);')
+    return EngineConnection(_databases[path].cursor(), local_locations(config))
+
+
+def count_rows(cur):
+    '''
+        Return the row count of every table of the pipeline.
+    '''
+    counts = {}
+    for table in ENGINE_TABLES:
+        cur.execute('SELECT COUNT(*) FROM {};'.format(table))
+        counts[table] = cur.fetchone()[0]
+    return counts
+
+
+def compare_songplay_join(cur, runs=5):
+    '''
+        Time the SELECT of the songplay insert with and without the match keys on the staged data (best of `runs`).
+        Returns `{name: (seconds, rows)}`.
+    '''
+    timings = {}
+    for name, query in (('before', SONGPLAY_SELECT_BEFORE), ('after', SONGPLAY_SELECT_AFTER)):
+        best = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            cur.execute('SELECT COUNT(*) FROM ({}) songplays;'.format(query))
+            rows = cur.fetchone()[0]
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        timings[name] = (best, rows)
+    return timings
+
+
+def parse_args(argv=None):
+    '''
+        Parse the command line options.
+    '''
+    parser = argparse.ArgumentParser(description='Run the whole staging -> star schema build in-process with DuckDB.')
+    parser.add_argument('--database', default=None,
+                        help='DuckDB database file (default: ENGINE_DB of the [LOCAL] section of dwh.cfg).')
+    parser.add_argument('--scale', type=int, default=1, metavar='N',
+                        help='Replicate the staged events and songs N times before building the star schema (default: 1).')
+    parser.add_argument('--compare', action='store_true',
+                        help='Time the songplay join with and without the match keys on the same staged data.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    '''
+        Recreate the tables, COPY the local `song_data`/`log_data`, compute the match keys, run the insert queries,
+        update the rollups, and print the time of every step and the row counts, to compare with a cluster run.
+    '''
+    args = parse_args(argv)
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    if args.database:
+        config['LOCAL']['ENGINE_DB'] = args.database
+
+    conn = connect(config)
+    cur = conn.cursor()
+
+    scale_queries = [query.format(copies=args.scale) for query in SCALE_QUERIES] if args.scale > 1 else []
+    for step, queries in (('create_tables', drop_table_queries + create_table_queries),
+                          ('load_staging_tables', copy_table_queries),
+                          ('scale_staging', scale_queries),
+                          ('match_keys', match_key_queries),
+                          ('insert_tables', insert_table_queries),
+                          ('update_rollups', rollup_table_queries)):
+        if not queries:
+            continue
+        start = time.perf_counter()
+        for query in queries:
+            cur.execute(query)
+            conn.commit()
+        print('{:<20} {:8.3f}s'.format(step, time.perf_counter() - start))
+
+    for table, count in count_rows(cur).items():
+        print('{:<20} {:8} rows'.format(table, count))
+
+    if args.compare:
+        for name, (seconds, rows) in compare_songplay_join(cur).items():
+            print('songplay join {:<6} {:8.3f}s {:8} rows'.format(name, seconds, rows))
+
+    conn.close()
+
+
+
+if __name__ == "__main__":
+    main()
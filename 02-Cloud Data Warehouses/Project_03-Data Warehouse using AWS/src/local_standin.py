@@ -0,0 +1,201 @@
+# Import all the necessary packages
+import io
+import os
+import re
+import csv
+import glob
+import json
+from datetime import datetime, timezone
+import psycopg2
+
+
+# Redshift-only parts of the DDL, dropped for PostgreSQL. The PRIMARY KEYs are dropped as well,
+# since Redshift does not enforce them and the `DISTINCT` inserts rely on that.
+DDL_REPLACEMENTS = [
+    (re.compile(r'INT\s+IDENTITY\s*\(\s*\d+\s*,\s*\d+\s*\)', re.IGNORECASE), 'SERIAL'),
+    (re.compile(r'\s+PRIMARY\s+KEY\b', re.IGNORECASE), ''),
+    (re.compile(r'\s+(sortkey|distkey)\b', re.IGNORECASE), ''),
+    (re.compile(r'\b(diststyle\s+\w+|compound\s+sortkey\s*\([^)]*\)|encode\s+\w+)', re.IGNORECASE), ''),
+]
+
+# Redshift SQL with a different PostgreSQL spelling
+QUERY_REPLACEMENTS = [
+    (re.compile(r'EXTRACT\(\s*weekday\s+from', re.IGNORECASE), 'EXTRACT(dow FROM'),
+    (re.compile(r'\bGETDATE\(\)', re.IGNORECASE), 'NOW()'),
+    (re.compile(r'\bFNV_HASH\(', re.IGNORECASE), 'hashtext('),
+]
+
+COPY_PATTERN = re.compile(r"^\s*COPY\s+(\w+)\s+FROM\s+'([^']+)'", re.IGNORECASE)
+JSON_PATTERN = re.compile(r"FORMAT\s+AS\s+JSON\s+'([^']+)'", re.IGNORECASE)
+JSONPATH_PATTERN = re.compile(r"\$(?:\['([^']+)'\]|\.(\w+))")
+INTEGER_TYPES = ('smallint', 'integer', 'bigint')
+
+
+def translate(query):
+    '''
+        Translate a Redshift statement of `sql_queries.py` into PostgreSQL.
+    '''
+    return translate_ddl(query)
+
+
+def translate_ddl(query, replacements=DDL_REPLACEMENTS):
+    '''
+        Translate the DDL and queries of `sql_queries.py`, with the given DDL replacements.
+    '''
+    if re.match(r'\s*CREATE\s+TABLE', query, re.IGNORECASE):
+        for pattern, replacement in replacements:
+            query = pattern.sub(replacement, query)
+    for pattern, replacement in QUERY_REPLACEMENTS:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+def read_jsonpaths(path):
+    '''
+        Read the JSON keys listed by a jsonpaths file (e.g. `log_json_path.json`), in column order.
+    '''
+    with open(path, encoding='utf8') as f:
+        paths = json.load(f)['jsonpaths']
+    return [next(group for group in JSONPATH_PATTERN.match(path).groups() if group) for path in paths]
+
+
+def write_copy_csv(buffer, locations, source, query, columns):
+    '''
+        Write the rows a Redshift `COPY ... FORMAT AS JSON` would load from `source` as CSV (`\\N` as NULL).
+
+        - `'auto'` matches the JSON keys to the column names (ignoring case), otherwise the jsonpaths file lists them in column order.
+        - `TIMEFORMAT 'epochmillisecs'` turns the epoch milliseconds of the timestamp columns into timestamps.
+        - `BLANKSASNULL`/`EMPTYASNULL`: blank strings become NULL.
+
+        Returns the number of rows written.
+    '''
+    # like S3, `source` can be any prefix of the keys under a location, e.g. one day of `log_data`
+    location = next((location for location in locations if source == location or source.startswith(location + '/')), None)
+    if location is None:
+        raise ValueError('No local copy of {} in the [LOCAL] section of dwh.cfg'.format(source))
+    root = locations[location]
+    paths = [path for path in sorted(glob.glob(os.path.join(root, '**', '*.json'), recursive=True))
+             if os.path.relpath(path, root).replace(os.sep, '/').startswith(source[len(location) + 1:])]
+    if not paths:
+        raise ValueError("The specified S3 prefix '{}' does not exist".format(source))
+    types = [data_type.lower() for name, data_type in columns]
+    epochmillis = 'epochmillisecs' in query.lower()
+
+    # JSON key of every column: from the jsonpaths file, or the column name itself with 'auto'
+    keys = None
+    jsonpaths = JSON_PATTERN.search(query).group(1)
+    if jsonpaths.lower() != 'auto':
+        keys = read_jsonpaths(locations.get(jsonpaths, jsonpaths))
+
+    writer = csv.writer(buffer)
+    count = 0
+    for path in paths:
+        with open(path, encoding='utf8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if keys is None:
+                    lowered = {key.lower(): value for key, value in record.items()}
+                    values = [lowered.get(name.lower()) for name, data_type in columns]
+                else:
+                    values = [record.get(key) for key in keys]
+
+                row = []
+                for data_type, value in zip(types, values):
+                    if value is None or (isinstance(value, str) and not value.strip()):
+                        value = '\\N'
+                    elif data_type.startswith('timestamp') and epochmillis:
+                        value = datetime.fromtimestamp(value / 1000.0, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+                    elif data_type in INTEGER_TYPES and isinstance(value, float):
+                        # e.g. 'registration' is a float in the JSON files
+                        value = int(value)
+                    row.append(value)
+                writer.writerow(row)
+                count += 1
+
+    return count
+
+
+class StandinCursor:
+    '''
+        Cursor running the Redshift statements on a local PostgreSQL database.
+
+        - DDL and queries are translated with `translate`.
+        - `COPY ... FROM 's3://...'` is emulated from the local files of the `[LOCAL]` section of `dwh.cfg`:
+          `FORMAT AS JSON 'auto'` (keys matched to the column names, ignoring case) or a jsonpaths file,
+          `TIMEFORMAT 'epochmillisecs'`, `BLANKSASNULL` and `EMPTYASNULL`.
+        - `pg_last_copy_count()` returns the row count of the last emulated COPY.
+    '''
+    def __init__(self, cursor, locations):
+        self._cursor = cursor
+        self._locations = locations
+        self.last_copy_count = 0
+
+    def execute(self, query, vars=None):
+        match = COPY_PATTERN.match(query)
+        if match:
+            return self.copy(match.group(1), match.group(2), query)
+        if 'pg_last_copy_count()' in query:
+            return self._cursor.execute('SELECT %s;', (self.last_copy_count,))
+        return self._cursor.execute(translate(query), vars)
+
+    def columns(self, table):
+        self._cursor.execute("SELECT column_name, data_type FROM information_schema.columns "
+                             "WHERE table_name = %s ORDER BY ordinal_position;", (table,))
+        return self._cursor.fetchall()
+
+    def copy(self, table, source, query):
+        '''
+            Emulate a Redshift COPY of JSON files into `table` with `COPY ... FROM STDIN`.
+        '''
+        columns = self.columns(table)
+        buffer = io.StringIO()
+        count = write_copy_csv(buffer, self._locations, source, query, columns)
+
+        buffer.seek(0)
+        self._cursor.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(
+            table, ', '.join(name for name, data_type in columns)), buffer)
+        self.last_copy_count = count
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+
+class StandinConnection:
+    '''
+        Connection to the local PostgreSQL stand-in, handing out `StandinCursor`s.
+    '''
+    def __init__(self, conn, locations):
+        self._conn = conn
+        self._locations = locations
+
+    def cursor(self):
+        return StandinCursor(self._conn.cursor(), self._locations)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def local_locations(config):
+    '''
+        Map the S3 locations of the `[S3]` section of `dwh.cfg` to the local paths of the `[LOCAL]` section with the same keys.
+    '''
+    local = config['LOCAL']
+    return {value.strip("'"): local[key] for key, value in config['S3'].items() if key in local}
+
+
+def connect(config):
+    '''
+        Connect to the local PostgreSQL stand-in described by the `[LOCAL]` section of `dwh.cfg`.
+    '''
+    local = config['LOCAL']
+    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(
+        local['HOST'], local['DB_NAME'], local['DB_USER'], local['DB_PASSWORD'], local['DB_PORT']))
+    return StandinConnection(conn, local_locations(config))
@@ -0,0 +1,94 @@
+# Import all the necessary packages
+import argparse
+import configparser
+
+from sql_queries import rollup_check_queries, rollup_clear_queries, plays_per_day_select, top_songs_select, top_artists_select
+from etl import connect, update_rollups
+
+
+def check_rollups(cur):
+    '''
+        Compare every rollup table with the same aggregate recomputed from `fact_songplay`.
+        Returns the number of differing rows per rollup table (0 when consistent).
+    '''
+    mismatches = {}
+    for table, query in rollup_check_queries.items():
+        cur.execute(query)
+        mismatches[table] = cur.fetchone()[0]
+    return mismatches
+
+
+def rebuild_rollups(cur, conn):
+    '''
+        Empty the rollup tables and recompute them from all of `fact_songplay`, in one transaction.
+    '''
+    try:
+        for query in rollup_clear_queries:
+            cur.execute(query)
+        update_rollups(cur, conn)
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def print_report(cur, top=10):
+    '''
+        Print the plays per day and level, and the `top` songs and artists, from the rollup tables.
+    '''
+    cur.execute(plays_per_day_select)
+    for day, level, plays in cur.fetchall():
+        print('{:%Y-%m-%d} {:<8} {:>8} plays'.format(day, level, plays))
+
+    for title, query in (('songs', top_songs_select), ('artists', top_artists_select)):
+        print('Top {} {}:'.format(top, title))
+        cur.execute(query.format(int(top)))
+        for key, name, plays in cur.fetchall():
+            print('    {:>8} {} ({})'.format(plays, name, key))
+
+
+def parse_args(argv=None):
+    '''
+        Parse the command line options.
+    '''
+    parser = argparse.ArgumentParser(description='Maintain and check the songplay rollup tables.')
+    parser.add_argument('--update', action='store_true', help='Add the songplays not counted yet to the rollups.')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute the rollups from all of `fact_songplay`.')
+    parser.add_argument('--check', action='store_true', help='Compare the rollups with the aggregates of `fact_songplay`.')
+    parser.add_argument('--report', action='store_true', help='Print plays per day and the top songs and artists.')
+    parser.add_argument('--top', type=int, default=10, metavar='N', help='Number of songs/artists in the report (default: 10).')
+    parser.add_argument('--local', action='store_true', help='Run against the local PostgreSQL stand-in.')
+    parser.add_argument('--embedded', action='store_true', help='Run against the embedded DuckDB engine.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    '''
+        Update or rebuild the rollups, print the reports, and check the rollups against `fact_songplay`
+        (exits with an error if they differ).
+    '''
+    args = parse_args(argv)
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    conn = connect(config, args.local, args.embedded)
+    cur = conn.cursor()
+
+    if args.rebuild:
+        rebuild_rollups(cur, conn)
+    elif args.update:
+        update_rollups(cur, conn)
+    if args.report:
+        print_report(cur, args.top)
+    mismatches = check_rollups(cur) if args.check else {}
+
+    conn.close()
+
+    for table, count in mismatches.items():
+        print('{}: {}'.format(table, 'consistent' if count == 0 else '{} rows differ'.format(count)))
+    if any(mismatches.values()):
+        raise SystemExit(1)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Import all the necessary packages
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from metrics import InstrumentedCursor
+
+
+def check_dag(dag):
+    '''
+        Make sure every dependency of the DAG exists and that there is no cycle.
+    '''
+    for name, (query, deps) in dag.items():
+        for dep in deps:
+            if dep not in dag:
+                raise ValueError('{} depends on unknown statement {}'.format(name, dep))
+
+    done, pending = set(), dict(dag)
+    while pending:
+        ready = [name for name, (query, deps) in pending.items() if done.issuperset(deps)]
+        if not ready:
+            raise ValueError('Cycle between the statements {}'.format(', '.join(sorted(pending))))
+        for name in ready:
+            done.add(name)
+            del pending[name]
+
+
+class ConnectionPool:
+    '''
+        Fixed set of `size` connections opened with `connect`, borrowed by one statement at a time.
+    '''
+    def __init__(self, connect, size):
+        self._connections = queue.Queue()
+        for _ in range(size):
+            self._connections.put(connect())
+
+    def getconn(self):
+        return self._connections.get()
+
+    def putconn(self, conn):
+        self._connections.put(conn)
+
+    def closeall(self):
+        while not self._connections.empty():
+            self._connections.get().close()
+
+
+def run_statement(pool, name, query, start, metrics=None):
+    '''
+        Run one statement on a pooled connection and commit it.
+        Returns its `(start, end)` offsets in seconds from `start`.
+    '''
+    conn = pool.getconn()
+    try:
+        began = time.perf_counter() - start
+        cur = conn.cursor()
+        if metrics is not None:
+            cur = InstrumentedCursor(cur, metrics)
+        cur.execute(query)
+        if metrics is not None and name.endswith('_copy'):
+            # COPY does not report its row count through the cursor
+            cur.execute("SELECT pg_last_copy_count();")
+            metrics.count('rows_copied', cur.fetchone()[0])
+        conn.commit()
+        return began, time.perf_counter() - start
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def run_dag(dag, connect, workers=4, metrics=None):
+    '''
+        Run the statements of `dag` (see `etl_dag` in `sql_queries.py`) on `workers` pooled connections.
+
+        - A statement starts as soon as all its dependencies are committed, so independent statements run concurrently.
+        - When a statement fails, the statements depending on it (directly or not) are skipped, the others go on.
+
+        Returns one report entry per statement: `name`, `status` (ok, failed or skipped), `start`, `end` and `seconds`.
+    '''
+    check_dag(dag)
+    pool = ConnectionPool(connect, workers)
+    start = time.perf_counter()
+    report, running = {}, {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(report) < len(dag):
+            for name, (query, deps) in dag.items():
+                if name in report or name in running:
+                    continue
+                if any(report.get(dep, {}).get('status') in ('failed', 'skipped') for dep in deps):
+                    report[name] = {'name': name, 'status': 'skipped', 'start': None, 'end': None, 'seconds': None}
+                elif all(report.get(dep, {}).get('status') == 'ok' for dep in deps):
+                    running[name] = executor.submit(run_statement, pool, name, query, start, metrics)
+
+            if not running:
+                continue
+
+            finished, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for name, future in list(running.items()):
+                if future not in finished:
+                    continue
+                del running[name]
+                try:
+                    began, ended = future.result()
+                except Exception as e:
+                    report[name] = {'name': name, 'status': 'failed', 'start': None, 'end': None, 'seconds': None, 'error': str(e)}
+                    print('{} failed: {}'.format(name, e))
+                else:
+                    report[name] = {'name': name, 'status': 'ok', 'start': round(began, 3), 'end': round(ended, 3),
+                                    'seconds': round(ended - began, 3)}
+
+    pool.closeall()
+    wall = time.perf_counter() - start
+
+    entries = sorted(report.values(), key=lambda entry: (entry['start'] is None, entry['start'] or 0.0))
+    print_report(entries, wall)
+    return entries
+
+
+def print_report(entries, wall):
+    '''
+        Print the per-statement timing report of `run_dag`.
+    '''
+    print('{:<24} {:>8} {:>8} {:>8}  {}'.format('statement', 'start', 'end', 'seconds', 'status'))
+    for entry in entries:
+        if entry['status'] == 'ok':
+            print('{name:<24} {start:>8.3f} {end:>8.3f} {seconds:>8.3f}  {status}'.format(**entry))
+        else:
+            print('{:<24} {:>8} {:>8} {:>8}  {}'.format(entry['name'], '-', '-', '-', entry['status']))
+
+    serial = sum(entry['seconds'] or 0.0 for entry in entries)
+    print('Wall time {:.3f}s for {:.3f}s of statements ({:.2f}x).'.format(wall, serial, serial / wall if wall else 0.0))
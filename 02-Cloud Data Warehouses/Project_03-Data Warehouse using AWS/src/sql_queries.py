@@ -16,6 +16,12 @@ user_table_drop = "DROP TABLE IF EXISTS dim_user"
 song_table_drop = "DROP TABLE IF EXISTS dim_song"
 artist_table_drop = "DROP TABLE IF EXISTS dim_artist"
 time_table_drop = "DROP TABLE IF EXISTS dim_time"
+watermark_table_drop = "DROP TABLE IF EXISTS etl_watermark"
+staging_events_keyed_table_drop = "DROP TABLE IF EXISTS staging_events_keyed"
+staging_songs_keyed_table_drop = "DROP TABLE IF EXISTS staging_songs_keyed"
+hour_rollup_table_drop = "DROP TABLE IF EXISTS songplay_hour_rollup"
+song_rollup_table_drop = "DROP TABLE IF EXISTS songplay_song_rollup"
+artist_rollup_table_drop = "DROP TABLE IF EXISTS songplay_artist_rollup"
 
 
 # CREATE TABLES
@@ -71,6 +77,27 @@ CREATE TABLE IF NOT EXISTS staging_songs (
     year INT);
 """)
 
+# Keyed copies of the staging tables for the songplay join: a song is matched on the MD5 of its normalized
+# title, artist name and duration (see `MATCH_KEY`) instead of two wide VARCHAR columns, and both tables are
+# distributed on that key so the join needs no redistribution.
+staging_events_keyed_table_create = ("""
+CREATE TABLE IF NOT EXISTS staging_events_keyed (
+    match_key VARCHAR(32) distkey, 
+    ts TIMESTAMP sortkey, 
+    userId INT, 
+    level VARCHAR, 
+    sessionId INT, 
+    location VARCHAR, 
+    userAgent VARCHAR);
+""")
+
+staging_songs_keyed_table_create = ("""
+CREATE TABLE IF NOT EXISTS staging_songs_keyed (
+    match_key VARCHAR(32) distkey, 
+    song_id VARCHAR, 
+    artist_id VARCHAR);
+""")
+
 # `SERIAL` alternative for Amazon Redshift: `IDENTITY(0, 1)` from https://docs.aws.amazon.com/redshift/latest/dg/r_CREATE_TABLE_NEW.html
 songplay_table_create = ("""
 CREATE TABLE IF NOT EXISTS fact_songplay (
@@ -124,6 +151,39 @@ CREATE TABLE IF NOT EXISTS dim_time (
 """)
 
 
+# High-water mark of the incremental loads (`etl.py --incremental`): latest `staging_events.ts` merged into the star schema.
+watermark_table_create = ("""
+CREATE TABLE IF NOT EXISTS etl_watermark (
+    source VARCHAR PRIMARY KEY, 
+    high_water TIMESTAMP NOT NULL, 
+    updated_at TIMESTAMP);
+""")
+
+
+# Rollup tables: plays per hour and level, per song and per artist, for the dashboards (per day/week plays are
+# sums of the hourly rows). Updated with the songplays newer than their own high-water mark (source 'rollups'
+# of `etl_watermark`), see the ROLLUPS section below.
+hour_rollup_table_create = ("""
+CREATE TABLE IF NOT EXISTS songplay_hour_rollup (
+    start_hour TIMESTAMP NOT NULL sortkey, 
+    level VARCHAR NOT NULL, 
+    plays BIGINT NOT NULL);
+""")
+
+song_rollup_table_create = ("""
+CREATE TABLE IF NOT EXISTS songplay_song_rollup (
+    song_id VARCHAR NOT NULL, 
+    artist_id VARCHAR, 
+    plays BIGINT NOT NULL);
+""")
+
+artist_rollup_table_create = ("""
+CREATE TABLE IF NOT EXISTS songplay_artist_rollup (
+    artist_id VARCHAR NOT NULL, 
+    plays BIGINT NOT NULL);
+""")
+
+
 # STAGING TABLES (Ingest data at "scale" using COPY)
 # Useful resources: 
     # https://knowledge.udacity.com/questions/98859
@@ -132,20 +192,23 @@ CREATE TABLE IF NOT EXISTS dim_time (
 
 # Event data location: s3://udacity-dend/log_data
 # File for 'mapping' Event data: s3://udacity-dend/log_json_path.json
-staging_events_copy = ("""
+# `staging_events_copy_from` takes the S3 location to load, e.g. one day of `log_data` for an incremental load
+# (the log files are partitioned by date: log_data/2018/11/2018-11-05-events.json).
+staging_events_copy_from = ("""
 COPY staging_events
-    FROM {}
+    FROM {{}}
     CREDENTIALS 'aws_iam_role={}'
     COMPUPDATE OFF region 'us-west-2'
     TIMEFORMAT as 'epochmillisecs'
     TRUNCATECOLUMNS BLANKSASNULL EMPTYASNULL
     FORMAT AS JSON {};
 """).format(
-    config.get('S3', 'LOG_DATA'), 
     config.get('IAM_ROLE', 'ARN'), 
     config.get('S3', 'LOG_JSONPATH')
 )
 
+staging_events_copy = staging_events_copy_from.format(config.get('S3', 'LOG_DATA'))
+
 # Song data location: s3://udacity-dend/song_data
 staging_songs_copy = ("""
 COPY staging_songs
@@ -160,11 +223,35 @@ COPY staging_songs
 )
 
 
+# MATCH KEYS
+# Events and songs are matched on the title, the artist name (trimmed, case-insensitive) and the duration
+# (rounded to 1/100 s, `length` of the events). NULL in any of them gives a NULL key, which matches nothing.
+MATCH_KEY = "MD5(LOWER(TRIM({title})) || '|' || LOWER(TRIM({artist})) || '|' || CAST(CAST({duration} AS DECIMAL(10, 2)) AS VARCHAR))"
+
+# The keyed tables are rebuilt from the staging tables on every load
+staging_events_keyed_truncate = "TRUNCATE staging_events_keyed"
+staging_songs_keyed_truncate = "TRUNCATE staging_songs_keyed"
+
+staging_events_match_key = ("""
+    INSERT INTO staging_events_keyed (match_key, ts, userId, level, sessionId, location, userAgent)
+    SELECT {}, ts, userId, level, sessionId, location, userAgent
+    FROM staging_events
+    WHERE song IS NOT NULL;
+""").format(MATCH_KEY.format(title='song', artist='artist', duration='length'))
+
+staging_songs_match_key = ("""
+    INSERT INTO staging_songs_keyed (match_key, song_id, artist_id)
+    SELECT {}, song_id, artist_id
+    FROM staging_songs
+    WHERE song_id IS NOT NULL;
+""").format(MATCH_KEY.format(title='title', artist='artist_name', duration='duration'))
+
+
 # FINAL TABLES
-# Useful resource: postgresqltutorial.com/postgresql-string-functions/postgresql-to_char/
+# `ts` is already a TIMESTAMP (COPY with `TIMEFORMAT as 'epochmillisecs'`), no conversion needed.
 songplay_table_insert = ("""
     INSERT INTO fact_songplay (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
-    SELECT TO_TIMESTAMP(TO_CHAR(se.ts, '9999-99-99 99:99:99'), 'YYYY-MM-DD HH24:MI:SS'), 
+    SELECT se.ts as start_time, 
                 se.userId as user_id, 
                 se.level as level, 
                 ss.song_id as song_id, 
@@ -172,8 +259,8 @@ songplay_table_insert = ("""
                 se.sessionId as session_id, 
                 se.location as location, 
                 se.userAgent as user_agent
-    FROM staging_events se
-    JOIN staging_songs ss ON se.song=ss.title AND se.artist=ss.artist_name;
+    FROM staging_events_keyed se
+    JOIN staging_songs_keyed ss ON se.match_key = ss.match_key;
 """)
 
 user_table_insert = ("""
@@ -184,7 +271,7 @@ user_table_insert = ("""
         gender AS gender, 
         level AS level
     FROM staging_events
-    WHERE user_id IS NOT NULL;
+    WHERE userId IS NOT NULL;
 """)
 
 song_table_insert = ("""
@@ -223,11 +310,333 @@ time_table_insert = ("""
 """)
 
 
+# INCREMENTAL LOAD
+# Only the days of `log_data` from the high-water mark on are copied (see `etl.log_data_prefixes`), the events
+# not newer than the mark are trimmed, then every table is merged with delete-then-insert by key in one transaction
+# (Redshift has no MERGE/UPSERT and does not enforce primary keys), so the cost of a nightly load scales with the
+# new data instead of the whole history. `song_data` is not partitioned by date: the catalog is staged again
+# (the songplays are matched against it), but only the songs and artists that are new or changed are written.
+# NOTE: `TRUNCATE` commits implicitly on Redshift, so it only runs in the staging step.
+staging_events_truncate = "TRUNCATE staging_events"
+staging_songs_truncate = "TRUNCATE staging_songs"
+
+staging_events_trim = ("""
+    DELETE FROM staging_events
+    WHERE ts <= (SELECT high_water FROM etl_watermark WHERE source = 'staging_events');
+""")
+
+# Null-safe digest of the columns of a row, to find the staged songs and artists that differ from the dimension
+def row_digest(alias, columns):
+    return 'MD5({})'.format(" || '|' || ".join("COALESCE(CAST({}.{} AS VARCHAR), '')".format(alias, column) for column in columns))
+
+# One staged row per song and per artist
+latest_staged_songs = ("""
+    SELECT song_id, title, artist_id, year, duration
+    FROM (SELECT song_id, title, artist_id, year, duration,
+              ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY title) AS rn
+          FROM staging_songs
+          WHERE song_id IS NOT NULL) latest
+    WHERE rn = 1""")
+
+latest_staged_artists = ("""
+    SELECT artist_id, name, location, latitude, longitude
+    FROM (SELECT artist_id, artist_name AS name, artist_location AS location,
+              artist_latitude AS latitude, artist_longitude AS longitude,
+              ROW_NUMBER() OVER (PARTITION BY artist_id ORDER BY artist_latitude, artist_location) AS rn
+          FROM staging_songs
+          WHERE artist_id IS NOT NULL) latest
+    WHERE rn = 1""")
+
+SONG_COLUMNS = ['title', 'artist_id', 'year', 'duration']
+ARTIST_COLUMNS = ['name', 'location', 'latitude', 'longitude']
+
+# Only the songs and artists whose attributes changed are deleted, then the ones missing (new or changed) inserted:
+# a catalog staged again without changes writes nothing.
+song_table_merge_delete = ("""
+    DELETE FROM dim_song
+    WHERE song_id IN (SELECT ss.song_id
+                      FROM ({}) ss
+                      JOIN dim_song s ON s.song_id = ss.song_id
+                      WHERE {} <> {});
+""").format(latest_staged_songs, row_digest('s', SONG_COLUMNS), row_digest('ss', SONG_COLUMNS))
+
+song_table_merge_insert = ("""
+    INSERT INTO dim_song (song_id, title, artist_id, year, duration)
+    SELECT ss.song_id, ss.title, ss.artist_id, ss.year, ss.duration
+    FROM ({}) ss
+    WHERE NOT EXISTS (SELECT 1 FROM dim_song s WHERE s.song_id = ss.song_id);
+""").format(latest_staged_songs)
+
+artist_table_merge_delete = ("""
+    DELETE FROM dim_artist
+    WHERE artist_id IN (SELECT sa.artist_id
+                        FROM ({}) sa
+                        JOIN dim_artist a ON a.artist_id = sa.artist_id
+                        WHERE {} <> {});
+""").format(latest_staged_artists, row_digest('a', ARTIST_COLUMNS), row_digest('sa', ARTIST_COLUMNS))
+
+artist_table_merge_insert = ("""
+    INSERT INTO dim_artist (artist_id, name, location, latitude, longitude)
+    SELECT sa.artist_id, sa.name, sa.location, sa.latitude, sa.longitude
+    FROM ({}) sa
+    WHERE NOT EXISTS (SELECT 1 FROM dim_artist a WHERE a.artist_id = sa.artist_id);
+""").format(latest_staged_artists)
+
+# One row per user, with the level of their latest event (instead of one row per distinct level)
+user_table_merge_delete = ("""
+    DELETE FROM dim_user
+    USING staging_events se
+    WHERE dim_user.user_id = se.userId;
+""")
+
+user_table_merge_insert = ("""
+    INSERT INTO dim_user (user_id, first_name, last_name, gender, level)
+    SELECT user_id, first_name, last_name, gender, level
+    FROM (SELECT userId AS user_id, firstName AS first_name, lastName AS last_name, gender, level,
+              ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) AS rn
+          FROM staging_events
+          WHERE userId IS NOT NULL) latest
+    WHERE rn = 1;
+""")
+
+time_table_merge_delete = ("""
+    DELETE FROM dim_time
+    USING staging_events se
+    WHERE dim_time.start_time = se.ts;
+""")
+
+time_table_merge_insert = ("""
+    INSERT INTO dim_time (start_time, hour, day, week, month, year, weekday)
+    SELECT DISTINCT ts, 
+        EXTRACT(hour FROM ts),
+        EXTRACT(day FROM ts),
+        EXTRACT(week FROM ts),
+        EXTRACT(month FROM ts),
+        EXTRACT(year FROM ts),
+        EXTRACT(weekday from ts)
+    FROM staging_events
+    WHERE ts IS NOT NULL;
+""")
+
+# A songplay is identified by its start time, user and session. The songs are resolved on the match keys,
+# as in the full load (`songplay_table_insert`): both loads give the same song and artist to the same event.
+songplay_table_merge_delete = ("""
+    DELETE FROM fact_songplay
+    USING staging_events se
+    WHERE fact_songplay.start_time = se.ts
+        AND fact_songplay.user_id = se.userId
+        AND fact_songplay.session_id = se.sessionId;
+""")
+
+songplay_table_merge_insert = ("""
+    INSERT INTO fact_songplay (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+    SELECT se.ts AS start_time, 
+                se.userId as user_id, 
+                se.level as level, 
+                ss.song_id as song_id, 
+                ss.artist_id as artist_id, 
+                se.sessionId as session_id, 
+                se.location as location, 
+                se.userAgent as user_agent
+    FROM staging_events_keyed se
+    JOIN staging_songs_keyed ss ON se.match_key = ss.match_key;
+""")
+
+watermark_update = ("""
+    UPDATE etl_watermark
+    SET high_water = (SELECT MAX(ts) FROM staging_events), updated_at = GETDATE()
+    WHERE source = 'staging_events' AND EXISTS (SELECT 1 FROM staging_events);
+""")
+
+watermark_insert = ("""
+    INSERT INTO etl_watermark (source, high_water, updated_at)
+    SELECT 'staging_events', MAX(ts), GETDATE()
+    FROM staging_events
+    WHERE NOT EXISTS (SELECT 1 FROM etl_watermark WHERE source = 'staging_events')
+    HAVING MAX(ts) IS NOT NULL;
+""")
+
+watermark_select = "SELECT high_water FROM etl_watermark WHERE source = 'staging_events';"
+
+
+# ROLLUPS
+# The songplays not counted yet are the ones after the 'rollups' high-water mark: both the full load and the
+# incremental merge only add songplays newer than what was loaded before, and songplays merged again
+# (same start time) stay below the mark, so they are not counted twice.
+# Redshift has no upsert: the counts of the existing keys are updated first, then the new keys are inserted.
+ROLLUP_NEW_SONGPLAYS = "start_time > COALESCE((SELECT high_water FROM etl_watermark WHERE source = 'rollups'), CAST('1900-01-01' AS TIMESTAMP))"
+
+# Aggregates of the songplays matching `{where}`, as the rollup tables store them
+hour_rollup_select = ("""
+    SELECT DATE_TRUNC('hour', start_time) AS start_hour, COALESCE(level, 'unknown') AS level, COUNT(*) AS plays
+    FROM fact_songplay
+    WHERE {where}
+    GROUP BY 1, 2
+""")
+
+song_rollup_select = ("""
+    SELECT song_id, MAX(artist_id) AS artist_id, COUNT(*) AS plays
+    FROM fact_songplay
+    WHERE {where} AND song_id IS NOT NULL
+    GROUP BY song_id
+""")
+
+artist_rollup_select = ("""
+    SELECT artist_id, COUNT(*) AS plays
+    FROM fact_songplay
+    WHERE {where} AND artist_id IS NOT NULL
+    GROUP BY artist_id
+""")
+
+hour_rollup_update = ("""
+    UPDATE songplay_hour_rollup
+    SET plays = songplay_hour_rollup.plays + d.plays
+    FROM ({}) d
+    WHERE songplay_hour_rollup.start_hour = d.start_hour AND songplay_hour_rollup.level = d.level;
+""").format(hour_rollup_select.format(where=ROLLUP_NEW_SONGPLAYS))
+
+hour_rollup_insert = ("""
+    INSERT INTO songplay_hour_rollup (start_hour, level, plays)
+    SELECT d.start_hour, d.level, d.plays
+    FROM ({}) d
+    WHERE NOT EXISTS (SELECT 1 FROM songplay_hour_rollup r WHERE r.start_hour = d.start_hour AND r.level = d.level);
+""").format(hour_rollup_select.format(where=ROLLUP_NEW_SONGPLAYS))
+
+song_rollup_update = ("""
+    UPDATE songplay_song_rollup
+    SET plays = songplay_song_rollup.plays + d.plays
+    FROM ({}) d
+    WHERE songplay_song_rollup.song_id = d.song_id;
+""").format(song_rollup_select.format(where=ROLLUP_NEW_SONGPLAYS))
+
+song_rollup_insert = ("""
+    INSERT INTO songplay_song_rollup (song_id, artist_id, plays)
+    SELECT d.song_id, d.artist_id, d.plays
+    FROM ({}) d
+    WHERE NOT EXISTS (SELECT 1 FROM songplay_song_rollup r WHERE r.song_id = d.song_id);
+""").format(song_rollup_select.format(where=ROLLUP_NEW_SONGPLAYS))
+
+artist_rollup_update = ("""
+    UPDATE songplay_artist_rollup
+    SET plays = songplay_artist_rollup.plays + d.plays
+    FROM ({}) d
+    WHERE songplay_artist_rollup.artist_id = d.artist_id;
+""").format(artist_rollup_select.format(where=ROLLUP_NEW_SONGPLAYS))
+
+artist_rollup_insert = ("""
+    INSERT INTO songplay_artist_rollup (artist_id, plays)
+    SELECT d.artist_id, d.plays
+    FROM ({}) d
+    WHERE NOT EXISTS (SELECT 1 FROM songplay_artist_rollup r WHERE r.artist_id = d.artist_id);
+""").format(artist_rollup_select.format(where=ROLLUP_NEW_SONGPLAYS))
+
+rollup_watermark_update = ("""
+    UPDATE etl_watermark
+    SET high_water = (SELECT MAX(start_time) FROM fact_songplay), updated_at = GETDATE()
+    WHERE source = 'rollups' AND EXISTS (SELECT 1 FROM fact_songplay);
+""")
+
+rollup_watermark_insert = ("""
+    INSERT INTO etl_watermark (source, high_water, updated_at)
+    SELECT 'rollups', MAX(start_time), GETDATE()
+    FROM fact_songplay
+    WHERE NOT EXISTS (SELECT 1 FROM etl_watermark WHERE source = 'rollups')
+    HAVING MAX(start_time) IS NOT NULL;
+""")
+
+# Consistency checks: number of rows differing between a rollup table and the same aggregate recomputed
+# from `fact_songplay` (up to the 'rollups' high-water mark), in either direction.
+rollup_check = ("""
+    SELECT COUNT(*) FROM (
+        (SELECT {columns} FROM {table} EXCEPT {select})
+        UNION ALL
+        ({select} EXCEPT SELECT {columns} FROM {table})
+    ) diff;
+""")
+
+ROLLUP_COUNTED_SONGPLAYS = "start_time <= (SELECT high_water FROM etl_watermark WHERE source = 'rollups')"
+
+hour_rollup_check = rollup_check.format(table='songplay_hour_rollup', columns='start_hour, level, plays',
+                                        select=hour_rollup_select.format(where=ROLLUP_COUNTED_SONGPLAYS))
+song_rollup_check = rollup_check.format(table='songplay_song_rollup', columns='song_id, artist_id, plays',
+                                        select=song_rollup_select.format(where=ROLLUP_COUNTED_SONGPLAYS))
+artist_rollup_check = rollup_check.format(table='songplay_artist_rollup', columns='artist_id, plays',
+                                          select=artist_rollup_select.format(where=ROLLUP_COUNTED_SONGPLAYS))
+
+# DELETE rather than TRUNCATE, which commits implicitly on Redshift
+rollup_clear_queries = ["DELETE FROM songplay_hour_rollup", "DELETE FROM songplay_song_rollup",
+                        "DELETE FROM songplay_artist_rollup", "DELETE FROM etl_watermark WHERE source = 'rollups'"]
+
+# Reports read from the rollups
+plays_per_day_select = ("""
+    SELECT DATE_TRUNC('day', start_hour) AS day, level, SUM(plays) AS plays
+    FROM songplay_hour_rollup
+    GROUP BY 1, 2
+    ORDER BY 1, 2;
+""")
+
+top_songs_select = ("""
+    SELECT r.song_id, s.title, r.plays
+    FROM songplay_song_rollup r
+    LEFT JOIN dim_song s ON s.song_id = r.song_id
+    ORDER BY r.plays DESC, r.song_id
+    LIMIT {};
+""")
+
+top_artists_select = ("""
+    SELECT r.artist_id, a.name, r.plays
+    FROM songplay_artist_rollup r
+    LEFT JOIN dim_artist a ON a.artist_id = r.artist_id
+    ORDER BY r.plays DESC, r.artist_id
+    LIMIT {};
+""")
+
+
 # QUERY LISTS
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
+create_table_queries = [staging_events_table_create, staging_songs_table_create, staging_events_keyed_table_create, staging_songs_keyed_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, watermark_table_create,
+                        hour_rollup_table_create, song_rollup_table_create, artist_rollup_table_create]
 
-drop_table_queries   = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
+drop_table_queries   = [staging_events_table_drop, staging_songs_table_drop, staging_events_keyed_table_drop, staging_songs_keyed_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, watermark_table_drop,
+                        hour_rollup_table_drop, song_rollup_table_drop, artist_rollup_table_drop]
 
 copy_table_queries   = [staging_events_copy, staging_songs_copy]
 
-insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
\ No newline at end of file
+match_key_queries    = [staging_events_keyed_truncate, staging_songs_keyed_truncate, staging_events_match_key, staging_songs_match_key]
+
+insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+
+# The events are copied in between, one `staging_events_copy_from` per day since the high-water mark (see `etl.py`),
+# and the match keys are computed once the events already loaded are trimmed
+incremental_staging_queries = [staging_events_truncate, staging_songs_truncate, staging_songs_copy]
+
+incremental_keying_queries = [staging_events_trim] + match_key_queries
+
+# Run in this order, in one transaction: the dimensions first, since the songplays are resolved against them
+merge_table_queries = [song_table_merge_delete, song_table_merge_insert, artist_table_merge_delete, artist_table_merge_insert,
+                       user_table_merge_delete, user_table_merge_insert, time_table_merge_delete, time_table_merge_insert,
+                       songplay_table_merge_delete, songplay_table_merge_insert, watermark_update, watermark_insert]
+
+# Run in one transaction after the songplays are loaded (`insert_table_queries` or `merge_table_queries`)
+rollup_table_queries = [hour_rollup_update, hour_rollup_insert, song_rollup_update, song_rollup_insert,
+                        artist_rollup_update, artist_rollup_insert, rollup_watermark_update, rollup_watermark_insert]
+
+rollup_check_queries = {'songplay_hour_rollup': hour_rollup_check, 'songplay_song_rollup': song_rollup_check,
+                        'songplay_artist_rollup': artist_rollup_check}
+
+
+# DEPENDENCIES
+# Statements of `copy_table_queries` and `insert_table_queries` with the statements they have to wait for,
+# used by `scheduler.py` to run the independent ones concurrently (e.g. both COPYs, then the dimension inserts).
+etl_dag = {
+    'staging_events_copy': (staging_events_copy, []),
+    'staging_songs_copy': (staging_songs_copy, []),
+    'staging_events_keyed_truncate': (staging_events_keyed_truncate, []),
+    'staging_songs_keyed_truncate': (staging_songs_keyed_truncate, []),
+    'staging_events_match_key': (staging_events_match_key, ['staging_events_copy', 'staging_events_keyed_truncate']),
+    'staging_songs_match_key': (staging_songs_match_key, ['staging_songs_copy', 'staging_songs_keyed_truncate']),
+    'songplay_table_insert': (songplay_table_insert, ['staging_events_match_key', 'staging_songs_match_key']),
+    'user_table_insert': (user_table_insert, ['staging_events_copy']),
+    'song_table_insert': (song_table_insert, ['staging_songs_copy']),
+    'artist_table_insert': (artist_table_insert, ['staging_songs_copy']),
+    'time_table_insert': (time_table_insert, ['staging_events_copy']),
+}